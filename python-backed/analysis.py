@@ -0,0 +1,110 @@
+import uuid
+import logging
+from cache import TTLCache
+from config import DETECTION_CACHE_SIZE, DETECTION_TTL
+
+logger = logging.getLogger(__name__)
+
+# Ostatnie detekcje /analyze (bile + kontekst stołu) - poprawki klienta odnoszą się do detection_id
+detections = TTLCache(maxsize=DETECTION_CACHE_SIZE, ttl=DETECTION_TTL, sliding=True)
+
+BALL_FIELDS = ("x", "y", "r", "class", "confidence")
+NUMERIC_FIELDS = ("x", "y", "r", "confidence")
+
+def split_cue_ball(balls, cue_color):
+    """
+    Dzieli bile na bilę rozgrywającą (pierwsza w kolorze cue_color) i pozostałe.
+    Pomija wpisy niebędące dict i bile z klasą "ignore"; promień normalizowany do int (domyślnie 15).
+    Zwraca (cue_ball lub None, other_balls).
+    """
+    cue_ball = None
+    other_balls = []
+    for b in balls:
+        if not isinstance(b, dict):
+            continue
+        if b.get('class', '').lower() == 'ignore':
+            continue
+        b['r'] = int(b.get('r', 15))
+        # Normalizacja klasy (może przychodzić "White"/"white")
+        cls = b.get('class', '')
+        cls_norm = cls.lower() if isinstance(cls, str) else ''
+        if cls_norm == cue_color and cue_ball is None:
+            cue_ball = b
+        else:
+            other_balls.append(b)
+    return cue_ball, other_balls
+
+def store_detection(balls, context, detection_id=None, next_id=None):
+    """
+    Zapisuje bile (z nadanymi "id") i kontekst (pockets, table_area, session_id, cue_ball_color...)
+    pod detection_id (nowym, jeśli nie podano). Zwraca (detection_id, balls).
+    """
+    balls = [dict(b, id=i) if 'id' not in b else dict(b) for i, b in enumerate(balls)]
+    if next_id is None:
+        next_id = max((b['id'] for b in balls), default=-1) + 1
+    detection_id = detection_id or uuid.uuid4().hex
+    detections.set(detection_id, {"balls": balls, "context": dict(context), "next_id": next_id})
+    return detection_id, balls
+
+def get_detection(detection_id):
+    """Zwraca {"balls", "context"} albo None (nieznana / wygasła detekcja)."""
+    if not detection_id:
+        return None
+    return detections.get(detection_id)
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _ball_id(value):
+    """id bili z poprawki - musi być liczbą całkowitą (np. lista z JSON dawałaby TypeError przy szukaniu)."""
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError(f"Niepoprawne id bili: {value!r}")
+    return value
+
+def _ball_fields(ball):
+    """Pola bili z poprawki (tylko BALL_FIELDS); x, y, r i confidence muszą być liczbami."""
+    fields = {k: ball[k] for k in BALL_FIELDS if k in ball}
+    for k in NUMERIC_FIELDS:
+        if k in fields and not _is_number(fields[k]):
+            raise ValueError(f"Pole {k} bili musi być liczbą")
+    return fields
+
+def apply_corrections(record, corrections):
+    """
+    Nakłada poprawki klienta na listę bil (nie modyfikuje wejścia):
+      {"update": [{"id": 3, "x": 120, "class": "Red"}, ...],   # tylko zmienione pola
+       "add":    [{"x": 300, "y": 200, "r": 14, "class": "Yellow"}, ...],
+       "remove": [5, 7]}
+    record - wpis z get_detection. Nowe bile dostają kolejne id (id usuniętych bil nie wracają).
+    Zwraca (balls, next_id). ValueError przy nieznanym id lub złym formacie.
+    """
+    if not isinstance(corrections, dict):
+        raise ValueError("corrections musi być obiektem JSON")
+    for key in ('update', 'add', 'remove'):
+        if not isinstance(corrections.get(key, []), list):
+            raise ValueError(f"corrections.{key} musi być listą")
+    by_id = {b['id']: dict(b) for b in record["balls"]}
+
+    for ball_id in corrections.get('remove', []):
+        if by_id.pop(_ball_id(ball_id), None) is None:
+            raise ValueError(f"Nieznane id bili: {ball_id}")
+
+    for change in corrections.get('update', []):
+        if not isinstance(change, dict):
+            raise ValueError(f"Niepoprawna poprawka bili: {change!r}")
+        ball_id = _ball_id(change.get('id'))
+        if ball_id not in by_id:
+            raise ValueError(f"Nieznane id bili: {ball_id}")
+        by_id[ball_id].update(_ball_fields(change))
+
+    next_id = record["next_id"]
+    for added in corrections.get('add', []):
+        if not isinstance(added, dict) or 'x' not in added or 'y' not in added:
+            raise ValueError("Dodawana bila musi mieć x i y")
+        ball = _ball_fields(added)
+        ball.setdefault('confidence', 1.0)
+        ball['id'] = next_id
+        by_id[next_id] = ball
+        next_id += 1
+
+    return sorted(by_id.values(), key=lambda b: b['id']), next_id
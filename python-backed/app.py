@@ -1,17 +1,252 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, request, jsonify, g, Response, current_app
+from flask_sock import Sock, ConnectionClosed
 import os
 import json
-from werkzeug.utils import secure_filename
-from config import logger, UPLOAD_FOLDER, allowed_file
-from image_processing import detect_all_balls
-from shot_calculation import find_best_shot
+import time
+import uuid
+import logging
+from config import (UPLOAD_FOLDER, MAX_CONTENT_LENGTH, PYRAMID_LEVELS, FLASK_DEBUG, SHOT_MAP_CELLS,
+                    LOG_FILE, WARM_UP, allowed_file, configure_logging)
+from image_processing import detect_all_balls, decode_image, effective_pyramid_levels, warm_up as warm_up_detector
+from calibration import create_session, get_session, sessions
+from tracking import get_tracker, trackers
+from workers import get_pool, pool_in_flight, PoolSaturated, PoolTimeout
+from metrics import REGISTRY, observe_request, register_gauge
+from timing import StageTimer
+from shot_calculation import SCORING_MODES, validate_shot_types, rank_shots
+from physics import simulation_options, simulate_best_variant
+from analysis import split_cue_ball, store_detection, get_detection, apply_corrections
+from result_cache import detection_params, cached_detect, cached_rank_shots, stats as cache_stats
+from stream import StreamAnalyzer, serve as serve_stream
+from shot_map import create_shot_map, get_shot_map, apply_moves
+from wire_format import JSON, PACKED, MSGPACK, FORMATS, available_formats, negotiate, encode, decode
 
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024  # 2 MB max
+logger = logging.getLogger(__name__)
+
+# Endpointy w blueprincie - aplikację tworzy create_app (serwery pre-fork: gunicorn "app:create_app()")
+api = Blueprint('api', __name__)
+sock = Sock()
+
+# Gdy wszystkie strzały są zablokowane, best_shot to najlepszy z nich (blocked=True, blocked_by)
+BLOCKED_MESSAGE = "Wszystkie strzały są zablokowane przez inne bile."
+
+register_gauge("billiards_detect_queue_depth", "Klatki w kolejce lub w trakcie detekcji w puli procesów.",
+               pool_in_flight)
+register_gauge("billiards_sessions", "Aktywne sesje kalibracyjne.", lambda: len(sessions))
+
+# Mały układ bil do rozgrzewki wyszukiwania strzałów i fizyki (stół 800 x 400)
+_WARM_UP_TABLE = [{"x": 0, "y": 0}, {"x": 800, "y": 0}, {"x": 800, "y": 400}, {"x": 0, "y": 400}]
+_WARM_UP_POCKETS = _WARM_UP_TABLE + [{"x": 400, "y": 0}, {"x": 400, "y": 400}]
+_WARM_UP_BALLS = [{"x": 200, "y": 200, "r": 11, "class": "White"}, {"x": 500, "y": 150, "r": 11, "class": "Red"},
+                  {"x": 600, "y": 300, "r": 11, "class": "Yellow"}, {"x": 300, "y": 320, "r": 11, "class": "Blue"}]
+
+def warm_up(pool=False):
+    """
+    Rozgrzewka przed pierwszym requestem: detektor bieżącego wątku (CLAHE, LUT, HoughCircles),
+    ranking strzałów (Monte Carlo, bank / kick / kombinacje) i symulacja fizyczna na małym układzie bil.
+    pool=True uruchamia też procesy puli detekcji - tylko po fork (np. hook post_fork gunicorna),
+    bo pula nie przechodzi przez fork.
+    """
+    start = time.perf_counter()
+    warm_up_detector()
+    cue_ball, other_balls = _WARM_UP_BALLS[0], _WARM_UP_BALLS[1:]
+    shots = rank_shots(cue_ball, other_balls, _WARM_UP_POCKETS, table_area=_WARM_UP_TABLE, top_k=3)
+    simulate_best_variant(cue_ball, other_balls, _WARM_UP_POCKETS, [sh for sh in shots if not sh["blocked"]],
+                          table_area=_WARM_UP_TABLE)
+    if pool and get_pool() is not None:
+        get_pool().warm_up()
+    logger.info(f"Rozgrzewka serwera: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+def create_app(config=None):
+    """
+    Fabryka aplikacji. Nic ciężkiego przy starcie (pula detekcji, sesje, cache - leniwie przy pierwszym
+    użyciu), chyba że WARM_UP - wtedy warm_up() od razu, przy --preload raz w procesie głównym.
+    config - opcjonalne nadpisania app.config (np. UPLOAD_FOLDER, LOG_FILE, WARM_UP).
+    """
+    app = Flask(__name__)
+    app.config.update(UPLOAD_FOLDER=UPLOAD_FOLDER, MAX_CONTENT_LENGTH=MAX_CONTENT_LENGTH, LOG_FILE=LOG_FILE,
+                      WARM_UP=WARM_UP)
+    app.config.update(config or {})
+    configure_logging(app.config['LOG_FILE'])
+    if app.config['UPLOAD_FOLDER']:
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    app.register_blueprint(api)
+    if app.config['WARM_UP']:
+        warm_up()
+    return app
+
+_default_app = None
+
+def __getattr__(name):
+    # "from app import app" / gunicorn "app:app" - domyślna aplikacja tworzona dopiero przy pierwszym odwołaniu
+    global _default_app
+    if name == 'app':
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+@api.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.timer = StageTimer()
+
+@api.after_app_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is not None and request.endpoint != 'api.metrics_endpoint':
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        observe_request(endpoint, response.status_code, time.perf_counter() - start, g.get('timer'))
+    return response
+
+def timings_requested(data=None):
+    """Czy klient prosi o rozbicie czasów w odpowiedzi (?timings=1, pole formularza lub JSON)."""
+    flag = request.args.get('timings') or request.form.get('timings')
+    if flag is None and isinstance(data, dict):
+        flag = data.get('timings')
+    return str(flag).lower() in ('1', 'true', 'yes')
+
+def respond(payload, data=None):
+    """
+    Odpowiedź w formacie z nagłówka Accept (JSON domyślnie, patrz wire_format.py)
+    + opcjonalne "timings" (ms per etap i razem) dla tego requestu.
+    """
+    if timings_requested(data):
+        stages = {name: round(ms, 3) for name, ms in g.timer.stages.items()}
+        stages["total"] = round((time.perf_counter() - g.request_start) * 1000.0, 3)
+        payload["timings"] = stages
+    media_type = negotiate(request.accept_mimetypes)
+    if media_type == JSON:
+        response = jsonify(payload)
+    else:
+        with g.timer.stage("encode"):
+            response = Response(encode(payload, media_type), mimetype=media_type)
+    response.vary.add('Accept')
+    return response
+
+def request_data():
+    """Body JSON requestu albo te same dane w formacie packed / msgpack (Content-Type). ValueError przy złych danych."""
+    if request.mimetype in (PACKED, MSGPACK):
+        return decode(request.get_data(), request.mimetype)
+    return request.get_json(silent=True)
+
+def parse_pyramid_levels(value):
+    """Poziom piramidy z requestu (0-4) lub None, jeśli nie podano. ValueError przy złej wartości."""
+    if value is None or value == '':
+        return None
+    levels = int(value)
+    if not 0 <= levels <= 4:
+        raise ValueError("pyramid_levels musi być w zakresie 0-4")
+    return levels
+
+def resolve_pyramid_levels(value, session=None):
+    """
+    Piramida: request > sesja > konfiguracja serwera. ValueError przy złej wartości.
+    Z sesją poziom jest od razu obniżany do faktycznie użytego przy jej szerokości widoku z góry
+    (effective_pyramid_levels), więc np. 0 i 1 dla sesji 800 px to ten sam wpis cache wyników.
+    Bez sesji szerokość znana jest dopiero po dekodowaniu - obniżenie robi sama detekcja.
+    """
+    levels = parse_pyramid_levels(value)
+    if levels is None:
+        levels = session.pyramid_levels if session is not None and session.pyramid_levels is not None else PYRAMID_LEVELS
+    if session is not None:
+        levels = effective_pyramid_levels(levels, session.size[0])
+    return levels
+
+def detector():
+    """Funkcja detekcji: pula procesów (DETECT_WORKERS > 0) albo detect_all_balls w wątku requestu."""
+    pool = get_pool()
+    return pool.detect if pool is not None else detect_all_balls
+
+def run_detection(img, table_area=None, calibration_point=None, session=None, pyramid_levels=PYRAMID_LEVELS):
+    """Wszystkie bile na obrazie (cue_color bez znaczenia na tym etapie); czasy etapów trafiają do g.timer."""
+    _, _, all_detected = detector()(
+        img, api_key=None, cue_ball_color="white",
+        table_area=table_area, calibration_point=calibration_point, session=session,
+        pyramid_levels=pyramid_levels, timer=g.timer
+    )
+    return all_detected
+
+def decode_upload(raw):
+    with g.timer.stage("decode"):
+        return decode_image(raw)
+
+def detect_cached(raw, table_area=None, calibration_point=None, session=None, pyramid_levels=PYRAMID_LEVELS):
+    """
+    run_detection przez cache wyników (ta sama klatka i parametry => bez dekodowania i OpenCV).
+    Zwraca listę bil albo None, jeśli pliku nie da się zdekodować.
+    ValueError, gdy klatka ma inną rozdzielczość niż sesja.
+    """
+    def decode(data):
+        # klatka sesji musi mieć jej rozdzielczość - sprawdzane przed cache perceptualnym i detekcją
+        img = decode_upload(data)
+        if img is not None and session is not None:
+            session.check_frame(img.shape)
+        return img
+
+    params = detection_params(table_area, calibration_point, session, pyramid_levels)
+    balls, _ = cached_detect(raw, params, decode, lambda img: run_detection(
+        img, table_area, calibration_point, session, pyramid_levels))
+    return balls
+
+def archive_upload(data, filename):
+    """Zapisuje kopię przesłanego pliku, jeśli skonfigurowano UPLOAD_FOLDER (unikalna nazwa)."""
+    folder = current_app.config.get('UPLOAD_FOLDER')
+    if not folder:
+        return
+    ext = os.path.splitext(filename)[1].lower() or '.jpg'
+    try:
+        with open(os.path.join(folder, uuid.uuid4().hex + ext), 'wb') as f:
+            f.write(data)
+    except Exception as e:
+        logger.warning(f"Nie udało się zarchiwizować pliku: {e}")
+
+# 0. SESJA KALIBRACYJNA (narożniki stołu + punkt kalibracji rejestrowane raz)
+# JSON z table_area albo multipart ze zdjęciem stołu (file) - wtedy narożniki i łuzy są wykrywane automatycznie
+@api.route('/session', methods=['POST'])
+def create_session_endpoint():
+    image = None
+    if 'file' in request.files:
+        try:
+            data = {k: json.loads(v) for k, v in request.form.items()}
+        except ValueError:
+            return jsonify({"error": "Pola formularza muszą być poprawnym JSON."}), 400
+        raw = request.files['file'].read()
+        image = decode_upload(raw)
+        if image is None:
+            return jsonify({"error": "Błąd odczytu pliku"}), 400
+    else:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({"error": "Brak danych JSON."}), 400
+    table_area = data.get('table_area')
+    if table_area is not None and (not isinstance(table_area, list) or len(table_area) != 4):
+        return jsonify({"error": "table_area musi zawierać 4 narożniki."}), 400
+    if table_area is None and image is None:
+        return jsonify({"error": "Podaj table_area albo zdjęcie stołu (file)."}), 400
+    try:
+        with g.timer.stage("table_detect"):
+            session = create_session(table_area, data.get('calibration_point'),
+                                     pyramid_levels=parse_pyramid_levels(data.get('pyramid_levels')),
+                                     pockets=data.get('pockets'), image=image)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Session Error: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+    if image is not None:
+        archive_upload(raw, request.files['file'].filename)
+    return jsonify(session.describe())
+
+@api.route('/session/<session_id>', methods=['DELETE'])
+def delete_session_endpoint(session_id):
+    if sessions.pop(session_id) is None:
+        return jsonify({"error": "Nieznana sesja."}), 404
+    trackers.pop(session_id)
+    return jsonify({"deleted": session_id})
 
 # 1. DETEKCJA (Zwraca listę bil)
-@app.route('/detect', methods=['POST'])
+@api.route('/detect', methods=['POST'])
 def detect_endpoint():
     if 'file' not in request.files:
         return jsonify({"error": "Brak pliku"}), 400
@@ -37,32 +272,74 @@ def detect_endpoint():
         except Exception:
             calibration_point = None
 
-    filename = secure_filename(file.filename) or "temp.jpg"
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filepath)
+    # Sesja zastępuje table_area / calibration_point (wszystko z cache)
+    session = None
+    if request.form.get('session_id'):
+        session = get_session(request.form['session_id'])
+        if session is None:
+            return jsonify({"error": "Nieznana lub wygasła sesja."}), 404
+
+    # Tryb śledzenia (kolejne klatki z kamery) - wymaga sesji
+    track = request.form.get('track', '').lower() in ('1', 'true', 'yes')
+    if track and session is None:
+        return jsonify({"error": "Tryb śledzenia wymaga session_id."}), 400
 
     try:
-        # Szukamy WSZYSTKICH bil (cue_color bez znaczenia na tym etapie)
-        _, _, all_detected = detect_all_balls(
-            filepath, api_key=None, cue_ball_color="white",
-            table_area=table_area, calibration_point=calibration_point
-        )
-        return jsonify({"balls": all_detected})
+        pyramid_levels = resolve_pyramid_levels(request.form.get('pyramid_levels'), session)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Dekodowanie bezpośrednio ze strumienia requestu - bez zapisu na dysk
+    data = file.read()
+
+    try:
+        if track:
+            img = decode_upload(data)
+            if img is None:
+                return jsonify({"error": "Błąd odczytu pliku"}), 400
+            session.check_frame(img.shape)
+            archive_upload(data, file.filename)
+            # Pełna detekcja tylko co kilka klatek / po zgubieniu śladu, w pozostałych okna wokół bil
+            balls, info = get_tracker(session).process(img, timer=g.timer, detect=detector(),
+                                                       pyramid_levels=pyramid_levels)
+            return respond({"balls": balls, "tracking": info})
+
+        all_detected = detect_cached(data, table_area, calibration_point, session, pyramid_levels)
+        if all_detected is None:
+            return jsonify({"error": "Błąd odczytu pliku"}), 400
+        archive_upload(data, file.filename)
+        return respond({"balls": all_detected})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except PoolSaturated:
+        return jsonify({"error": "Serwer jest przeciążony, spróbuj ponownie."}), 429
+    except PoolTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         logger.error(f"Detect Error: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
-    finally:
-        try:
-            if os.path.exists(filepath):
-                os.remove(filepath)
-        except Exception as e:
-            logger.warning(f"Nie udało się usunąć pliku tmp: {e}")
+
+def attach_simulation(shots, cue_ball, other_balls, pockets, table_area, simulation):
+    """Dołącza do niezablokowanych strzałów wynik symulacji fizycznej (pole "simulation"), jeśli zażądano."""
+    if simulation is None:
+        return shots
+    open_shots = [sh for sh in shots if not sh["blocked"]]
+    speeds, spins = simulation
+    with g.timer.stage("shot_simulation"):
+        results = simulate_best_variant(cue_ball, other_balls, pockets, open_shots, table_area=table_area,
+                                        speeds=speeds, spins=spins)
+    # kopie - strzały mogą pochodzić z cache wyników
+    simulated = {id(sh): res for sh, res in zip(open_shots, results)}
+    return [dict(sh, simulation=simulated[id(sh)]) if id(sh) in simulated else sh for sh in shots]
 
 # 2. OBLICZENIA (Przyjmuje poprawione bile)
-@app.route('/calculate', methods=['POST'])
+@api.route('/calculate', methods=['POST'])
 def calculate_endpoint():
     try:
-        data = request.json
+        try:
+            data = request_data()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         if not data:
             return jsonify({"error": "Brak danych JSON."}), 400
 
@@ -70,6 +347,15 @@ def calculate_endpoint():
         pockets = data.get('pockets', [])
         cue_color = data.get('cue_ball_color', 'white').lower()
         table_area = data.get('table_area', [])
+        top_k = data.get('top_k')
+
+        hull = None
+        if data.get('session_id'):
+            session = get_session(data['session_id'])
+            if session is None:
+                return jsonify({"error": "Nieznana lub wygasła sesja."}), 404
+            table_area, hull = session.table_area, session.hull
+            pockets = pockets or session.pockets or []
 
         # Minimalna walidacja
         if not isinstance(balls, list) or len(balls) < 2:
@@ -77,43 +363,243 @@ def calculate_endpoint():
         if not isinstance(pockets, list) or len(pockets) == 0:
             return jsonify({"error": "Brak łuz (pockets)."}), 400
 
-        cue_ball = None
-        other_balls = []
-
-        for b in balls:
-            if not isinstance(b, dict):
-                continue
-            if b.get('class', '').lower() == 'ignore':
-                continue
-            b['r'] = int(b.get('r', 15))
-            # Normalizacja klasy (może przychodzić "White"/"white")
-            cls = b.get('class', '')
-            if isinstance(cls, str):
-                cls_norm = cls.lower()
-            else:
-                cls_norm = ''
-
-            if cls_norm == cue_color:
-                if cue_ball is None:
-                    cue_ball = b
-                else:
-                    other_balls.append(b)
-            else:
-                other_balls.append(b)
-
+        cue_ball, other_balls = split_cue_ball(balls, cue_color)
         if cue_ball is None:
             return jsonify({"error": f"Brak bili {cue_color}."}), 400
 
-        best_shot = find_best_shot(cue_ball, other_balls, pockets, table_area=table_area)
+        # top_k > 1 => zwracamy też alternatywy (bez kolejnego wywołania /calculate)
+        try:
+            top_k = max(1, int(top_k)) if top_k is not None else 1
+        except (TypeError, ValueError):
+            return jsonify({"error": "Niepoprawne top_k."}), 400
+        scoring = data.get('scoring')
+        if scoring is not None and scoring not in SCORING_MODES:
+            return jsonify({"error": f"Nieznany sposób oceny strzałów: {scoring}"}), 400
+        try:
+            simulation = simulation_options(data.get('simulate'))
+            shot_types = validate_shot_types(data['shot_types']) if data.get('shot_types') is not None else None
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        shots = cached_rank_shots(cue_ball, other_balls, pockets, table_area=table_area, top_k=top_k, hull=hull,
+                                  timer=g.timer, scoring=scoring, shot_types=shot_types)
+        try:
+            shots = attach_simulation(shots, cue_ball, other_balls, pockets, table_area, simulation)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        if best_shot is None:
+        # Najlepszy = pierwszy na liście (zablokowane są na końcu, więc blocked tylko gdy innych brak)
+        if not shots:
             return jsonify({"error": "Brak dobrego strzału."}), 400
 
-        return jsonify({"best_shot": best_shot})
+        response = {"best_shot": shots[0]}
+        if shots[0]["blocked"]:
+            response["message"] = BLOCKED_MESSAGE
+        if 'top_k' in data:
+            response["shots"] = shots
+        return respond(response, data)
     except Exception as e:
         logger.error(f"Calc Error: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+# 3. ANALIZA (detekcja + strzały w jednym requeście; poprawki bil jako delty względem detection_id)
+@api.route('/analyze', methods=['POST'])
+def analyze_endpoint():
+    file = request.files.get('file')
+    if file is not None:
+        try:
+            data = json.loads(request.form.get('data') or '{}')
+        except ValueError:
+            return jsonify({"error": "Niepoprawny JSON w polu data."}), 400
+    else:
+        try:
+            data = request_data() or {}
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    if not isinstance(data, dict):
+        return jsonify({"error": "Niepoprawne dane."}), 400
+
+    try:
+        top_k = max(1, int(data['top_k'])) if data.get('top_k') is not None else 1
+    except (TypeError, ValueError):
+        return jsonify({"error": "Niepoprawne top_k."}), 400
+    scoring = data.get('scoring')
+    if scoring is not None and scoring not in SCORING_MODES:
+        return jsonify({"error": f"Nieznany sposób oceny strzałów: {scoring}"}), 400
+    try:
+        simulation = simulation_options(data.get('simulate'))
+        shot_types = validate_shot_types(data['shot_types']) if data.get('shot_types') is not None else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    next_id = None
+    if file is None:
+        # Poprawka: tylko zmienione bile względem zapamiętanej detekcji
+        if not data.get('detection_id'):
+            return jsonify({"error": "Brak pliku lub detection_id."}), 400
+        record = get_detection(data['detection_id'])
+        if record is None:
+            return jsonify({"error": "Nieznana lub wygasła detekcja."}), 404
+        try:
+            balls, next_id = apply_corrections(record, data.get('corrections') or {})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        context = dict(record["context"])
+        # łuzy i kolor bili można zmienić bez ponownej detekcji
+        context.update({k: data[k] for k in ('pockets', 'cue_ball_color') if k in data})
+        # Poprawiony stan trafia pod nowe detection_id, a poprzedni zostaje bez zmian -
+        # ponowione żądanie (np. po zerwanym połączeniu) nie doda bil drugi raz
+    else:
+        if file.filename == '' or not allowed_file(file.filename):
+            return jsonify({"error": "Nieobsługiwany format. Użyj JPG/PNG."}), 400
+        session = None
+        if data.get('session_id'):
+            session = get_session(data['session_id'])
+            if session is None:
+                return jsonify({"error": "Nieznana lub wygasła sesja."}), 404
+        try:
+            pyramid_levels = resolve_pyramid_levels(data.get('pyramid_levels'), session)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        raw = file.read()
+        try:
+            balls = detect_cached(raw, data.get('table_area'), data.get('calibration_point'), session,
+                                  pyramid_levels)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except PoolSaturated:
+            return jsonify({"error": "Serwer jest przeciążony, spróbuj ponownie."}), 429
+        except PoolTimeout as e:
+            return jsonify({"error": str(e)}), 503
+        except Exception as e:
+            logger.error(f"Analyze Error: {e}", exc_info=True)
+            return jsonify({"error": str(e)}), 500
+        if balls is None:
+            return jsonify({"error": "Błąd odczytu pliku"}), 400
+        archive_upload(raw, file.filename)
+        context = {"pockets": data.get('pockets', []), "cue_ball_color": data.get('cue_ball_color', 'white'),
+                   "table_area": data.get('table_area') or [], "session_id": data.get('session_id')}
+
+    detection_id, balls = store_detection(balls, context, next_id=next_id)
+    response = {"detection_id": detection_id, "balls": balls, "best_shot": None}
+
+    try:
+        # Strzały: brak białej bili / łuz to nie błąd - klient może jeszcze poprawić bile
+        table_area, hull = context.get('table_area') or [], None
+        session = get_session(context.get('session_id'))
+        if session is not None:
+            table_area, hull = session.table_area, session.hull
+        cue_color = str(context.get('cue_ball_color') or 'white').lower()
+        cue_ball, other_balls = split_cue_ball([dict(b) for b in balls], cue_color)
+        pockets = context.get('pockets') or (session.pockets if session is not None else None) or []
+        if cue_ball is None:
+            response["message"] = f"Brak bili {cue_color}."
+        elif not other_balls or not isinstance(pockets, list) or len(pockets) == 0:
+            response["message"] = "Za mało bil lub brak łuz (pockets)."
+        else:
+            shots = cached_rank_shots(cue_ball, other_balls, pockets, table_area=table_area, top_k=top_k, hull=hull,
+                                      timer=g.timer, scoring=scoring, shot_types=shot_types)
+            try:
+                shots = attach_simulation(shots, cue_ball, other_balls, pockets, table_area, simulation)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            response["best_shot"] = shots[0] if shots else None
+            if not shots:
+                response["message"] = "Brak dobrego strzału."
+            elif shots[0]["blocked"]:
+                response["message"] = BLOCKED_MESSAGE
+            if 'top_k' in data:
+                response["shots"] = shots
+    except Exception as e:
+        logger.error(f"Analyze Error: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+    return respond(response, data)
+
+# 3b. MAPA STRZAŁÓW (gra pozycyjna: szansa najlepszego strzału dla każdej pozycji białej, patrz shot_map.py)
+@api.route('/shot_map', methods=['POST'])
+def shot_map_endpoint():
+    try:
+        data = request_data()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not isinstance(data, dict):
+        return jsonify({"error": "Brak danych JSON."}), 400
+    try:
+        if data.get('map_id'):
+            # Przesunięcia bil względem zapamiętanej mapy - przeliczane tylko zależne komórki
+            shot_map = get_shot_map(data['map_id'])
+            if shot_map is None:
+                return jsonify({"error": "Nieznana lub wygasła mapa."}), 404
+            with g.timer.stage("shot_map"):
+                apply_moves(shot_map, data.get('moves'))
+            map_id = data['map_id']
+        else:
+            pockets = data.get('pockets', [])
+            table_area = data.get('table_area') or []
+            if data.get('session_id'):
+                session = get_session(data['session_id'])
+                if session is None:
+                    return jsonify({"error": "Nieznana lub wygasła sesja."}), 404
+                table_area = session.table_area
+                pockets = pockets or session.pockets or []
+            if not isinstance(pockets, list) or len(pockets) == 0:
+                return jsonify({"error": "Brak łuz (pockets)."}), 400
+            balls = data.get('balls', [])
+            if not isinstance(balls, list):
+                return jsonify({"error": "balls musi być listą."}), 400
+            # biała nie należy do mapy - jej pozycją jest każda komórka siatki
+            _, other_balls = split_cue_ball([dict(b) for b in balls], data.get('cue_ball_color', 'white').lower())
+            cells = data.get('resolution', SHOT_MAP_CELLS)
+            if not isinstance(cells, int) or not 8 <= cells <= 256:
+                return jsonify({"error": "resolution musi być liczbą 8-256."}), 400
+            with g.timer.stage("shot_map"):
+                map_id, shot_map = create_shot_map(other_balls, pockets, table_area=table_area, cells=cells)
+        with g.timer.stage("shot_map_encode"):
+            with shot_map.lock:
+                response = shot_map.describe(map_id)
+        return respond(response, data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Shot Map Error: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+# 4. STRUMIEŃ KLATEK Z KAMERY (WebSocket; przetwarzana zawsze najnowsza klatka, patrz stream.py)
+@sock.route('/stream', bp=api)
+def stream_endpoint(ws):
+    session = None
+    if request.args.get('session_id'):
+        session = get_session(request.args['session_id'])
+        if session is None:
+            ws.send(json.dumps({"error": "Nieznana lub wygasła sesja."}))
+            return
+    try:
+        pyramid_levels = resolve_pyramid_levels(request.args.get('pyramid_levels'), session)
+    except ValueError as e:
+        ws.send(json.dumps({"error": str(e)}))
+        return
+    # format wyników: ?format=json|packed|msgpack (przeglądarki nie ustawiają Accept dla WebSocket) albo Accept
+    media_type = negotiate(request.accept_mimetypes)
+    if request.args.get('format'):
+        media_type = FORMATS.get(request.args['format'])
+        if media_type not in available_formats():
+            ws.send(json.dumps({"error": f"Nieznany lub niedostępny format: {request.args['format']}"}))
+            return
+    analyzer = StreamAnalyzer(session, detect=detector(), pyramid_levels=pyramid_levels)
+    try:
+        serve_stream(ws, analyzer, media_type=media_type)
+    except ConnectionClosed:
+        logger.info(f"Stream zamknięty po {analyzer.frames} klatkach")
+
+# 5. METRYKI (format tekstowy Prometheusa)
+@api.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/cache/stats', methods=['GET'])
+def cache_stats_endpoint():
+    return jsonify(cache_stats())
+
 if __name__ == '__main__':
-    # debug=False na produkcji; host i port można konfigurować przez env
-    app.run(host='0.0.0.0', port=int(os.getenv('PORT', 5001)), debug=True)
+    # Tryb debug tylko przez FLASK_DEBUG (domyślnie wyłączony); host i port można konfigurować przez env
+    create_app().run(host='0.0.0.0', port=int(os.getenv('PORT', 5001)), debug=FLASK_DEBUG)
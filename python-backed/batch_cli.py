@@ -0,0 +1,201 @@
+"""
+Offline analiza nagranych sesji: katalog zdjęć albo plik wideo -> JSON Lines (jedna linia na klatkę).
+
+Klatki są czytane strumieniowo (zdjęcia dekodują workery, wideo - proces główny, sekwencyjnie)
+i rozdzielane na procesy w porcjach po --chunk-size. W pamięci są najwyżej dwie porcje naraz;
+wyniki każdej porcji są dopisywane do pliku w kolejności klatek i od razu zapisywane na dysk.
+Ponowne uruchomienie z tym samym plikiem wyjściowym pomija klatki, które już w nim są
+(przerwany zapis ostatniej linii jest obcinany).
+
+Linia wyniku:
+    {"source": "frame_0001.jpg", "frame": 0, "balls": [...], "best_shot": {...} | null, "timings": {...}}
+    {"source": "frame_0002.jpg", "frame": 1, "error": "Błąd odczytu pliku"}
+Dla wideo "source" to ścieżka pliku, a "frame" to numer klatki w nagraniu.
+
+Użycie:
+    python batch_cli.py nagrania/sesja1/ -o sesja1.jsonl --table-area '[{"x": 60, "y": 40}, ...]' \\
+        --pockets '[{"x": 40, "y": 30}, ...]'
+    python batch_cli.py mecz.mp4 -o mecz.jsonl --every 5 --workers 8 --chunk-size 64 --pyramid-levels 1
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+from config import PYRAMID_LEVELS, ALLOWED_EXT, configure_logging
+
+logger = logging.getLogger(__name__)
+
+# --- strona workera -------------------------------------------------------
+
+# Ustawienia przebiegu w procesie workera (sesja z mapami warpa budowana raz na proces)
+_worker_state = {}
+
+def _init_worker(options):
+    from image_processing import warm_up
+    from calibration import CalibrationSession
+    warm_up()
+    session = None
+    if options.get("table_area"):
+        session = CalibrationSession(options["table_area"], options.get("calibration_point"),
+                                     pyramid_levels=options.get("pyramid_levels"))
+    _worker_state.update(options=options, session=session)
+
+def _analyze_frame(source_name, frame_index, source):
+    """Detekcja + najlepszy strzał dla jednej klatki (ścieżka do zdjęcia albo obraz BGR)."""
+    from image_processing import detect_all_balls
+    from shot_calculation import find_best_shot
+    from analysis import split_cue_ball
+    from timing import StageTimer
+    options, session = _worker_state["options"], _worker_state["session"]
+    record = {"source": source_name, "frame": frame_index}
+    timer = StageTimer()
+    start = time.perf_counter()
+    try:
+        if source is None:
+            raise ValueError("Błąd odczytu klatki")
+        _, _, balls = detect_all_balls(source, session=session, pyramid_levels=options["pyramid_levels"], timer=timer)
+        record["balls"] = balls
+        record["best_shot"] = None
+        cue_ball, other_balls = split_cue_ball([dict(b) for b in balls], options["cue_ball_color"])
+        if cue_ball is not None and other_balls and options["pockets"]:
+            record["best_shot"] = find_best_shot(
+                cue_ball, other_balls, options["pockets"], table_area=options["table_area"] or [],
+                hull=session.hull if session is not None else None, timer=timer)
+    except Exception as e:
+        record["error"] = str(e)
+    stages = {name: round(ms, 3) for name, ms in timer.stages.items()}
+    stages["total"] = round((time.perf_counter() - start) * 1000.0, 3)
+    record["timings"] = stages
+    return record
+
+# --- proces główny --------------------------------------------------------
+
+def iter_frames(path, every=1):
+    """
+    Strumień (source, frame, dane) bez wczytywania całości: dla katalogu - ścieżki zdjęć
+    (posortowane, dekodowane dopiero w workerze), dla wideo - kolejne klatki BGR co every-tą.
+    """
+    if os.path.isdir(path):
+        names = sorted(n for n in os.listdir(path) if os.path.splitext(n)[1].lower() in ALLOWED_EXT)
+        for index, name in enumerate(names[::every]):
+            yield name, index * every, os.path.join(path, name)
+        return
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"Nie można otworzyć wideo: {path}")
+    try:
+        for index in itertools.count():
+            # grab() bez dekodowania dla pomijanych klatek
+            if not capture.grab():
+                break
+            if index % every:
+                continue
+            ok, frame = capture.retrieve()
+            yield path, index, frame if ok else None
+    finally:
+        capture.release()
+
+def load_done(output):
+    """
+    Klatki już zapisane w pliku wyniku: zbiór (source, frame). Niepełna ostatnia linia
+    (przerwany zapis) jest obcinana, żeby kolejne wyniki zaczynały się od nowej linii.
+    """
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            logger.warning(f"Obcinam niepełną ostatnią linię {output}")
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+            done.add((record["source"], record["frame"]))
+        except (ValueError, KeyError):
+            continue
+    return done
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def run(path, output, options, workers=None, chunk_size=32, every=1, resume=True):
+    """Przetwarza wszystkie klatki z path i dopisuje wyniki do output. Zwraca liczbę nowych wyników."""
+    done = load_done(output) if resume else set()
+    if done:
+        logger.info(f"Wznowienie: {len(done)} klatek już w {output}")
+    pending = ((name, index, data) for name, index, data in iter_frames(path, every)
+               if (name, index) not in done)
+
+    written, start = 0, time.perf_counter()
+    with open(output, 'a' if resume else 'w', encoding='utf-8') as out, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                initializer=_init_worker, initargs=(options,)) as executor:
+        def flush(futures):
+            nonlocal written
+            for future in futures:
+                out.write(json.dumps(future.result(), ensure_ascii=False) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+            written += len(futures)
+            elapsed = time.perf_counter() - start
+            logger.info(f"Zapisano {written} klatek ({written / elapsed:.1f} klatek/s)")
+
+        # Najwyżej dwie porcje w locie: jedna liczona, następna czeka (workery nie stoją przy zapisie)
+        in_flight = deque()
+        for chunk in chunks(pending, chunk_size):
+            in_flight.append([executor.submit(_analyze_frame, *item) for item in chunk])
+            if len(in_flight) > 1:
+                flush(in_flight.popleft())
+        while in_flight:
+            flush(in_flight.popleft())
+    return written
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline analiza katalogu zdjęć lub pliku wideo do JSON Lines")
+    parser.add_argument('input', help="katalog ze zdjęciami JPG/PNG albo plik wideo")
+    parser.add_argument('-o', '--output', required=True, help="plik wynikowy .jsonl (dopisywany przy wznowieniu)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="liczba procesów")
+    parser.add_argument('--chunk-size', type=int, default=32, help="klatek w porcji (zapis po każdej porcji)")
+    parser.add_argument('--every', type=int, default=1, help="co która klatka / zdjęcie")
+    parser.add_argument('--no-resume', action='store_true', help="nadpisz plik wynikowy zamiast wznawiać")
+    parser.add_argument('--table-area', help="4 narożniki stołu jako JSON [{x, y}, ...]")
+    parser.add_argument('--calibration-point', help="punkt kalibracji koloru sukna jako JSON {x, y}")
+    parser.add_argument('--pockets', help="łuzy jako JSON [{x, y}, ...] (bez nich best_shot = null)")
+    parser.add_argument('--cue', default='white', help="kolor bili rozgrywającej")
+    parser.add_argument('--pyramid-levels', type=int, default=PYRAMID_LEVELS, choices=range(0, 5),
+                        help="poziom piramidy; obniżany, gdy zmniejszona klatka miałaby < 640 px szerokości")
+    args = parser.parse_args(argv)
+    # postęp na stdout, bez pliku logu serwera
+    configure_logging(log_file=None)
+
+    options = {
+        "table_area": json.loads(args.table_area) if args.table_area else None,
+        "calibration_point": json.loads(args.calibration_point) if args.calibration_point else None,
+        "pockets": json.loads(args.pockets) if args.pockets else [],
+        "cue_ball_color": args.cue.lower(),
+        "pyramid_levels": args.pyramid_levels,
+    }
+    if options["table_area"] is not None and len(options["table_area"]) != 4:
+        parser.error("--table-area musi zawierać 4 narożniki")
+    start = time.perf_counter()
+    written = run(args.input, args.output, options, workers=args.workers, chunk_size=max(1, args.chunk_size),
+                  every=max(1, args.every), resume=not args.no_resume)
+    print(f"Nowe wyniki: {written} klatek w {time.perf_counter() - start:.1f} s -> {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,388 @@
+"""
+Benchmarki detekcji i obliczeń strzałów.
+
+Tryb --suite (powtarzalny zestaw do porównywania wersji): syntetyczne sceny stołu ze znanymi
+bilami (synthetic.render_scene - perspektywa, oświetlenie, szum) oraz złote fixtury
+(test.jpg + zdjęcia z aplikacji iOS) z oczekiwanym wynikiem w benchmark_golden.json.
+Raportuje czasy etapów (mediana / p95), przepustowość, szczytową pamięć, precision/recall
+względem ground truth, czasy rank_shots / find_best_shot (ranking kątem i szansą wbicia; strzały
+bezpośrednie oraz pełne wyszukiwanie z bandą i kombinacjami) i symulacji fizycznej wszystkich kandydatów
+(SIMULATION_SPEEDS x SIMULATION_SPINS wariantów każdego) oraz budowy i przyrostowej aktualizacji mapy
+strzałów (shot_map.py), a także rozmiar i czas serializacji odpowiedzi w formatach z wire_format.py
+(JSON / packed / msgpack). Wynik --json można porównać z poprzednią wersją
+przez --compare stary.json.
+
+Tryb domyślny: ścieżka pełnej rozdzielczości vs piramida (coarse-to-fine).
+
+Każdy obraz testowy jest skalowany do szerokości bazowej (dla niej dostrojone są
+parametry Hougha - tak jak robi to aplikacja iOS), a potem powiększany 2^N razy,
+co symuluje większe uploady. Recall piramidy liczymy względem detekcji na obrazie
+bazowym (przeskalowanej do dużej rozdzielczości).
+
+Tryb --tracking mierzy czas klatki w trybie śledzenia (BallTracker) na sekwencji
+nieruchomego stołu (ta sama klatka + szum sensora) względem pełnej detekcji.
+
+Użycie:
+    python benchmark.py --suite [--repeat 3] [--json wynik.json] [--compare poprzedni.json] [--update-golden]
+    python benchmark.py [--levels 1 2] [--base-width 808] [--repeat 3] [--json wynik.json] [obrazy...]
+    python benchmark.py --tracking [--frames 30] [obrazy...]
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import platform
+import resource
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from image_processing import detect_all_balls
+from calibration import CalibrationSession
+from tracking import BallTracker
+from shot_calculation import rank_shots, find_best_shot, SHOT_TYPE_NAMES
+from physics import simulate_best_variant
+from shot_map import ShotMap
+from wire_format import FORMATS, available_formats, encode
+from synthetic import render_scene
+from timing import StageTimer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FIXTURES = [os.path.join(HERE, 'test.jpg')] + sorted(
+    glob.glob(os.path.join(HERE, '..', 'ios-app', '**', '*.imageset', '*.jpg'), recursive=True))
+GOLDEN_PATH = os.path.join(HERE, 'benchmark_golden.json')
+
+# Stały zestaw scen syntetycznych (seed => identyczny obraz w każdej wersji)
+SYNTHETIC_SCENES = [
+    {"seed": 1, "n_balls": 6, "perspective": 0.0, "lighting": 0.0},
+    {"seed": 2, "n_balls": 10, "perspective": 0.0, "lighting": 0.3},
+    {"seed": 3, "n_balls": 10, "perspective": 0.08, "lighting": 0.3},
+    {"seed": 4, "n_balls": 16, "perspective": 0.08, "lighting": 0.5},
+    {"seed": 5, "n_balls": 10, "perspective": 0.15, "lighting": 0.5},
+    {"seed": 6, "n_balls": 16, "perspective": 0.15, "lighting": 0.3, "noise": 8.0},
+]
+
+def resize_to_width(img, width):
+    h, w = img.shape[:2]
+    interp = cv2.INTER_AREA if width < w else cv2.INTER_CUBIC
+    return cv2.resize(img, (int(width), int(round(h * width / w))), interpolation=interp)
+
+def match_rate(reference, found, tol=0.5):
+    """Odsetek bil z reference, dla których w found jest bila w odległości <= tol * r (min. 4 px)."""
+    if not reference:
+        return 1.0
+    if not found:
+        return 0.0
+    ref = np.array([[b['x'], b['y'], b['r']] for b in reference], dtype=float)
+    got = np.array([[b['x'], b['y']] for b in found], dtype=float)
+    dist = np.hypot(ref[:, None, 0] - got[None, :, 0], ref[:, None, 1] - got[None, :, 1]).min(axis=1)
+    return float(np.mean(dist <= np.maximum(tol * ref[:, 2], 4.0)))
+
+def class_accuracy(reference, found, tol=0.5):
+    """Odsetek dopasowanych bil (jak w match_rate), którym detekcja nadała tę samą klasę koloru."""
+    if not reference or not found:
+        return None
+    ref = np.array([[b['x'], b['y'], b['r']] for b in reference], dtype=float)
+    got = np.array([[b['x'], b['y']] for b in found], dtype=float)
+    dist = np.hypot(ref[:, None, 0] - got[None, :, 0], ref[:, None, 1] - got[None, :, 1])
+    nearest = dist.argmin(axis=1)
+    matched = dist[np.arange(len(ref)), nearest] <= np.maximum(tol * ref[:, 2], 4.0)
+    if not np.any(matched):
+        return None
+    same = [reference[i]['class'].lower() == found[nearest[i]]['class'].lower() for i in np.flatnonzero(matched)]
+    return float(np.mean(same))
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else None
+
+def timed_detect(img, repeat, **kwargs):
+    """Najlepszy czas z repeat prób (ms) i wynik detekcji."""
+    best, balls = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _, _, balls = detect_all_balls(img, **kwargs)
+        elapsed = (time.perf_counter() - start) * 1000.0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, balls
+
+def bench_pyramid(paths, levels, base_width, repeat):
+    results = []
+    for path in paths:
+        img = cv2.imread(path)
+        if img is None:
+            print(f"Pomijam (błąd odczytu): {path}")
+            continue
+        base = resize_to_width(img, base_width)
+        _, reference = timed_detect(base, 1)
+        for level in levels:
+            factor = 2 ** level
+            big = resize_to_width(img, base_width * factor)
+            ref_big = [{"x": b['x'] * factor, "y": b['y'] * factor, "r": b['r'] * factor} for b in reference]
+            full_ms, full = timed_detect(big, repeat)
+            pyr_ms, pyr = timed_detect(big, repeat, pyramid_levels=level)
+            row = {
+                "image": os.path.basename(path), "width": big.shape[1], "levels": level,
+                "reference_balls": len(reference),
+                "full_ms": round(full_ms, 1), "full_balls": len(full), "full_recall": round(match_rate(ref_big, full), 3),
+                "pyramid_ms": round(pyr_ms, 1), "pyramid_balls": len(pyr),
+                "pyramid_recall": round(match_rate(ref_big, pyr), 3),
+                "pyramid_precision": round(match_rate(pyr, ref_big), 3),
+            }
+            results.append(row)
+            print(f"{row['image']:>16} {row['width']:>5}px L={level}  "
+                  f"full {row['full_ms']:>8.1f} ms ({row['full_balls']} bil, recall {row['full_recall']:.2f})  "
+                  f"piramida {row['pyramid_ms']:>7.1f} ms ({row['pyramid_balls']} bil, "
+                  f"recall {row['pyramid_recall']:.2f}, precision {row['pyramid_precision']:.2f})")
+    return results
+
+def bench_tracking(paths, base_width, frames):
+    """Nieruchomy stół: pierwsza klatka = pełna detekcja, kolejne = śledzenie w oknach."""
+    results = []
+    rng = np.random.default_rng(0)
+    for path in paths:
+        img = cv2.imread(path)
+        if img is None:
+            print(f"Pomijam (błąd odczytu): {path}")
+            continue
+        img = resize_to_width(img, base_width)
+        h, w = img.shape[:2]
+        session = CalibrationSession([{"x": 0, "y": 0}, {"x": w - 1, "y": 0}, {"x": w - 1, "y": h - 1}, {"x": 0, "y": h - 1}])
+        tracker = BallTracker(session, full_every=frames + 1)
+        times, full_flags = [], []
+        for _ in range(frames):
+            frame = cv2.add(img, rng.integers(0, 4, img.shape, dtype=np.uint8))
+            start = time.perf_counter()
+            balls, info = tracker.process(frame)
+            times.append((time.perf_counter() - start) * 1000.0)
+            full_flags.append(info["full_detection"])
+        tracked = [t for t, full in zip(times, full_flags) if not full]
+        row = {"image": os.path.basename(path), "width": w, "balls": len(balls), "frames": frames,
+               "full_ms": round(times[0], 1), "full_detections": int(sum(full_flags)),
+               "tracked_median_ms": round(float(np.median(tracked)), 2) if tracked else None}
+        results.append(row)
+        print(f"{row['image']:>16} {w:>5}px  pełna {row['full_ms']:>7.1f} ms  "
+              f"śledzenie (mediana) {row['tracked_median_ms']} ms  "
+              f"({row['balls']} bil, pełnych detekcji {row['full_detections']}/{frames})")
+    return results
+
+def profile_detect(img, repeat, **kwargs):
+    """
+    repeat przebiegów detekcji z StageTimer + jeden dodatkowy pod tracemalloc (szczyt pamięci
+    alokowanej przez Pythona/NumPy - bez buforów wewnętrznych OpenCV). Zwraca (wiersz, wynik detekcji).
+    """
+    totals, stages, balls = [], {}, None
+    for _ in range(repeat):
+        timer = StageTimer()
+        start = time.perf_counter()
+        _, _, balls = detect_all_balls(img, timer=timer, **kwargs)
+        totals.append((time.perf_counter() - start) * 1000.0)
+        for name, ms in timer.stages.items():
+            stages.setdefault(name, []).append(ms)
+    tracemalloc.start()
+    detect_all_balls(img, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    row = {
+        "total_ms": {"median": round(percentile(totals, 50), 2), "p95": round(percentile(totals, 95), 2)},
+        "stages_ms": {name: round(percentile(v, 50), 3) for name, v in stages.items()},
+        "peak_alloc_mb": round(peak / 2 ** 20, 2),
+        "balls": len(balls),
+    }
+    return row, balls
+
+# Warianty symulacji każdego kandydata w --suite (siła x rotacja)
+SIMULATION_SPEEDS = (0.8, 1.5, 2.5, 4.0)
+SIMULATION_SPINS = (-1.0, 0.0, 1.0)
+# Czasy rankingu porównywalne między wersjami - tylko strzały bezpośrednie
+DIRECT = ("direct",)
+
+def time_call(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = (time.perf_counter() - start) * 1000.0
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 3)
+
+def bench_synthetic(repeat):
+    """Sceny syntetyczne: detekcja z table_area (jak w aplikacji) + strzały na bilach ground truth."""
+    rows = []
+    for params in SYNTHETIC_SCENES:
+        scene = render_scene(**params)
+        truth = scene["balls"]
+        row, found = profile_detect(scene["image"], repeat, table_area=scene["table_area"])
+        cue, others = truth[0], truth[1:]
+        shot_map = ShotMap(others, scene["pockets"], table_area=scene["table_area"])
+        shots = rank_shots(cue, others, scene["pockets"], table_area=scene["table_area"], top_k=5,
+                           scoring="probability", shot_types=SHOT_TYPE_NAMES)
+        # odpowiedź jak z /analyze z top_k=5 - rozmiar i czas serializacji w każdym formacie
+        payload = {"detection_id": "0" * 32, "balls": found, "best_shot": shots[0] if shots else None, "shots": shots}
+        formats = {name: media_type for name, media_type in FORMATS.items() if media_type in available_formats()}
+        candidates = [sh for sh in rank_shots(cue, others, scene["pockets"], table_area=scene["table_area"],
+                                              top_k=None, scoring="angle", shot_types=DIRECT) if not sh["blocked"]]
+        row.update({
+            "scene": params, "truth_balls": len(truth),
+            "recall": round(match_rate(truth, found), 3),
+            "precision": round(match_rate(found, truth), 3),
+            "class_accuracy": None if class_accuracy(truth, found) is None else round(class_accuracy(truth, found), 3),
+            "rank_shots_ms": time_call(lambda: rank_shots(cue, others, scene["pockets"], table_area=scene["table_area"],
+                                                          scoring="angle", shot_types=DIRECT), repeat),
+            "find_best_shot_ms": time_call(lambda: find_best_shot(cue, others, scene["pockets"],
+                                                                  table_area=scene["table_area"], scoring="angle",
+                                                                  shot_types=DIRECT), repeat),
+            "rank_shots_probability_ms": time_call(lambda: rank_shots(cue, others, scene["pockets"],
+                                                                      table_area=scene["table_area"],
+                                                                      scoring="probability", shot_types=DIRECT),
+                                                   repeat),
+            # pełne wyszukiwanie: bank / kick / kombinacje w budżecie SHOT_SEARCH_BUDGET_MS
+            "rank_shots_search_ms": time_call(lambda: rank_shots(cue, others, scene["pockets"],
+                                                                 table_area=scene["table_area"], scoring="probability",
+                                                                 shot_types=SHOT_TYPE_NAMES), repeat),
+            "shot_map_ms": time_call(lambda: ShotMap(others, scene["pockets"], table_area=scene["table_area"]), repeat),
+            "shot_map_move_ms": time_call(lambda: shot_map.move(0, others[0]['x'] + 10, others[0]['y']), repeat),
+            "wire_bytes": {name: len(encode(payload, media_type)) for name, media_type in formats.items()},
+            "wire_encode_ms": {name: time_call(lambda: encode(payload, media_type), repeat)
+                               for name, media_type in formats.items()},
+            "simulated_shots": len(candidates) * len(SIMULATION_SPEEDS) * len(SIMULATION_SPINS),
+            "simulate_shots_ms": time_call(lambda: simulate_best_variant(cue, others, scene["pockets"], candidates,
+                                                                         table_area=scene["table_area"],
+                                                                         speeds=SIMULATION_SPEEDS,
+                                                                         spins=SIMULATION_SPINS), repeat),
+        })
+        rows.append(row)
+        print(f"scena {params['seed']:>2} ({len(truth):>2} bil, persp {params['perspective']:.2f}, "
+              f"światło {params['lighting']:.1f})  {row['total_ms']['median']:>7.1f} ms  "
+              f"recall {row['recall']:.2f} precision {row['precision']:.2f} klasy {row['class_accuracy']}  "
+              f"strzały {row['rank_shots_ms']:.2f} / {row['find_best_shot_ms']:.2f} ms, "
+              f"Monte Carlo {row['rank_shots_probability_ms']:.2f} ms, z bandą/kombinacjami {row['rank_shots_search_ms']:.2f} ms, "
+              f"symulacja {row['simulated_shots']} strzałów {row['simulate_shots_ms']:.1f} ms, "
+              f"mapa strzałów {row['shot_map_ms']:.1f} ms (przesunięcie bili {row['shot_map_move_ms']:.1f} ms), "
+              "odpowiedź " + ", ".join(f"{name} {row['wire_bytes'][name]} B / {row['wire_encode_ms'][name]:.3f} ms"
+                                       for name in formats))
+    return rows
+
+def load_fixture(path, base_width):
+    img = cv2.imread(path)
+    return None if img is None else resize_to_width(img, base_width)
+
+def update_golden(paths, base_width):
+    """Zapisuje bieżący wynik detekcji fixtur jako oczekiwany (po świadomej zmianie zachowania)."""
+    golden = {"base_width": base_width, "fixtures": {}}
+    for path in paths:
+        img = load_fixture(path, base_width)
+        if img is None:
+            continue
+        _, _, balls = detect_all_balls(img)
+        golden["fixtures"][os.path.basename(path)] = balls
+    # jedna bila na linię - czytelny diff w gicie po --update-golden
+    with open(GOLDEN_PATH, 'w') as f:
+        f.write('{\n "base_width": %d,\n "fixtures": {\n' % base_width)
+        items = list(golden["fixtures"].items())
+        for i, (name, balls) in enumerate(items):
+            rows = ",\n".join("   " + json.dumps({k: b[k] for k in ("x", "y", "r", "class")}) for b in balls)
+            f.write(f'  {json.dumps(name)}: [\n{rows}\n  ]{"," if i < len(items) - 1 else ""}\n')
+        f.write(' }\n}\n')
+    print(f"Zapisano {len(golden['fixtures'])} fixtur do {GOLDEN_PATH}")
+
+def bench_fixtures(paths, repeat):
+    """Złote fixtury: czasy + zgodność z zapisanym wynikiem (wykrywa zmiany zachowania detekcji)."""
+    with open(GOLDEN_PATH) as f:
+        golden = json.load(f)
+    rows = []
+    for path in paths:
+        name = os.path.basename(path)
+        expected = golden["fixtures"].get(name)
+        img = load_fixture(path, golden["base_width"])
+        if img is None or expected is None:
+            print(f"Pomijam (brak obrazu lub wpisu w {os.path.basename(GOLDEN_PATH)}): {name}")
+            continue
+        row, found = profile_detect(img, repeat)
+        row.update({"image": name, "golden_balls": len(expected),
+                    "recall": round(match_rate(expected, found), 3),
+                    "precision": round(match_rate(found, expected), 3)})
+        rows.append(row)
+        print(f"{name:>16}  {row['total_ms']['median']:>7.1f} ms  ({row['balls']} bil, złote {len(expected)}, "
+              f"recall {row['recall']:.2f} precision {row['precision']:.2f})")
+    return rows
+
+def summarize(rows):
+    totals = [r["total_ms"]["median"] for r in rows]
+    stages = {}
+    for r in rows:
+        for name, ms in r["stages_ms"].items():
+            stages[name] = stages.get(name, 0.0) + ms
+    return {
+        "frames": len(rows),
+        "throughput_fps": round(1000.0 * len(rows) / sum(totals), 2) if totals else None,
+        "median_total_ms": round(percentile(totals, 50), 2) if totals else None,
+        "p95_total_ms": round(percentile(totals, 95), 2) if totals else None,
+        "stage_share": {name: round(ms / sum(totals), 3) for name, ms in stages.items()} if totals else {},
+        "recall": round(float(np.mean([r["recall"] for r in rows])), 3) if rows else None,
+        "precision": round(float(np.mean([r["precision"] for r in rows])), 3) if rows else None,
+        "peak_alloc_mb": max((r["peak_alloc_mb"] for r in rows), default=None),
+    }
+
+def bench_suite(paths, repeat):
+    # rozgrzewka (inicjalizacja OpenCV, LUT, CLAHE) - nie powinna trafić do pierwszego pomiaru
+    detect_all_balls(render_scene(0)["image"])
+    print("== Sceny syntetyczne ==")
+    synthetic = bench_synthetic(repeat)
+    print("== Złote fixtury ==")
+    fixtures = bench_fixtures(paths, repeat)
+    return {
+        "meta": {"python": platform.python_version(), "opencv": cv2.__version__, "numpy": np.__version__,
+                 "machine": platform.machine(), "repeat": repeat},
+        "synthetic": synthetic,
+        "fixtures": fixtures,
+        "summary": {"synthetic": summarize(synthetic), "fixtures": summarize(fixtures),
+                    # ru_maxrss w KB (Linux) - szczyt całego procesu, łącznie z OpenCV
+                    "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)},
+    }
+
+def compare_suites(old, new):
+    """Różnice kluczowych metryk między dwoma wynikami --suite (stary -> nowy)."""
+    print("== Porównanie z poprzednim wynikiem ==")
+    for group in ("synthetic", "fixtures"):
+        before, after = old["summary"].get(group, {}), new["summary"][group]
+        for key in ("median_total_ms", "p95_total_ms", "throughput_fps", "recall", "precision", "peak_alloc_mb"):
+            a, b = before.get(key), after.get(key)
+            if a is None or b is None:
+                continue
+            change = f" ({(b - a) / a * 100:+.1f}%)" if a else ""
+            print(f"{group:>10} {key:>16}: {a} -> {b}{change}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark detekcji: pełna rozdzielczość vs piramida")
+    parser.add_argument('images', nargs='*', help="obrazy testowe (domyślnie test.jpg + zdjęcia z aplikacji iOS)")
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--base-width', type=int, default=808)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--suite', action='store_true', help="pełny zestaw: sceny syntetyczne + złote fixtury")
+    parser.add_argument('--update-golden', action='store_true', help="zapisz bieżący wynik fixtur jako złoty")
+    parser.add_argument('--compare', help="poprzedni wynik --suite --json do porównania")
+    parser.add_argument('--tracking', action='store_true', help="benchmark trybu śledzenia zamiast piramidy")
+    parser.add_argument('--frames', type=int, default=30, help="liczba klatek sekwencji (--tracking)")
+    parser.add_argument('--json', help="zapisz wyniki do pliku JSON")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    if args.update_golden:
+        update_golden(args.images or DEFAULT_FIXTURES, args.base_width)
+        return
+    if args.suite:
+        results = bench_suite(args.images or DEFAULT_FIXTURES, args.repeat)
+        if args.compare:
+            with open(args.compare) as f:
+                compare_suites(json.load(f), results)
+    elif args.tracking:
+        results = bench_tracking(args.images or DEFAULT_FIXTURES, args.base_width, args.frames)
+    else:
+        results = bench_pyramid(args.images or DEFAULT_FIXTURES, args.levels, args.base_width, args.repeat)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
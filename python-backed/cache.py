@@ -0,0 +1,77 @@
+import time
+import threading
+from collections import OrderedDict
+
+class TTLCache:
+    """
+    Prosty, bezpieczny wątkowo cache LRU z czasem życia wpisów (TTL).
+    maxsize - maksymalna liczba wpisów (najdawniej używane są usuwane jako pierwsze),
+    ttl - czas życia wpisu w sekundach liczony od ostatniego zapisu (None = bez limitu),
+    sliding - jeśli True, każdy odczyt odświeża czas życia wpisu (np. dla aktywnych sesji).
+    hits / misses - liczniki trafień get() (patrz stats()).
+    """
+
+    def __init__(self, maxsize=128, ttl=None, sliding=False):
+        self.maxsize = int(maxsize)
+        self.ttl = ttl
+        self.sliding = sliding
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _expired(self, stamp, now):
+        return self.ttl is not None and now - stamp > self.ttl
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, stamp = item
+            if self._expired(stamp, now):
+                del self._data[key]
+                self.misses += 1
+                return default
+            self.hits += 1
+            if self.sliding:
+                self._data[key] = (value, now)
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, now)
+            self._data.move_to_end(key)
+            # Najpierw wygasłe, potem najdawniej używane
+            for k in [k for k, (_, stamp) in self._data.items() if self._expired(stamp, now)]:
+                del self._data[k]
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def __contains__(self, key):
+        """Czy klucz jest w cache i nie wygasł - bez liczenia w stats() i bez odświeżania LRU/TTL."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and not self._expired(item[1], now)
+
+    def stats(self):
+        """Liczniki trafień i zajętość: {"hits", "misses", "hit_rate", "size", "maxsize"}."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / total, 4) if total else None,
+                    "size": len(self._data), "maxsize": self.maxsize}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
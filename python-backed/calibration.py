@@ -0,0 +1,203 @@
+import uuid
+import threading
+import numpy as np
+import cv2
+import logging
+from cache import TTLCache
+from config import SESSION_MAX_ENTRIES, SESSION_TTL
+from geometry import compute_perspective, table_hull
+from image_processing import sample_calibration_hsv, effective_pyramid_levels
+from table_detection import detect_table, pocket_hole_mask
+
+logger = logging.getLogger(__name__)
+
+class CalibrationSession:
+    """
+    Stała kalibracja kamery nad stołem: narożniki stołu + punkt kalibracji tła, opcjonalnie łuzy
+    (podane albo wykryte automatycznie - table_detection.py).
+    Raz wyliczone M, M_inv, otoczka stołu i mapy cv2.remap są używane dla każdej klatki.
+    Mapy, kolor tła (HSV), maska stołu i maska otworów łuz są liczone leniwie przy pierwszej klatce.
+    Narożniki i mapy dotyczą jednej rozdzielczości klatek (frame_size: ze zdjęcia rejestracji albo
+    z pierwszej klatki) - klatki o innym rozmiarze są odrzucane (check_frame).
+    Przy serializacji (np. do procesu workera) ciężkie mapy i maski są pomijane - odbiorca liczy je sam.
+    """
+
+    def __init__(self, table_area, calibration_point=None, session_id=None, pyramid_levels=None, pockets=None,
+                 auto=False, frame_size=None):
+        if not table_area or len(table_area) != 4:
+            raise ValueError("table_area musi zawierać 4 narożniki")
+        if pockets is not None and (not isinstance(pockets, list) or not all(isinstance(p, dict) for p in pockets)):
+            raise ValueError("pockets musi być listą punktów {x, y}")
+        self.session_id = session_id or uuid.uuid4().hex
+        self.table_area = [{"x": int(p['x']), "y": int(p['y'])} for p in table_area]
+        self.calibration_point = calibration_point
+        # Łuzy sesji - domyślne dla /calculate, /analyze i /stream, gdy request ich nie podaje
+        self.pockets = [{"x": int(p['x']), "y": int(p['y'])} for p in pockets] if pockets else None
+        self.auto = auto
+        # (w, h) klatek, dla których podano narożniki; None = ustalany przy pierwszej klatce
+        self.frame_size = tuple(int(v) for v in frame_size) if frame_size is not None else None
+        self.M, self.M_inv, self.size = compute_perspective(self.table_area)
+        # Poziom piramidy dla klatek tej sesji (None = domyślny serwera) - od razu ten faktycznie użyty
+        # przy szerokości widoku z góry (effective_pyramid_levels), tak też raportowany w describe()
+        self.pyramid_levels = (None if pyramid_levels is None
+                               else effective_pyramid_levels(pyramid_levels, self.size[0]))
+        self.hull = table_hull(self.table_area)
+        self.calib_hsv = None
+        self._calibrated = False
+        self._masks = {}
+        self._pocket_fill = None
+        self._lock = threading.Lock()
+        self._maps = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # mapy remap i maski to megabajty - odtwarzane leniwie po drugiej stronie
+        state.update(_maps=None, _masks={}, _pocket_fill=None)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _build_maps(self):
+        """
+        Mapy remap: dla każdego piksela obrazu wyjściowego współrzędne źródłowe (M_inv).
+        Liczone w double jak w warpPerspective, żeby wynik był (prawie) identyczny.
+        """
+        w, h = self.size
+        xs, ys = np.meshgrid(np.arange(w, dtype=np.float64), np.arange(h, dtype=np.float64))
+        Mi = self.M_inv
+        den = Mi[2, 0] * xs + Mi[2, 1] * ys + Mi[2, 2]
+        map1 = ((Mi[0, 0] * xs + Mi[0, 1] * ys + Mi[0, 2]) / den).astype(np.float32)
+        map2 = ((Mi[1, 0] * xs + Mi[1, 1] * ys + Mi[1, 2]) / den).astype(np.float32)
+        return map1, map2
+
+    def check_frame(self, shape):
+        """
+        Sprawdza, czy klatka (shape obrazu) ma rozdzielczość sesji; pierwsza klatka ją ustala,
+        jeśli nie znano jej przy rejestracji. ValueError przy innym rozmiarze - narożniki i mapy
+        remap nie pasowałyby do klatki.
+        """
+        size = (int(shape[1]), int(shape[0]))
+        if self.frame_size is None:
+            with self._lock:
+                if self.frame_size is None:
+                    self.frame_size = size
+        if size != self.frame_size:
+            raise ValueError(f"Klatka {size[0]}x{size[1]} ma inną rozdzielczość niż sesja "
+                             f"({self.frame_size[0]}x{self.frame_size[1]})")
+
+    def warp(self, image, dst=None):
+        """
+        Odpowiednik warp_perspective, ale na gotowych mapach (bez liczenia macierzy).
+        dst - opcjonalny bufor wyniku (H x W x 3 uint8 w rozmiarze sesji), np. z BallDetector.
+        ValueError, gdy obraz ma inną rozdzielczość niż sesja (check_frame).
+        """
+        self.check_frame(image.shape)
+        if self._maps is None:
+            with self._lock:
+                if self._maps is None:
+                    self._maps = self._build_maps()
+        map1, map2 = self._maps
+        return cv2.remap(image, map1, map2, cv2.INTER_LINEAR, dst=dst, borderMode=cv2.BORDER_CONSTANT)
+
+    def calibration_hsv(self, warped):
+        """Kolor tła w HSV - liczony przy pierwszej klatce sesji, potem z cache."""
+        if not self._calibrated:
+            with self._lock:
+                if not self._calibrated:
+                    self.calib_hsv = sample_calibration_hsv(warped, self.calibration_point, self.M)
+                    self._calibrated = True
+        return self.calib_hsv
+
+    def mask_pockets(self, gray, warped):
+        """
+        Zamalowuje otwory łuz (widok z góry, obraz gray w skali detekcji) szarością sukna, żeby Hough
+        nie znajdował na ich krawędziach fałszywych bil. Maska liczona z pierwszej klatki (pocket_hole_mask),
+        potem skalowana do rozmiaru gray i trzymana w cache. Bez łuz w sesji - bez zmian.
+        """
+        if not self.pockets:
+            return gray
+        if self._pocket_fill is None:
+            with self._lock:
+                if self._pocket_fill is None:
+                    top = cv2.perspectiveTransform(np.float32([[p['x'], p['y']] for p in self.pockets])
+                                                   .reshape(-1, 1, 2), self.M).reshape(-1, 2)
+                    mask = pocket_hole_mask(warped, top)
+                    fill = int(np.median(cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)[::4, ::4]))
+                    self._pocket_fill = (mask, fill, {})
+        mask, fill, scaled = self._pocket_fill
+        if mask is None:
+            return gray
+        key = gray.shape[:2]
+        index = scaled.get(key)
+        if index is None:
+            resized = mask if mask.shape == key else cv2.resize(mask, (key[1], key[0]), interpolation=cv2.INTER_NEAREST)
+            index = scaled[key] = np.flatnonzero(resized)
+        gray.ravel()[index] = fill
+        return gray
+
+    def table_mask(self, shape):
+        """Maska stołu (uint8, 255 = stół) dla obrazu o danym rozmiarze (h, w)."""
+        key = (int(shape[0]), int(shape[1]))
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = np.zeros(key, dtype=np.uint8)
+            cv2.fillConvexPoly(mask, self.hull.astype(np.int32), 255)
+            self._masks[key] = mask
+        return mask
+
+    def contains(self, x, y, shape):
+        """Czy punkt (w układzie oryginalnego obrazu) leży na stole - odczyt z maski zamiast pointPolygonTest."""
+        mask = self.table_mask(shape)
+        xi, yi = int(x), int(y)
+        if yi < 0 or xi < 0 or yi >= mask.shape[0] or xi >= mask.shape[1]:
+            return False
+        return bool(mask[yi, xi])
+
+    def contains_points(self, points, shape):
+        """Wektorowa wersja contains dla tablicy punktów (N x 2)."""
+        mask = self.table_mask(shape)
+        pts = np.asarray(points, dtype=int).reshape(-1, 2)
+        inside = (pts[:, 0] >= 0) & (pts[:, 1] >= 0) & (pts[:, 0] < mask.shape[1]) & (pts[:, 1] < mask.shape[0])
+        result = np.zeros(len(pts), dtype=bool)
+        result[inside] = mask[pts[inside, 1], pts[inside, 0]] > 0
+        return result
+
+    def describe(self):
+        """Publiczny opis sesji dla klienta."""
+        return {"session_id": self.session_id, "width": int(self.size[0]), "height": int(self.size[1]),
+                "table_area": self.table_area, "pockets": self.pockets, "auto": self.auto,
+                "pyramid_levels": self.pyramid_levels, "frame_size": list(self.frame_size) if self.frame_size else None,
+                "expires_in": SESSION_TTL}
+
+# Rejestr sesji kalibracyjnych (LRU + TTL)
+sessions = TTLCache(maxsize=SESSION_MAX_ENTRIES, ttl=SESSION_TTL, sliding=True)
+
+def create_session(table_area, calibration_point=None, pyramid_levels=None, pockets=None, image=None):
+    """
+    Tworzy i rejestruje nową sesję kalibracyjną. Bez table_area narożniki stołu i łuzy
+    są wykrywane raz na obrazie image (table_detection.detect_table); podane pockets mają pierwszeństwo.
+    ValueError, gdy nie ma ani table_area, ani obrazu, albo stołu nie da się wykryć.
+    """
+    auto = False
+    if not table_area:
+        if image is None:
+            raise ValueError("Podaj table_area albo zdjęcie stołu do automatycznego wykrycia")
+        table = detect_table(image)
+        table_area, auto = table["table_area"], True
+        pockets = pockets or table["pockets"]
+    frame_size = (image.shape[1], image.shape[0]) if image is not None else None
+    session = CalibrationSession(table_area, calibration_point, pyramid_levels=pyramid_levels, pockets=pockets,
+                                 auto=auto, frame_size=frame_size)
+    sessions.set(session.session_id, session)
+    logger.info(f"Nowa sesja kalibracji: {session.session_id} ({session.size[0]}x{session.size[1]}"
+                f"{', stół wykryty automatycznie' if auto else ''})")
+    return session
+
+def get_session(session_id):
+    """Zwraca sesję lub None (nieznana / wygasła)."""
+    if not session_id:
+        return None
+    return sessions.get(session_id)
@@ -1,5 +1,6 @@
 import cv2
 import numpy as np
+from functools import lru_cache
 
 # --- KOLORY (zakresy HSV) ---
 COLOR_RANGES = {
@@ -15,51 +16,76 @@ COLOR_RANGES = {
     "black":  ([0, 0, 0], [180, 255, 50])
 }
 
-def adjust_gamma(image, gamma=1.5):
-    """Korekta gamma dla lepszego kontrastu."""
+# Kolejność klas dla klasyfikatora wektorowego (indeks = id koloru)
+COLOR_NAMES = ("white", "black", "red", "brown", "orange", "yellow", "green", "blue", "purple", "unknown")
+
+@lru_cache(maxsize=8)
+def gamma_table(gamma):
+    """Tablica LUT (256 x uint8) dla korekty gamma - liczona raz dla danej wartości gamma."""
     invGamma = 1.0 / gamma
     table = np.array([((i / 255.0) ** invGamma) * 255 for i in np.arange(0, 256)]).astype("uint8")
-    return cv2.LUT(image, table)
+    table.setflags(write=False)
+    return table
+
+def adjust_gamma(image, gamma=1.5):
+    """Korekta gamma dla lepszego kontrastu."""
+    return cv2.LUT(image, gamma_table(gamma))
+
+def roi_hsv_means(image_bgr, boxes, gamma=None, lut=None):
+    """
+    Średnie HSV dla wielu prostokątnych ROI naraz, bez konwersji całej klatki.
+    Piksele wszystkich ROI są sklejane w jeden pasek, na którym gamma (LUT) i konwersja
+    BGR->HSV wykonują się jednym wywołaniem, a sumy liczy np.add.reduceat.
+    boxes: (N, 4) int - x1, y1, x2, y2 (niepuste prostokąty). lut - gotowa tablica LUT zamiast gamma.
+    Zwraca tablicę (N, 3) float - te same wartości co cv2.mean(roi_hsv)[:3].
+    """
+    boxes = np.asarray(boxes, dtype=int).reshape(-1, 4)
+    if len(boxes) == 0:
+        return np.zeros((0, 3), dtype=float)
+    # Jeden wiersz (1 x P) - OpenCV przetwarza go wektorowo; kolumna (P x 1) byłaby wielokrotnie wolniejsza
+    strip = np.concatenate([image_bgr[y1:y2, x1:x2].reshape(-1, 3) for x1, y1, x2, y2 in boxes])[None, :, :]
+    if lut is None and gamma is not None:
+        lut = gamma_table(gamma)
+    if lut is not None:
+        strip = cv2.LUT(strip, lut)
+    hsv = cv2.cvtColor(strip, cv2.COLOR_BGR2HSV).reshape(-1, 3)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    starts = np.concatenate(([0], np.cumsum(areas)[:-1]))
+    sums = np.add.reduceat(hsv, starts, axis=0, dtype=np.int64)
+    return sums / areas[:, None]
+
+def classify_hsv_means(means):
+    """
+    Wektorowa wersja reguł get_ball_color dla wielu średnich HSV naraz.
+    means: (N, 3) - średnie H, S, V.
+    Zwraca tablicę (N,) z id kolorów (indeksy w COLOR_NAMES).
+    """
+    means = np.asarray(means, dtype=float).reshape(-1, 3)
+    h, s, v = means[:, 0], means[:, 1], means[:, 2]
+    reddish = ((0 <= h) & (h <= 10)) | ((170 <= h) & (h <= 180))
+    orangish = (11 <= h) & (h <= 25)
+    # Kolejność warunków = kolejność if-ów w get_ball_color (pierwszy spełniony wygrywa)
+    rules = [
+        ((s < 60) & (v > 130), "white"),
+        (v < 50, "black"),
+        (reddish & (s > 70), "red"),
+        (reddish, "brown"),
+        (orangish & (v > 140), "orange"),
+        (orangish, "brown"),
+        ((26 <= h) & (h <= 35), "yellow"),
+        ((36 <= h) & (h <= 88), "green"),
+        ((89 <= h) & (h <= 135), "blue"),
+        ((136 <= h) & (h <= 170), "purple"),
+        # fallbacky uwzględniające niską jasność
+        ((v < 90) & (130 <= h) & (h <= 170), "purple"),
+        ((v < 90) & (0 <= h) & (h <= 25), "brown"),
+    ]
+    return np.select([cond for cond, _ in rules], [COLOR_NAMES.index(name) for _, name in rules],
+                     default=COLOR_NAMES.index("unknown"))
 
 def get_ball_color(roi_hsv):
     """
     Zwraca kolor (lowercase). Opiera się o średnie HSV w ROI.
     """
     mean_color = cv2.mean(roi_hsv)[:3]
-    h, s, v = mean_color
-
-    # prosty regułowy klasyfikator
-    if s < 60 and v > 130:
-        return "white"
-    if v < 50:
-        return "black"
-
-    # czerwony przy 0 lub przy 180
-    if (0 <= h <= 10) or (170 <= h <= 180):
-        if s > 70:
-            return "red"
-        else:
-            return "brown"
-    if 11 <= h <= 25:
-        if v > 140:
-            return "orange"
-        else:
-            return "brown"
-    if 26 <= h <= 35:
-        return "yellow"
-    if 36 <= h <= 88:
-        return "green"
-    if 89 <= h <= 135:
-        return "blue"
-    if 136 <= h <= 170:
-        return "purple"
-
-    # fallbacky uwzględniające niską jasność
-    if v < 90:
-        if 130 <= h <= 170:
-            return "purple"
-        if 0 <= h <= 25:
-            return "brown"
-
-    return "unknown"
-
+    return COLOR_NAMES[int(classify_hsv_means([mean_color])[0])]
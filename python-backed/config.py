@@ -4,22 +4,84 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-# Logging - plikowy + stdout
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-file_handler = logging.FileHandler("server.log")
-file_handler.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+# Logi serwera: stdout + opcjonalnie plik LOG_FILE (pusty = tylko stdout). Konfigurowane dopiero
+# w create_app (configure_logging) - sam import config nie tworzy plików ani handlerów.
+LOG_FILE = os.getenv('LOG_FILE', 'server.log')
 
 # Flask config
-UPLOAD_FOLDER = 'static/uploads/'
-MAX_CONTENT_LENGTH = 2 * 1024 * 1024  # 2 MB max
+# Obrazy są dekodowane w pamięci. UPLOAD_FOLDER jest opcjonalny - jeśli ustawiony,
+# serwer archiwizuje tam kopie przesłanych klatek (np. do debugowania).
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER') or None
+MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', 2 * 1024 * 1024))  # domyślnie 2 MB
 ALLOWED_EXT = {'.jpg', '.jpeg', '.png'}
 
-# Tworzenie folderu uploads jeśli nie istnieje
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Piramida (coarse-to-fine): 0 = pełna rozdzielczość, N = Hough na obrazie zmniejszonym 2^N razy
+# (obniżane, gdy zmniejszony obraz miałby mniej niż 640 px szerokości - patrz effective_pyramid_levels)
+PYRAMID_LEVELS = int(os.getenv('PYRAMID_LEVELS', 0))
+
+# Sesje kalibracyjne (stała kamera nad stołem) - LRU + TTL w sekundach
+SESSION_MAX_ENTRIES = int(os.getenv('SESSION_MAX_ENTRIES', 64))
+SESSION_TTL = float(os.getenv('SESSION_TTL', 3600))
+
+# Tracking klatek z kamery: pełna detekcja co TRACK_FULL_EVERY klatek, między nimi dopasowanie
+# wzorców bil w małych oknach (TRACK_MIN_SCORE - minimalna korelacja, poniżej ślad jest zgubiony)
+TRACK_FULL_EVERY = int(os.getenv('TRACK_FULL_EVERY', 15))
+TRACK_MIN_SCORE = float(os.getenv('TRACK_MIN_SCORE', 0.6))
+
+# Pula procesów detekcji (opt-in): DETECT_WORKERS procesów (0 = detekcja w wątku requestu),
+# maks. DETECT_QUEUE_SIZE klatek w locie (domyślnie 2 x DETECT_WORKERS) - powyżej serwer zwraca 429.
+# DETECT_TIMEOUT - maks. czas (s) klatki w workerze; po nim pula jest restartowana, a request dostaje 503
+DETECT_WORKERS = int(os.getenv('DETECT_WORKERS', 0))
+DETECT_QUEUE_SIZE = int(os.getenv('DETECT_QUEUE_SIZE', 0)) or None
+DETECT_TIMEOUT = float(os.getenv('DETECT_TIMEOUT', 10))
+
+# Cache detekcji /analyze (poprawki bil wysyłane jako delty względem detection_id) - LRU + TTL w sekundach
+DETECTION_CACHE_SIZE = int(os.getenv('DETECTION_CACHE_SIZE', 256))
+DETECTION_TTL = float(os.getenv('DETECTION_TTL', 900))
+
+# Cache wyników (klucz = hash treści): detekcja po bajtach obrazu + parametrach, strzały po stanie stołu.
+# RESULT_CACHE_PHASH - dodatkowo dHash zdekodowanej klatki (trafienia dla ponownie skompresowanych,
+# prawie identycznych zdjęć; drobne przesunięcie bili może nie zmienić hasha - domyślnie wyłączone)
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 512))
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', 600))
+RESULT_CACHE_PHASH = os.getenv('RESULT_CACHE_PHASH', 'False').lower() in ('1', 'true', 'yes')
+
+# Ranking strzałów: "probability" - szansa wbicia z symulacji Monte Carlo (shot_probability.py),
+# "angle" - najmniejszy kąt cięcia. Symulacja: budżet czasu (ms) i limit próbek na strzał,
+# odchylenie kąta uderzenia (stopnie) i punktu celowania (ułamek promienia bili)
+SHOT_SCORING = os.getenv('SHOT_SCORING', 'probability')
+SHOT_MC_BUDGET_MS = float(os.getenv('SHOT_MC_BUDGET_MS', 15))
+SHOT_MC_MAX_SAMPLES = int(os.getenv('SHOT_MC_MAX_SAMPLES', 4096))
+SHOT_MC_AIM_SIGMA_DEG = float(os.getenv('SHOT_MC_AIM_SIGMA_DEG', 0.6))
+SHOT_MC_CONTACT_SIGMA = float(os.getenv('SHOT_MC_CONTACT_SIGMA', 0.08))
+
+# Rodzaje strzałów w rankingu (lista po przecinku): direct, bank (bila od bandy), kick (biała od bandy),
+# combination (biała -> bila -> bila -> łuza). Twardy budżet czasu (ms) wyszukiwania strzałów złożonych
+SHOT_TYPES = tuple(t.strip() for t in os.getenv('SHOT_TYPES', 'direct,bank,kick,combination').split(',') if t.strip())
+SHOT_SEARCH_BUDGET_MS = float(os.getenv('SHOT_SEARCH_BUDGET_MS', 10))
+
+# Mapa strzałów (gra pozycyjna): komórek siatki na dłuższym boku stołu, liczba map w pamięci i TTL (s)
+SHOT_MAP_CELLS = int(os.getenv('SHOT_MAP_CELLS', 64))
+SHOT_MAP_CACHE_SIZE = int(os.getenv('SHOT_MAP_CACHE_SIZE', 32))
+SHOT_MAP_TTL = float(os.getenv('SHOT_MAP_TTL', 600))
+
+# Tryb debug serwera deweloperskiego (nigdy na produkcji)
+FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() in ('1', 'true', 'yes')
+
+# Rozgrzewka w create_app (detektor, OpenCV, wyszukiwanie strzałów, fizyka) - przy serwerach pre-fork
+# (gunicorn --preload) liczona raz w procesie głównym i dziedziczona przez workery
+WARM_UP = os.getenv('WARM_UP', 'False').lower() in ('1', 'true', 'yes')
+
+def configure_logging(log_file=LOG_FILE):
+    """Logi INFO na stdout + plik log_file. Wywołanie wielokrotne nie dubluje handlerów."""
+    logging.basicConfig(level=logging.INFO)
+    root = logging.getLogger()
+    path = os.path.abspath(log_file) if log_file else None
+    if path and not any(getattr(h, 'baseFilename', None) == path for h in root.handlers):
+        file_handler = logging.FileHandler(path)
+        file_handler.setLevel(logging.INFO)
+        file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        root.addHandler(file_handler)
 
 def allowed_file(filename):
     fn = filename.lower()
@@ -1,6 +1,9 @@
 import numpy as np
 import cv2
 
+# Promień bili (px), gdy bila nie ma pola "r" - wspólny dla detekcji i liczenia strzałów
+DEFAULT_BALL_RADIUS = 18
+
 def order_points(pts):
     """Porządkuje punkty w kolejności: top-left, top-right, bottom-right, bottom-left."""
     rect = np.zeros((4, 2), dtype="float32")
@@ -12,10 +15,10 @@ def order_points(pts):
     rect[3] = pts[np.argmax(diff)]
     return rect
 
-def warp_perspective(image, corners):
+def compute_perspective(corners):
     """
-    Wykonuje transformację perspektywy na obrazie.
-    Zwraca: warped_image, M (macierz transformacji), M_inv (macierz odwrotna)
+    Wylicza macierze perspektywy dla narożników stołu.
+    Zwraca: M (macierz transformacji), M_inv (macierz odwrotna), (szerokość, wysokość) obrazu wyjściowego
     """
     rect = order_points(np.array([[p['x'], p['y']] for p in corners], dtype="float32"))
     (tl, tr, br, bl) = rect
@@ -28,7 +31,15 @@ def warp_perspective(image, corners):
     dst = np.array([[0, 0], [maxWidth - 1, 0], [maxWidth - 1, maxHeight - 1], [0, maxHeight - 1]], dtype="float32")
     M = cv2.getPerspectiveTransform(rect, dst)
     M_inv = cv2.getPerspectiveTransform(dst, rect)
-    warped = cv2.warpPerspective(image, M, (maxWidth, maxHeight))
+    return M, M_inv, (maxWidth, maxHeight)
+
+def warp_perspective(image, corners):
+    """
+    Wykonuje transformację perspektywy na obrazie.
+    Zwraca: warped_image, M (macierz transformacji), M_inv (macierz odwrotna)
+    """
+    M, M_inv, size = compute_perspective(corners)
+    warped = cv2.warpPerspective(image, M, size)
     return warped, M, M_inv
 
 def transform_point_back(x, y, M_inv):
@@ -43,6 +54,39 @@ def transform_point_forward(x, y, M):
     dst = cv2.perspectiveTransform(pt, M)
     return int(dst[0][0][0]), int(dst[0][0][1])
 
+def table_hull(table_area):
+    """Zwraca otoczkę wypukłą obszaru stołu (N x 2, int32) lub None, jeśli obszar nie jest podany."""
+    if not table_area or len(table_area) < 3:
+        return None
+    area_points = np.array([[p['x'], p['y']] for p in table_area], dtype=np.int32)
+    return cv2.convexHull(area_points).reshape(-1, 2)
+
+def points_inside_hull(points, hull):
+    """
+    Wektorowy odpowiednik cv2.pointPolygonTest(...) >= 0 dla wielu punktów naraz.
+    points: array-like (N x 2), hull: wynik table_hull lub None.
+    Zwraca tablicę bool (N,) - punkty na krawędzi liczą się jako wewnątrz.
+    """
+    pts = np.asarray(points, dtype=float).reshape(-1, 2)
+    if hull is None:
+        return np.ones(len(pts), dtype=bool)
+    h = np.asarray(hull, dtype=float).reshape(-1, 2)
+    edges = np.roll(h, -1, axis=0) - h
+    area2 = np.sum(h[:, 0] * np.roll(h[:, 1], -1) - np.roll(h[:, 0], -1) * h[:, 1])
+    if len(h) < 3 or area2 == 0:
+        # Zdegenerowana otoczka (punkty współliniowe) - klasyczny test punkt po punkcie
+        cnt = h.astype(np.float32).reshape(-1, 1, 2)
+        return np.array([cv2.pointPolygonTest(cnt, (float(x), float(y)), True) >= 0.0 for x, y in pts], dtype=bool)
+    rel = pts[:, None, :] - h[None, :, :]
+    cross = edges[None, :, 0] * rel[:, :, 1] - edges[None, :, 1] * rel[:, :, 0]
+    if area2 < 0:
+        cross = -cross
+    return np.all(cross >= 0, axis=1)
+
+def points_inside_table_area(points, table_area):
+    """Sprawdza wektorowo, które punkty (N x 2) leżą wewnątrz obszaru stołu."""
+    return points_inside_hull(points, table_hull(table_area))
+
 def is_point_inside_table_area(point, table_area):
     """Sprawdza czy punkt znajduje się wewnątrz obszaru stołu."""
     if not table_area or len(table_area) < 3:
@@ -52,3 +96,97 @@ def is_point_inside_table_area(point, table_area):
     dist = cv2.pointPolygonTest(hull, (float(point['x']), float(point['y'])), True)
     return dist >= 0.0
 
+
+class BallGrid:
+    """
+    Jednorodna siatka (uniform grid) nad środkami bil.
+    Pozwala szybko znaleźć bile leżące w pobliżu odcinków (korytarzy strzałów)
+    bez sprawdzania każdej bili z każdym odcinkiem. Zapytania są wsadowe (wiele odcinków naraz).
+    """
+
+    def __init__(self, centers, radii, cell_size=None):
+        self.centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+        self.radii = np.asarray(radii, dtype=float).reshape(-1)
+        self.max_r = float(self.radii.max()) if len(self.radii) else 0.0
+        if cell_size is None and len(self.centers):
+            # Komórka co najmniej 2 średnice największej bili, a przy rzadkim rozłożeniu
+            # tak duża, żeby na komórkę przypadała średnio ok. jedna bila
+            extent = np.ptp(self.centers, axis=0) + 4.0 * self.max_r
+            cell_size = max(4.0 * self.max_r, float(np.sqrt(extent[0] * extent[1] / len(self.centers))))
+        self.cell = max(float(cell_size or 0.0), 1.0)
+        # Gęsta siatka w układzie CSR: dla każdej komórki początek i liczba bil w self._order
+        cells = np.floor(self.centers / self.cell).astype(np.int64)
+        self._origin = cells.min(axis=0) if len(cells) else np.zeros(2, dtype=np.int64)
+        self._shape = (cells.max(axis=0) - self._origin + 1) if len(cells) else np.ones(2, dtype=np.int64)
+        flat = (cells[:, 0] - self._origin[0]) * self._shape[1] + (cells[:, 1] - self._origin[1])
+        self._order = np.argsort(flat, kind='stable')
+        self._count = np.bincount(flat, minlength=int(self._shape[0] * self._shape[1]))
+        self._start = np.cumsum(self._count) - self._count
+
+    def first_blockers(self, starts, ends, moving_radius, exclude=None):
+        """
+        Test przesuwanego okręgu (swept circle) dla wielu odcinków naraz:
+        bila o promieniu moving_radius toczy się od starts[i] do ends[i].
+        exclude[i] - indeks bili pomijanej dla danego odcinka (-1 = brak).
+        Zwraca tablicę (S,) z indeksem pierwszej bili na drodze (-1 = droga wolna).
+        Bile leżące za punktem startu są pomijane.
+        """
+        starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+        n_seg = len(starts)
+        result = np.full(n_seg, -1, dtype=int)
+        if n_seg == 0 or len(self.centers) == 0:
+            return result
+        moving_radius = np.broadcast_to(np.asarray(moving_radius, dtype=float), (n_seg,))
+        exclude = np.full(n_seg, -1, dtype=int) if exclude is None else np.broadcast_to(np.asarray(exclude, dtype=int), (n_seg,))
+
+        # 1. Próbkowanie odcinków co jedną komórkę i zebranie komórek w promieniu margin + pół kroku
+        d = ends - starts
+        length = np.hypot(d[:, 0], d[:, 1])
+        steps = np.maximum(1, np.ceil(length / self.cell)).astype(np.int64)
+        margin = float(moving_radius.max()) + self.max_r
+        k = int(np.ceil((margin + 0.5 * float(np.max(length / steps))) / self.cell))
+        seg_id = np.repeat(np.arange(n_seg), steps + 1)
+        first = np.concatenate(([0], np.cumsum(steps + 1)[:-1]))
+        frac = (np.arange(len(seg_id)) - first[seg_id]) / steps[seg_id]
+        samples = np.floor((starts[seg_id] + d[seg_id] * frac[:, None]) / self.cell).astype(np.int64)
+        span = np.arange(-k, k + 1)
+        offs = np.column_stack((np.repeat(span, len(span)), np.tile(span, len(span))))
+        cells = (samples[:, None, :] + offs[None, :, :]).reshape(-1, 2)
+        cell_seg = np.repeat(seg_id, len(offs))
+
+        # 2. Tylko niepuste komórki wewnątrz siatki -> pary (odcinek, bila)
+        local = cells - self._origin
+        inside = (local[:, 0] >= 0) & (local[:, 1] >= 0) & (local[:, 0] < self._shape[0]) & (local[:, 1] < self._shape[1])
+        flat = local[inside, 0] * self._shape[1] + local[inside, 1]
+        counts = self._count[flat]
+        occupied = counts > 0
+        if not np.any(occupied):
+            return result
+        flat, counts, cell_seg = flat[occupied], counts[occupied], cell_seg[inside][occupied]
+        pair_seg = np.repeat(cell_seg, counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_ball = self._order[np.repeat(self._start[flat], counts) + within]
+        # Duplikaty par (ta sama bila z kilku próbek) nie przeszkadzają - liczy się pierwsza kolizja
+        keep = pair_ball != exclude[pair_seg]
+        pair_seg, pair_ball = pair_seg[keep], pair_ball[keep]
+
+        # 3. Dokładny test odległości środka bili od odcinka
+        a = starts[pair_seg]
+        dd = d[pair_seg]
+        rel = self.centers[pair_ball] - a
+        proj = np.sum(rel * dd, axis=1)
+        len2 = np.sum(dd * dd, axis=1)
+        t = np.clip(proj / np.where(len2 == 0, 1.0, len2), 0.0, 1.0)
+        dist = np.hypot(*(rel - t[:, None] * dd).T)
+        hit = (len2 > 0) & (proj > 0) & (dist < moving_radius[pair_seg] + self.radii[pair_ball])
+        if not np.any(hit):
+            return result
+
+        # 4. Pierwsza bila wzdłuż drogi dla każdego odcinka
+        hs, hb, hp = pair_seg[hit], pair_ball[hit], proj[hit]
+        order = np.lexsort((hp, hs))
+        hs, hb = hs[order], hb[order]
+        is_first = np.concatenate(([True], hs[1:] != hs[:-1]))
+        result[hs[is_first]] = hb[is_first]
+        return result
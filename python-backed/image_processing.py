@@ -1,12 +1,105 @@
+import os
 import numpy as np
 import cv2
 import logging
-from color_detection import adjust_gamma, get_ball_color
-from geometry import warp_perspective, transform_point_back, transform_point_forward, is_point_inside_table_area
+import threading
+from color_detection import COLOR_NAMES, roi_hsv_means, classify_hsv_means, gamma_table
+from timing import StageTimer, timed
+from geometry import warp_perspective, transform_point_forward, table_hull, points_inside_hull, DEFAULT_BALL_RADIUS
 
 logger = logging.getLogger(__name__)
 
-DEFAULT_BALL_RADIUS = 18
+# Hough params (różne czułości) - od najbardziej restrykcyjnych
+HOUGH_CASCADE = [
+    {"param2": 22, "minDist": 25},
+    {"param2": 18, "minDist": 25},
+    {"param2": 15, "minDist": 20},
+]
+
+# Zakres promieni bil (px pełnej rozdzielczości); na poziomach piramidy dzielony przez skalę
+MIN_BALL_RADIUS = 8
+MAX_BALL_RADIUS = 70
+
+# Piramida nie schodzi poniżej tej szerokości: preprocessing i progi Hougha są dostrojone
+# do obrazów ~640-800 px, a na mniejszych bile mają po kilka pikseli i recall spada
+PYRAMID_MIN_WIDTH = 640
+
+# Korekta gamma przed klasyfikacją koloru (LUT liczony raz, patrz gamma_table)
+CLASSIFY_GAMMA = 1.6
+
+# Preprocessing przed Houghem: CLAHE (clipLimit, siatka) i rozmycie Gaussa (rozmiar jądra, sigma)
+CLAHE_CLIP_LIMIT = 3.0
+CLAHE_TILE_GRID = (8, 8)
+BLUR_KSIZE = (9, 9)
+BLUR_SIGMA = 2
+
+# Detektor trzyma CLAHE i bufory robocze, więc nie jest współdzielony między wątkami - jeden na wątek
+_thread_state = threading.local()
+
+def get_detector():
+    """BallDetector bieżącego wątku (tworzony przy pierwszym użyciu, potem ten sam dla kolejnych klatek)."""
+    detector = getattr(_thread_state, "detector", None)
+    if detector is None:
+        detector = BallDetector()
+        _thread_state.detector = detector
+    return detector
+
+def warm_up():
+    """
+    Przygotowuje stan detekcji przed pierwszą klatką (np. w procesie workera):
+    BallDetector wątku (CLAHE, LUT gamma) i jedno przejście na pustym obrazie (inicjalizacja HoughCircles).
+    """
+    get_detector().warm_up()
+
+def suppress_close(circles, min_dist):
+    """
+    Zachłanne NMS: przegląda okręgi w podanej kolejności (najważniejsze pierwsze)
+    i odrzuca te, których środek leży bliżej niż min_dist od już zaakceptowanego.
+    Pary bliskich środków szukane są w siatce o boku min_dist (tylko 3x3 sąsiednie komórki),
+    więc koszt rośnie liniowo z liczbą okręgów, a nie kwadratowo.
+    Zwraca indeksy zaakceptowanych okręgów (rosnąco).
+    """
+    pts = np.asarray(circles, dtype=float).reshape(len(circles), -1)[:, :2]
+    n = len(pts)
+    if n == 0:
+        return np.array([], dtype=int)
+    if min_dist <= 0:
+        return np.arange(n)
+
+    # Siatka w układzie CSR (jak BallGrid): dla każdej komórki początek i liczba punktów w order
+    cells = np.floor(pts / min_dist).astype(np.int64)
+    origin = cells.min(axis=0)
+    shape = cells.max(axis=0) - origin + 1
+    flat = (cells[:, 0] - origin[0]) * shape[1] + (cells[:, 1] - origin[1])
+    order = np.argsort(flat, kind='stable')
+    count = np.bincount(flat, minlength=int(shape[0] * shape[1]))
+    start = np.cumsum(count) - count
+
+    # Kandydaci z 3x3 sąsiednich komórek -> pary (i, j) bliżej niż min_dist
+    offs = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+    local = (cells[:, None, :] + offs[None, :, :]).reshape(-1, 2) - origin
+    owner = np.repeat(np.arange(n), len(offs))
+    inside = (local[:, 0] >= 0) & (local[:, 1] >= 0) & (local[:, 0] < shape[0]) & (local[:, 1] < shape[1])
+    nb = local[inside, 0] * shape[1] + local[inside, 1]
+    counts = count[nb]
+    pair_i = np.repeat(owner[inside], counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_j = order[np.repeat(start[nb], counts) + within]
+    diff = pts[pair_i] - pts[pair_j]
+    close = (pair_j > pair_i) & (np.hypot(diff[:, 0], diff[:, 1]) < min_dist)
+    pair_i, pair_j = pair_i[close], pair_j[close]
+    by_i = np.argsort(pair_i, kind='stable')
+    pair_i, pair_j = pair_i[by_i], pair_j[by_i]
+    bounds = np.searchsorted(pair_i, np.arange(n + 1))
+
+    suppressed = np.zeros(n, dtype=bool)
+    keep = []
+    for i in range(n):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed[pair_j[bounds[i]:bounds[i + 1]]] = True
+    return np.array(keep, dtype=int)
 
 def filter_overlapping_circles(circles, min_dist=25):
     """
@@ -18,199 +111,389 @@ def filter_overlapping_circles(circles, min_dist=25):
     if circles is None or len(circles) == 0:
         return np.array([])
 
-    circles = sorted(circles, key=lambda c: c[2], reverse=True)
-    filtered = []
+    circles = np.asarray(circles)[:, :3]
+    order = np.argsort(-circles[:, 2], kind='stable')
+    ordered = circles[order]
+    return ordered[suppress_close(ordered, min_dist)].astype(int)
 
-    for c in circles:
-        x, y, r = c
-        is_duplicate = False
-        for f in filtered:
-            fx, fy, fr = f
-            dist = np.hypot(x - fx, y - fy)
-            if dist < min_dist:
-                is_duplicate = True
-                break
-        if not is_duplicate:
-            filtered.append([int(x), int(y), int(r)])
-    return np.array(filtered)
+def hough_cascade(gray_blurred, timer=None, scale=1):
+    """
+    Klasyczna kaskada: HoughCircles z malejącym param2 aż coś się znajdzie.
+    scale - skala poziomu piramidy; minDist i zakres promieni są dzielone przez nią,
+    żeby na zmniejszonym obrazie szukać tych samych bil co w pełnej rozdzielczości.
+    """
+    for attempt, params in enumerate(HOUGH_CASCADE, start=1):
+        with timed(timer, f"hough_{attempt}"):
+            circles_found = cv2.HoughCircles(
+                gray_blurred, cv2.HOUGH_GRADIENT, dp=1,
+                minDist=max(1, params["minDist"] / scale),
+                param1=40,
+                param2=params["param2"],
+                minRadius=max(1, MIN_BALL_RADIUS // scale), maxRadius=-(-MAX_BALL_RADIUS // scale)
+            )
+        if circles_found is not None and len(circles_found[0]) > 0:
+            logger.info(f"Znaleziono okręgi przy param: {params}")
+            return np.round(circles_found[0, :]).astype("int")
+    return None
 
-def detect_all_balls(image_path, api_key=None, cue_ball_color="White", table_area=None, calibration_point=None):
+def effective_pyramid_levels(pyramid_levels, width):
     """
-    Zwraca: cue_ball (dict or None), other_balls (list of dicts), all_detected_balls (list of dicts)
-    Każda bila: {"x": int, "y": int, "r": int, "class": "Red", "confidence": 0.9}
+    Poziom piramidy faktycznie użyty dla obrazu o szerokości width (po warpie):
+    pyramid_levels obniżone tak, żeby zmniejszony obraz miał co najmniej PYRAMID_MIN_WIDTH px.
+    """
+    levels = max(0, int(pyramid_levels or 0))
+    while levels and width / 2 ** levels < PYRAMID_MIN_WIDTH:
+        levels -= 1
+    return levels
+
+def refine_circles(image, circles, scale):
+    """
+    Doprecyzowanie okręgów znalezionych na poziomie piramidy (współrzędne zmniejszone scale razy).
+    Dla każdego kandydata Hough działa tylko w małym ROI pełnej rozdzielczości
+    i w wąskim zakresie promieni wokół przeskalowanego promienia.
+    Jeśli w ROI nic się nie znajdzie, zostaje przeskalowany kandydat.
+    Zwraca listę [x, y, r] (int) w pełnej rozdzielczości.
+    """
+    h, w = image.shape[:2]
+    ksize = 2 * int(scale) + 1
+    refined = []
+    for (x, y, r) in circles:
+        cx, cy, cr = x * scale, y * scale, r * scale
+        half = int(cr + 2 * scale + 4)
+        x1, y1 = max(0, cx - half), max(0, cy - half)
+        x2, y2 = min(w, cx + half + 1), min(h, cy + half + 1)
+        best = (cx, cy, cr)
+        if x2 - x1 > 2 and y2 - y1 > 2:
+            roi = cv2.GaussianBlur(cv2.cvtColor(image[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY), (ksize, ksize), scale)
+            found = cv2.HoughCircles(roi, cv2.HOUGH_GRADIENT, dp=1, minDist=1, param1=40,
+                                     param2=HOUGH_CASCADE[-1]["param2"],
+                                     minRadius=max(1, int(cr - 1.5 * scale)), maxRadius=int(cr + 1.5 * scale) + 1)
+            if found is not None:
+                cand = found[0]
+                dist = np.hypot(cand[:, 0] + x1 - cx, cand[:, 1] + y1 - cy)
+                ok = np.flatnonzero(dist <= 2 * scale)
+                if ok.size:
+                    # najwięcej głosów = pierwszy pasujący (OpenCV sortuje malejąco)
+                    fx, fy, fr = cand[ok[0]]
+                    best = (int(round(fx + x1)), int(round(fy + y1)), int(round(fr)))
+        refined.append([int(best[0]), int(best[1]), int(best[2])])
+    return refined
+
+def classify_circles(image, circles, calib_hsv=None, lut=None):
+    """
+    Wsadowa klasyfikacja koloru wszystkich okręgów naraz (okręgi we współrzędnych image -
+    w piramidzie już po refine_circles, więc ROI jak przy detekcji w pełnej rozdzielczości).
+    Średnie HSV liczone są tylko z ROI (roi_hsv_means), potem wektorowo:
+    filtr tła względem skalibrowanego HSV, filtr cieni i reguły kolorów (classify_hsv_means).
+    lut - gotowa tablica LUT gamma (BallDetector); domyślnie gamma_table(CLASSIFY_GAMMA).
+    Zwraca tablicę (N, 4) int: x, y, r, id koloru (COLOR_NAMES) - bez okręgów uznanych za tło.
+    """
+    circles = np.asarray(circles, dtype=int).reshape(-1, 3)
+    if len(circles) == 0:
+        return np.zeros((0, 4), dtype=int)
+    h, w = image.shape[:2]
+    x, y, r = circles[:, 0], circles[:, 1], circles[:, 2]
+    roi_size = np.maximum(6, r / 2.5).astype(int)
+    boxes = np.stack([np.maximum(0, x - roi_size), np.maximum(0, y - roi_size),
+                      np.minimum(w, x + roi_size), np.minimum(h, y + roi_size)], axis=1)
+    has_roi = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+
+    color_ids = np.full(len(circles), COLOR_NAMES.index("unknown"))
+    background = np.zeros(len(circles), dtype=bool)
+    if np.any(has_roi):
+        means = roi_hsv_means(image, boxes[has_roi], gamma=CLASSIFY_GAMMA, lut=lut)
+        is_background = np.zeros(len(means), dtype=bool)
+        # Filtracja tła względem skalibrowanego HSV (jeśli podano)
+        if calib_hsv is not None:
+            diff_h = np.abs(means[:, 0] - calib_hsv[0])
+            diff_h = np.where(diff_h > 90, 180 - diff_h, diff_h)
+            is_background |= ((diff_h <= 15) & (np.abs(means[:, 1] - calib_hsv[1]) <= 80)
+                              & (np.abs(means[:, 2] - calib_hsv[2]) <= 80))
+        # filtr cieni: niska jasność i niskie nasycenie
+        is_background |= (means[:, 2] < 40) & (means[:, 1] < 60)
+        background[has_roi] = is_background
+        color_ids[has_roi] = classify_hsv_means(means)
+
+    keep = ~background
+    return np.column_stack((circles[keep], color_ids[keep]))
+
+def project_balls_back(balls, M_inv):
+    """
+    Powrót do współrzędnych oryginalnego obrazu (jeśli był warp) - wszystkie bile jednym
+    wywołaniem cv2.perspectiveTransform. Promień = odległość przekształconego punktu (x + r, y).
+    balls: (N, 4) int - x, y, r, id koloru. Zwraca tablicę tego samego kształtu.
+    """
+    if M_inv is None or len(balls) == 0:
+        return balls
+    pts = np.concatenate([balls[:, :2], balls[:, :2] + np.column_stack((balls[:, 2], np.zeros(len(balls))))])
+    dst = cv2.perspectiveTransform(pts.astype("float32").reshape(-1, 1, 2), M_inv).reshape(-1, 2).astype(int)
+    centers, edges = dst[:len(balls)], dst[len(balls):]
+    orig_r = np.abs(edges[:, 0] - centers[:, 0])
+    orig_r = np.where(orig_r <= 0, balls[:, 2], orig_r)
+    return np.column_stack((centers, orig_r, balls[:, 3]))
+
+def decode_image(data):
+    """
+    Dekoduje obraz (JPG/PNG) z bufora w pamięci bez zapisu na dysk.
+    data: bytes / bytearray / memoryview / 1-wymiarowa np.ndarray uint8
+    Zwraca obraz BGR (np.ndarray) lub None, jeśli bufor nie jest poprawnym obrazem.
+    """
+    if data is None:
+        return None
+    buf = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data.ravel()
+    if buf.size == 0:
+        return None
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+def load_image(source):
+    """
+    Zwraca obraz BGR z dowolnego obsługiwanego źródła:
+    - np.ndarray z obrazem (H x W x 3) - bez kopiowania,
+    - zakodowany bufor (bytes, bytearray, memoryview, 1-wymiarowa np.ndarray uint8),
+    - obiekt plikowy z metodą read() (np. strumień z requestu),
+    - ścieżka do pliku (str / os.PathLike) - przez cv2.imread.
+    Zwraca None, jeśli obrazu nie da się odczytać.
     """
-    logger.info(f"Detekcja OpenCV... Szukam: {cue_ball_color}")
+    if isinstance(source, np.ndarray):
+        if source.ndim == 1:
+            return decode_image(source)
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return decode_image(source)
+    if hasattr(source, 'read'):
+        return decode_image(source.read())
+    return cv2.imread(os.fspath(source))
 
-    img = cv2.imread(image_path)
+def sample_calibration_hsv(processing_img, calibration_point, M=None):
+    """
+    Średni kolor tła (HSV) w małym oknie wokół punktu kalibracji.
+    Jeśli podano M, punkt jest najpierw przenoszony do układu obrazu po warpie.
+    Zwraca krotkę (h, s, v) lub None.
+    """
+    if not calibration_point:
+        return None
+    try:
+        if M is not None:
+            calib_x, calib_y = transform_point_forward(calibration_point['x'], calibration_point['y'], M)
+        else:
+            calib_x, calib_y = int(calibration_point['x']), int(calibration_point['y'])
+        calib_x = max(0, min(calib_x, processing_img.shape[1] - 1))
+        calib_y = max(0, min(calib_y, processing_img.shape[0] - 1))
+        roi_c = processing_img[max(0, calib_y - 2):min(processing_img.shape[0], calib_y + 3),
+                               max(0, calib_x - 2):min(processing_img.shape[1], calib_x + 3)]
+        if roi_c.size > 0:
+            roi_hsv = cv2.cvtColor(roi_c, cv2.COLOR_BGR2HSV)
+            calib_hsv = cv2.mean(roi_hsv)[:3]
+            logger.info(f"Skalibrowano tło (HSV): {calib_hsv}")
+            return calib_hsv
+    except Exception as e:
+        logger.warning(f"Problem z kalibracją: {e}")
+    return None
+
+def detect_all_balls(image, api_key=None, cue_ball_color="White", table_area=None, calibration_point=None,
+                     session=None, pyramid_levels=0, timer=None):
+    """
+    Cienka nakładka: przyjmuje ścieżkę, bufor w pamięci, strumień albo gotowy obraz
+    (patrz load_image) i wywołuje detect_balls_in_image.
+    Zwraca: cue_ball (dict or None), other_balls (list of dicts), all_detected_balls (list of dicts)
+    """
+    with timed(timer, "decode"):
+        img = load_image(image)
     if img is None:
         raise ValueError("Błąd odczytu pliku")
+    return detect_balls_in_image(img, cue_ball_color=cue_ball_color, table_area=table_area,
+                                 calibration_point=calibration_point, session=session,
+                                 pyramid_levels=pyramid_levels, timer=timer)
+
+def detect_balls_in_image(img, cue_ball_color="White", table_area=None, calibration_point=None, session=None,
+                          pyramid_levels=0, timer=None):
+    """Detekcja bil na zdekodowanym obrazie BGR detektorem bieżącego wątku (patrz BallDetector.detect)."""
+    return get_detector().detect(img, cue_ball_color=cue_ball_color, table_area=table_area,
+                                 calibration_point=calibration_point, session=session,
+                                 pyramid_levels=pyramid_levels, timer=timer)
+
+class BallDetector:
+    """
+    Detektor bil wielokrotnego użytku: CLAHE, LUT gamma do klasyfikacji koloru i bufory robocze
+    preprocessingu (szarość, CLAHE, rozmycie, piramida) tworzone raz i używane dla kolejnych klatek.
+    Bufory są przydzielane na nowo tylko przy zmianie rozmiaru klatki.
+    Nie jest bezpieczny wątkowo - get_detector() daje osobny egzemplarz na wątek.
+    """
+
+    def __init__(self, clip_limit=CLAHE_CLIP_LIMIT, tile_grid=CLAHE_TILE_GRID, gamma=CLASSIFY_GAMMA):
+        self.clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid)
+        self.gamma = gamma
+        self.gamma_lut = gamma_table(gamma)
+        self._buffers = {}
+
+    def _buffer(self, name, shape, dtype=np.uint8):
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = self._buffers[name] = np.empty(shape, dtype=dtype)
+        return buf
+
+    def preprocess(self, detect_img, session=None, processing_img=None):
+        """
+        Szarość -> (zamalowanie otworów łuz sesji) -> CLAHE -> rozmycie Gaussa, w buforach detektora.
+        Zwraca (gray_enhanced, gray_blurred) - widoki buforów ważne do następnej klatki.
+        """
+        shape = detect_img.shape[:2]
+        gray = cv2.cvtColor(detect_img, cv2.COLOR_BGR2GRAY, dst=self._buffer("gray", shape))
+        if session is not None:
+            # otwory łuz (sesje z łuzami) zamalowane kolorem sukna - ich krawędzie dają fałszywe okręgi
+            gray = session.mask_pockets(gray, processing_img)
+        gray_enhanced = self.clahe.apply(gray, dst=self._buffer("clahe", shape))
+        gray_blurred = cv2.GaussianBlur(gray_enhanced, BLUR_KSIZE, BLUR_SIGMA, dst=self._buffer("blur", shape))
+        return gray_enhanced, gray_blurred
+
+    def warm_up(self):
+        """Jedno przejście detekcji na pustym obrazie - inicjalizacja HoughCircles i buforów OpenCV."""
+        self.detect(np.zeros((64, 64, 3), dtype=np.uint8))
+
+    def detect(self, img, cue_ball_color="White", table_area=None, calibration_point=None, session=None,
+               pyramid_levels=0, timer=None):
+        """
+        Detekcja bil na zdekodowanym obrazie BGR (np.ndarray).
+        session (CalibrationSession) - jeśli podana, zastępuje table_area/calibration_point
+        i dostarcza z cache macierze, mapy warpa, kolor tła i maskę stołu.
+        pyramid_levels - 0 = detekcja w pełnej rozdzielczości; N > 0 = Hough na obrazie
+        zmniejszonym 2^N razy i doprecyzowanie środka/promienia/koloru w ROI pełnej rozdzielczości.
+        N jest obniżane tak, żeby zmniejszony obraz miał co najmniej PYRAMID_MIN_WIDTH px szerokości.
+        timer (StageTimer) - opcjonalnie zbiera czasy etapów; czasy są też logowane.
+        Zwraca: cue_ball (dict or None), other_balls (list of dicts), all_detected_balls (list of dicts)
+        Każda bila: {"x": int, "y": int, "r": int, "class": "Red", "confidence": 0.9}
+        """
+        logger.info(f"Detekcja OpenCV... Szukam: {cue_ball_color}")
+        if timer is None:
+            timer = StageTimer()
+        pyramid_levels = max(0, int(pyramid_levels or 0))
+
+        # Warp jeśli podano table_area (z sesji - gotowe mapy remap i kolor tła)
+        hull = None
+        with timer.stage("warp"):
+            if session is not None:
+                processing_img = session.warp(img, dst=self._buffer("warp", (session.size[1], session.size[0], 3)))
+                M, M_inv = session.M, session.M_inv
+                calib_hsv = session.calibration_hsv(processing_img)
+            elif table_area and len(table_area) == 4:
+                processing_img, M, M_inv = warp_perspective(img, table_area)
+                calib_hsv = sample_calibration_hsv(processing_img, calibration_point, M)
+                hull = table_hull(table_area)
+            else:
+                processing_img = img
+                M_inv = None
+                M = None
+                calib_hsv = None
+                hull = table_hull(table_area)
+
+        # Piramida: Hough na zmniejszonym obrazie (parametry dostrojone do ~640-800 px),
+        # potem doprecyzowanie w małych ROI pełnej rozdzielczości
+        requested_levels = pyramid_levels
+        pyramid_levels = effective_pyramid_levels(pyramid_levels, processing_img.shape[1])
+        if pyramid_levels != requested_levels:
+            logger.debug(f"Piramida: {requested_levels} -> {pyramid_levels} poziomów "
+                         f"(szerokość {processing_img.shape[1]} px)")
+        scale = 2 ** pyramid_levels
+        detect_img = processing_img
+        if pyramid_levels:
+            with timer.stage("pyramid"):
+                # INTER_AREA - tak samo jak skalowanie po stronie klienta, dla którego dobrano parametry
+                h, w = processing_img.shape[:2]
+                size = (max(1, round(w / scale)), max(1, round(h / scale)))
+                detect_img = cv2.resize(processing_img, size, dst=self._buffer("pyramid", (size[1], size[0], 3)),
+                                        interpolation=cv2.INTER_AREA)
 
-    # Warp jeśli podano table_area
-    if table_area and len(table_area) == 4:
-        processing_img, M, M_inv = warp_perspective(img, table_area)
-        calib_hsv = None
-        if calibration_point:
+        # Preprocessing (bez gamma/HSV całej klatki - kolor liczony tylko z ROI bil)
+        with timer.stage("preprocess"):
+            gray_enhanced, gray_blurred = self.preprocess(detect_img, session, processing_img)
+
+        circles = hough_cascade(gray_blurred, timer, scale)
+
+        # Fallback: jeśli Hough nic nie znalazł -> kontury + minEnclosingCircle
+        if circles is None:
+            logger.info("Fallback: używam adaptiveThreshold + kontury")
+            circles = []
             try:
-                calib_x, calib_y = transform_point_forward(calibration_point['x'], calibration_point['y'], M)
-                calib_x = max(0, min(calib_x, processing_img.shape[1] - 1))
-                calib_y = max(0, min(calib_y, processing_img.shape[0] - 1))
-                roi_c = processing_img[max(0, calib_y - 2):min(processing_img.shape[0], calib_y + 3),
-                                       max(0, calib_x - 2):min(processing_img.shape[1], calib_x + 3)]
-                if roi_c.size > 0:
-                    roi_hsv = cv2.cvtColor(roi_c, cv2.COLOR_BGR2HSV)
-                    calib_hsv = cv2.mean(roi_hsv)[:3]
-                    logger.info(f"Skalibrowano tło (HSV): {calib_hsv}")
+                with timer.stage("fallback"):
+                    thresh = cv2.adaptiveThreshold(gray_enhanced, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                                   cv2.THRESH_BINARY_INV, 11, 2,
+                                                   dst=self._buffer("fallback", gray_enhanced.shape))
+                    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                    for cnt in contours:
+                        (x, y), r = cv2.minEnclosingCircle(cnt)
+                        if 8 / scale < r < 80 / scale:
+                            circles.append([int(x), int(y), int(r)])
+                if len(circles) == 0:
+                    circles = None
+                else:
+                    circles = np.array(circles, dtype=int)
             except Exception as e:
-                logger.warning(f"Problem z kalibracją: {e}")
-    else:
-        processing_img = img
-        M_inv = None
-        M = None
-        calib_hsv = None
-
-    # Preprocessing
-    enhanced_color_img = adjust_gamma(processing_img, gamma=1.6)
-    gray = cv2.cvtColor(processing_img, cv2.COLOR_BGR2GRAY)
-    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-    gray_enhanced = clahe.apply(gray)
-    gray_blurred = cv2.GaussianBlur(gray_enhanced, (9, 9), 2)
-
-    # Hough params (różne czułości)
-    circle_params = [
-        {"param2": 22, "minDist": 25},
-        {"param2": 18, "minDist": 25},
-        {"param2": 15, "minDist": 20},
-    ]
-
-    circles = None
-    for params in circle_params:
-        circles_found = cv2.HoughCircles(
-            gray_blurred, cv2.HOUGH_GRADIENT, dp=1,
-            minDist=params["minDist"],
-            param1=40,
-            param2=params["param2"],
-            minRadius=8, maxRadius=70
-        )
-        if circles_found is not None and len(circles_found[0]) > 0:
-            circles = np.round(circles_found[0, :]).astype("int")
-            logger.info(f"Znaleziono okręgi przy param: {params}")
-            break
-
-    # Fallback: jeśli Hough nic nie znalazł -> kontury + minEnclosingCircle
-    if circles is None:
-        logger.info("Fallback: używam adaptiveThreshold + kontury")
-        circles = []
-        try:
-            thresh = cv2.adaptiveThreshold(gray_enhanced, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
-                                           cv2.THRESH_BINARY_INV, 11, 2)
-            contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            for cnt in contours:
-                (x, y), r = cv2.minEnclosingCircle(cnt)
-                if 8 < r < 80:
-                    circles.append([int(x), int(y), int(r)])
-            if len(circles) == 0:
+                logger.warning(f"Fallback error: {e}")
                 circles = None
-            else:
-                circles = np.array(circles, dtype=int)
-        except Exception as e:
-            logger.warning(f"Fallback error: {e}")
-            circles = None
-
-    cue_ball = None
-    other_balls = []
-    all_detected_balls = []
-    target_color_lower = cue_ball_color.lower()
-    hsv_img = cv2.cvtColor(enhanced_color_img, cv2.COLOR_BGR2HSV)
-
-    if circles is not None and len(circles) > 0:
-        # Usuń dublujące się okręgi
-        raw_circles = circles
-        clean_circles = filter_overlapping_circles(raw_circles, min_dist=20)
-        logger.info(f"Po filtracji duplikatów: {len(raw_circles)} -> {len(clean_circles)}")
-
-        for (x, y, r) in clean_circles:
-            # filtry prostoty
-            if r < 8 or r > 80:
-                continue
-
-            roi_size = int(max(6, r / 2.5))
-            y1, y2 = max(0, y - roi_size), min(processing_img.shape[0], y + roi_size)
-            x1, x2 = max(0, x - roi_size), min(processing_img.shape[1], x + roi_size)
-
-            detected_color = "unknown"
-            is_background = False
-
-            if y2 > y1 and x2 > x1:
-                roi = hsv_img[y1:y2, x1:x2]
-                if roi.size == 0:
-                    continue
-                ball_mean_hsv = cv2.mean(roi)[:3]
-
-                # Filtracja tła względem skalibrowanego HSV (jeśli podano)
-                if calib_hsv is not None:
-                    diff_h = abs(ball_mean_hsv[0] - calib_hsv[0])
-                    if diff_h > 90:
-                        diff_h = 180 - diff_h
-                    if diff_h <= 15 and abs(ball_mean_hsv[1] - calib_hsv[1]) <= 80 and abs(ball_mean_hsv[2] - calib_hsv[2]) <= 80:
-                        is_background = True
-
-                # filtr cieni: niska jasność i niskie nasycenie
-                if not is_background:
-                    if ball_mean_hsv[2] < 40 and ball_mean_hsv[1] < 60:
-                        # prawdopodobny cień - pomijamy
-                        is_background = True
-
-                if not is_background:
-                    detected_color = get_ball_color(roi)
-
-            if is_background:
-                continue
-
-            # Powrót do współrzędnych oryginalnego obrazu jeśli był warp
-            if M_inv is not None:
-                try:
-                    orig_x, orig_y = transform_point_back(x, y, M_inv)
-                    scale_check_x, _ = transform_point_back(x + r, y, M_inv)
-                    orig_r = abs(scale_check_x - orig_x)
-                    if orig_r <= 0:
-                        orig_r = r
-                except Exception as e:
-                    logger.debug(f"Transform back error: {e}")
-                    orig_x, orig_y, orig_r = int(x), int(y), int(r)
-            else:
-                orig_x, orig_y, orig_r = int(x), int(y), int(r)
-
-            # Sprawdź czy punkt jest w obszarze stołu (jeśli podano)
-            if table_area and not is_point_inside_table_area({"x": orig_x, "y": orig_y}, table_area):
-                logger.debug(f"Bila poza stołem: {(orig_x, orig_y)}, ignoruję")
-                continue
-
-            # Confidence prosty: większy promień = większe prawdopodobieństwo
-            conf = max(0.25, min(1.0, orig_r / 70.0))
-
-            # normalizacja nazwy klasy (capitalize) - ułatwia front-end (Swift oczekuje np. "White")
-            detected_color_normalized = detected_color.capitalize() if isinstance(detected_color, str) else "Unknown"
-
-            ball_data = {
-                "x": int(orig_x),
-                "y": int(orig_y),
-                "r": int(max(4, orig_r)),
-                "class": detected_color_normalized,
-                "confidence": float(conf)
-            }
-            all_detected_balls.append(ball_data)
-
-            # rozdzielenie cue ball / others
-            if detected_color.lower() == target_color_lower:
-                if cue_ball is None:
-                    cue_ball = ball_data
+
+        cue_ball = None
+        other_balls = []
+        all_detected_balls = []
+        target_color_lower = cue_ball_color.lower()
+        if circles is not None and len(circles) > 0:
+            # Usuń dublujące się okręgi
+            raw_circles = circles
+            with timer.stage("dedup"):
+                clean_circles = filter_overlapping_circles(raw_circles, min_dist=20 / scale)
+            logger.info(f"Po filtracji duplikatów: {len(raw_circles)} -> {len(clean_circles)}")
+
+            # filtry prostoty (progi przeliczone na skalę, w której działał Hough)
+            clean_circles = [c for c in clean_circles if 8 / scale <= c[2] <= 80 / scale]
+            if pyramid_levels:
+                with timer.stage("refine"):
+                    clean_circles = refine_circles(processing_img, clean_circles, scale)
+                # po przeskalowaniu promień musi mieścić się w zakresie pełnej rozdzielczości
+                clean_circles = [c for c in clean_circles if MIN_BALL_RADIUS <= c[2] <= MAX_BALL_RADIUS]
+
+            with timer.stage("classify"):
+                balls = classify_circles(processing_img, clean_circles, calib_hsv, lut=self.gamma_lut)
+
+            with timer.stage("backproject"):
+                balls = project_balls_back(balls, M_inv)
+                # Sprawdź czy punkt jest w obszarze stołu (jeśli podano)
+                if session is not None:
+                    on_table = session.contains_points(balls[:, :2], img.shape)
+                else:
+                    on_table = points_inside_hull(balls[:, :2], hull)
+                if not np.all(on_table):
+                    logger.debug(f"Bile poza stołem: {balls[~on_table, :2].tolist()}, ignoruję")
+                balls = balls[on_table]
+
+            for orig_x, orig_y, orig_r, color_id in balls:
+                detected_color = COLOR_NAMES[color_id]
+
+                # Confidence prosty: większy promień = większe prawdopodobieństwo
+                conf = max(0.25, min(1.0, orig_r / float(MAX_BALL_RADIUS)))
+
+                # normalizacja nazwy klasy (capitalize) - ułatwia front-end (Swift oczekuje np. "White")
+                detected_color_normalized = detected_color.capitalize()
+
+                ball_data = {
+                    "x": int(orig_x),
+                    "y": int(orig_y),
+                    "r": int(max(4, orig_r)),
+                    "class": detected_color_normalized,
+                    "confidence": float(conf)
+                }
+                all_detected_balls.append(ball_data)
+
+                # rozdzielenie cue ball / others
+                if detected_color == target_color_lower:
+                    if cue_ball is None:
+                        cue_ball = ball_data
+                    else:
+                        other_balls.append(ball_data)
                 else:
                     other_balls.append(ball_data)
-            else:
-                other_balls.append(ball_data)
 
-    # Sortowanie opcjonalne po pewności/promieniu
-    all_detected_balls = sorted(all_detected_balls, key=lambda b: b['confidence'], reverse=True)
+        # Sortowanie opcjonalne po pewności/promieniu
+        all_detected_balls = sorted(all_detected_balls, key=lambda b: b['confidence'], reverse=True)
+        logger.info(f"Czasy etapów [ms] (piramida={pyramid_levels}): {timer.summary()}")
 
-    return cue_ball, other_balls, all_detected_balls
+        return cue_ball, other_balls, all_detected_balls
 
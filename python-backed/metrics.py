@@ -0,0 +1,151 @@
+import bisect
+import threading
+
+# Przedziały histogramów czasu (sekundy) - od pojedynczych etapów (ms) po całe requesty
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _labels_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    """Wspólna część metryk: nazwa, opis, etykiety i blokada (metryki są aktualizowane z wielu wątków)."""
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: oczekiwane etykiety {self.labelnames}, podano {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    """Licznik rosnący (np. liczba requestów)."""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels_text(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+class Gauge(_Metric):
+    """Wartość chwilowa; z callback wartość jest odczytywana dopiero przy eksporcie (np. głębokość kolejki)."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, callback=None):
+        super().__init__(name, help_text)
+        self.callback = callback
+
+    def set(self, value):
+        with self._lock:
+            self._values[()] = value
+
+    def render(self):
+        if self.callback is not None:
+            value = self.callback()
+        else:
+            with self._lock:
+                value = self._values.get((), 0)
+        return self.header() + [f"{self.name} {_number(value)}"]
+
+class Histogram(_Metric):
+    """Histogram kumulatywny w formacie Prometheusa (_bucket / _sum / _count)."""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, ([*counts], total, n)) for k, (counts, total, n) in self._values.items())
+        lines = self.header()
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _labels_text(self.labelnames, key, [("le", _number(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _labels_text(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {n}")
+        return lines
+
+class Registry:
+    """Zbiór metryk eksportowanych razem przez /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Tekstowy format ekspozycji Prometheusa (text/plain; version=0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "billiards_requests_total", "Liczba requestów HTTP wg endpointu i kodu odpowiedzi.", ("endpoint", "status")))
+ERRORS = REGISTRY.register(Counter(
+    "billiards_request_errors_total", "Requesty zakończone błędem (4xx/5xx) wg endpointu i kodu.", ("endpoint", "status")))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "billiards_request_duration_seconds", "Czas obsługi requestu.", ("endpoint",)))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "billiards_stage_duration_seconds", "Czas etapów detekcji i obliczania strzałów.", ("endpoint", "stage")))
+
+def observe_request(endpoint, status, seconds, timer=None):
+    """Zapisuje jeden obsłużony request: licznik, błędy, czas całkowity i czasy etapów z StageTimer."""
+    endpoint = endpoint or "unknown"
+    REQUESTS.inc(endpoint=endpoint, status=status)
+    if status >= 400:
+        ERRORS.inc(endpoint=endpoint, status=status)
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+    if timer is not None:
+        for stage, ms in timer.stages.items():
+            STAGE_SECONDS.observe(ms / 1000.0, endpoint=endpoint, stage=stage)
+
+def register_gauge(name, help_text, callback):
+    """Gauge odczytywany przy eksporcie (np. głębokość kolejki puli detekcji)."""
+    return REGISTRY.register(Gauge(name, help_text, callback))
@@ -0,0 +1,381 @@
+"""
+Zdarzeniowa symulacja ruchu bil (2D) do przewidywania skutku strzału: gdzie zatrzyma się biała,
+które bile wpadną, czy biała wpadnie do łuzy (scratch).
+
+Model:
+- bile toczą się po prostej ze stałym opóźnieniem (opór toczenia), a = DECEL,
+- zderzenie bila-bila: wymiana składowych normalnych (współczynnik restytucji BALL_RESTITUTION),
+  potem przejście w toczenie: v = 5/7 w + 2/7 spin * u (u - prędkość przed zderzeniem, w - po;
+  spin = 1 toczenie, 0 stop/stun, -1 wsteczna) - dla białej daje to regułę 30° przy toczeniu,
+- banda: odbicie składowej normalnej (CUSHION_RESTITUTION); jeśli punkt styku z bandą leży w wylocie
+  łuzy (odległość od środka łuzy < CORNER_CAPTURE / SIDE_CAPTURE promieni), bila wpada.
+Zamiast stałego kroku czasu symulacja skacze od zdarzenia do zdarzenia: dla każdej bili czas zatrzymania,
+dla każdej pary bil pierwszy pierwiastek wielomianu 4. stopnia |Δp(t)|² = (2R)² (wszystkie pary naraz -
+wartości własne macierzy towarzyszących), dla band - równanie kwadratowe. Wiele strzałów
+(różne kierunki / siły / rotacje) liczonych jest jednocześnie, w jednych tablicach (strzał x bila).
+
+Współrzędne stołu: jeśli table_area ma 4 narożniki, symulacja działa w widoku z góry (warp perspektywy),
+a trasy są rzutowane z powrotem na obraz. Długość stołu = 1, więc siła strzału to droga, jaką biała
+przetoczyłaby się po pustym stole (w długościach stołu).
+"""
+import numpy as np
+import cv2
+from geometry import compute_perspective
+from shot_probability import side_pockets
+
+DECEL = 1.0
+BALL_RESTITUTION = 0.95
+CUSHION_RESTITUTION = 0.75
+ROLL_FRACTION = 2.0 / 7.0
+CORNER_CAPTURE, SIDE_CAPTURE = 2.6, 2.0
+MAX_EVENTS = 64
+# Limit symulowanych wariantów (strzały x siły x rotacje) na jedno wywołanie
+MAX_VARIANTS = 1024
+DEFAULT_SPEED = 1.5
+DEFAULT_SPIN = 1.0
+
+_EPS = 1e-9
+
+class Table:
+    """
+    Geometria stołu w układzie symulacji: wielokąt band (wypukły), łuzy i przekształcenia obraz <-> stół.
+    table_area z 4 narożnikami - widok z góry (prostokąt); inaczej wielokąt = otoczka łuz w układzie obrazu.
+    """
+
+    def __init__(self, pockets, table_area=None):
+        P = np.array([[p['x'], p['y']] for p in pockets], dtype=float).reshape(-1, 2)
+        self.M = self.M_inv = None
+        if table_area and len(table_area) == 4:
+            self.M, self.M_inv, (w, h) = compute_perspective(table_area)
+            polygon = np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]], dtype=float)
+        else:
+            points = P if len(P) >= 3 else np.array([[p['x'], p['y']] for p in table_area or []], dtype=float)
+            if len(points) < 3:
+                raise ValueError("Geometria stołu wymaga table_area albo co najmniej 3 łuz")
+            polygon = cv2.convexHull(points.astype(np.float32)).reshape(-1, 2).astype(float)
+        self.scale = float(np.ptp(polygon, axis=0).max()) or 1.0
+        self.polygon = polygon / self.scale
+        # Bandy: normalne skierowane do wnętrza, wnętrze spełnia n·x - c >= 0
+        edges = np.roll(self.polygon, -1, axis=0) - self.polygon
+        normals = np.column_stack((-edges[:, 1], edges[:, 0]))
+        normals /= np.hypot(*normals.T)[:, None]
+        inside = self.polygon.mean(axis=0)
+        flip = np.sum(normals * (inside - self.polygon), axis=1) < 0
+        normals[flip] *= -1
+        self.normals = normals
+        self.offsets = np.sum(normals * self.polygon, axis=1)
+        self.pockets = self.to_table(P)
+        side, _, _ = side_pockets(self.pockets)
+        self.capture = np.where(side, SIDE_CAPTURE, CORNER_CAPTURE)
+
+    def to_table(self, points):
+        pts = np.asarray(points, dtype=float).reshape(-1, 2)
+        if self.M is not None and len(pts):
+            pts = cv2.perspectiveTransform(pts.reshape(-1, 1, 2).astype(np.float64), self.M).reshape(-1, 2)
+        return pts / self.scale
+
+    def to_image(self, points):
+        pts = np.asarray(points, dtype=float).reshape(-1, 2) * self.scale
+        if self.M_inv is not None and len(pts):
+            pts = cv2.perspectiveTransform(pts.reshape(-1, 1, 2).astype(np.float64), self.M_inv).reshape(-1, 2)
+        return pts
+
+    def ball_radius(self, balls, default=18.0):
+        """Wspólny promień bil w układzie stołu (mediana po przekształceniu promieni z obrazu)."""
+        centers = np.array([[b['x'], b['y']] for b in balls], dtype=float)
+        r = np.array([float(b.get('r', default)) for b in balls])
+        c = self.to_table(centers)
+        ex = self.to_table(centers + np.column_stack((r, np.zeros_like(r))))
+        ey = self.to_table(centers + np.column_stack((np.zeros_like(r), r)))
+        return float(np.median(0.5 * (np.hypot(*(ex - c).T) + np.hypot(*(ey - c).T))))
+
+def _first_quadratic_root(a, b, c):
+    """
+    Najmniejszy t >= 0 dla a t² + b t + c = 0, w którym wartość maleje (2 a t + b < 0) - wejście
+    w bandę / zbliżanie się; inf, jeśli brak. Już w kolizji (c <= 0) i dalej się zbliża => 0.
+    """
+    t = np.full(np.shape(c), np.inf)
+    quad = np.abs(a) > _EPS
+    disc = b * b - 4 * a * c
+    sq = np.sqrt(np.maximum(disc, 0.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for root in ((-b - sq) / (2 * a), (-b + sq) / (2 * a)):
+            ok = quad & (disc >= 0) & (root >= 0) & (2 * a * root + b < 0)
+            t = np.where(ok, np.minimum(t, root), t)
+        linear = ~quad & (b < 0)
+        t = np.where(linear, np.minimum(t, np.maximum(-c / b, 0.0)), t)
+    return np.where((c <= 0) & (b < 0), 0.0, t)
+
+def _collision_times(D, V, A, dist):
+    """
+    Pierwszy czas zderzenia dla K par: |D + V t + A t²/2|² = dist², t >= 0, pary się zbliżają.
+    Wielomian 4. stopnia rozwiązywany wsadowo (wartości własne macierzy towarzyszących 4 x 4),
+    pierwiastki rzeczywiste doprecyzowane krokiem Newtona. Zwraca (K,) - inf, gdy brak zderzenia.
+    """
+    c4 = 0.25 * np.sum(A * A, axis=1)
+    c3 = np.sum(A * V, axis=1)
+    c2 = np.sum(V * V, axis=1) + np.sum(A * D, axis=1)
+    c1 = 2.0 * np.sum(V * D, axis=1)
+    c0 = np.sum(D * D, axis=1) - dist * dist
+    t = np.full(len(D), np.inf)
+
+    quartic = c4 > _EPS * (np.abs(c2) + np.abs(c1) + 1.0)
+    if quartic.any():
+        q = np.flatnonzero(quartic)
+        coef = np.column_stack((c3[q], c2[q], c1[q], c0[q])) / c4[q, None]
+        companion = np.zeros((len(q), 4, 4))
+        companion[:, 0, :] = -coef
+        companion[:, 1, 0] = companion[:, 2, 1] = companion[:, 3, 2] = 1.0
+        roots = np.linalg.eigvals(companion)
+        real = np.abs(roots.imag) <= 1e-6 * (1.0 + np.abs(roots.real))
+        r = roots.real
+        poly = lambda x: (((c4[q, None] * x + c3[q, None]) * x + c2[q, None]) * x + c1[q, None]) * x + c0[q, None]
+        deriv = lambda x: ((4 * c4[q, None] * x + 3 * c3[q, None]) * x + 2 * c2[q, None]) * x + c1[q, None]
+        for _ in range(2):
+            d = deriv(r)
+            r = np.where(np.abs(d) > _EPS, r - poly(r) / np.where(np.abs(d) > _EPS, d, 1.0), r)
+        ok = real & (r >= 0) & (deriv(r) < 0)
+        t[q] = np.where(ok, r, np.inf).min(axis=1)
+    rest = ~quartic
+    if rest.any():
+        # brak względnego przyspieszenia - zwykłe równanie kwadratowe
+        t[rest] = _first_quadratic_root(c2[rest], c1[rest], c0[rest])
+    return np.where((c0 <= 0) & (c1 < 0), 0.0, t)
+
+def simulate(table, positions, radius, cue_velocity, spin=DEFAULT_SPIN, max_events=MAX_EVENTS):
+    """
+    Symuluje S strzałów na tym samym układzie bil (bila 0 = biała).
+    positions (N x 2) i radius w układzie stołu, cue_velocity (S x 2), spin - liczba albo (S,).
+    Zwraca dict tablic: position (S x N x 2) - pozycje końcowe, pocket (S x N) - indeks łuzy (-1 = na stole),
+    events (S,), paths - dla każdego strzału {indeks bili: [punkty trasy]} (tylko bile, które się ruszyły).
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    cue_velocity = np.asarray(cue_velocity, dtype=float).reshape(-1, 2)
+    n, s = len(positions), len(cue_velocity)
+    pos = np.repeat(positions[None], s, axis=0)
+    vel = np.zeros_like(pos)
+    vel[:, 0] = cue_velocity
+    spins = np.ones((s, n))
+    spins[:, 0] = spin
+    alive = np.ones((s, n), dtype=bool)
+    pocket = np.full((s, n), -1)
+    events = np.zeros(s, dtype=int)
+    paths = [{0: [tuple(positions[0])]} for _ in range(s)]
+    iu, ju = np.triu_indices(n, 1)
+    normals, offsets = table.normals, table.offsets
+    n_edges = len(normals)
+    diameter = 2.0 * radius
+    running = np.ones(s, dtype=bool)
+
+    for _ in range(max_events):
+        # Liczymy tylko strzały, w których coś się jeszcze toczy
+        act = np.flatnonzero(running)
+        if len(act) == 0:
+            break
+        p, v, live = pos[act], vel[act], alive[act]
+        speed = np.hypot(v[..., 0], v[..., 1])
+        moving = live & (speed > _EPS)
+        direction = v / np.where(speed > _EPS, speed, 1.0)[..., None]
+        acc = -DECEL * direction * moving[..., None]
+        t_stop = np.where(moving, speed / DECEL, np.inf)
+
+        # Bandy (strzał x bila x banda): n·p(t) - c - R = 0
+        t_cushion = _first_quadratic_root(0.5 * (acc @ normals.T), v @ normals.T, p @ normals.T - offsets - radius)
+        t_cushion[~moving] = np.inf
+
+        # Pary bil: tylko takie, które mogą się spotkać przed zatrzymaniem - bila w spoczynku musi leżeć
+        # bliżej niż 2R od odcinka drogi toczącej się bili (zasięg v² / 2a)
+        reach = np.where(moving, speed * speed / (2 * DECEL), 0.0)
+        D = p[:, ju] - p[:, iu]
+        candidate = live[:, iu] & live[:, ju] & (moving[:, iu] | moving[:, ju])
+        single = candidate & (moving[:, iu] != moving[:, ju])
+        if single.any():
+            # kierunek i zasięg bili w ruchu względem bili w spoczynku (D: od i do j)
+            rel = np.where(moving[:, iu, None], D, -D)
+            d = np.where(moving[:, iu, None], direction[:, iu], direction[:, ju])
+            r = np.maximum(reach[:, iu], reach[:, ju])
+            along = np.clip(np.sum(rel * d, axis=-1), 0.0, r)
+            off = rel - along[..., None] * d
+            candidate &= ~single | (np.hypot(off[..., 0], off[..., 1]) <= diameter + _EPS)
+        both = candidate & moving[:, iu] & moving[:, ju]
+        if both.any():
+            gap = np.hypot(D[..., 0], D[..., 1]) - diameter
+            candidate &= ~both | (gap <= reach[:, iu] + reach[:, ju] + _EPS)
+        t_pair = np.full(candidate.shape, np.inf)
+        if candidate.any():
+            V = v[:, ju] - v[:, iu]
+            A = acc[:, ju] - acc[:, iu]
+            t_pair[candidate] = _collision_times(D[candidate], V[candidate], A[candidate], diameter)
+
+        # Najbliższe zdarzenie w każdym strzale
+        times = np.concatenate((t_stop, t_cushion.reshape(len(act), -1), t_pair), axis=1)
+        first = np.argmin(times, axis=1)
+        dt = times[np.arange(len(act)), first]
+        done = ~np.isfinite(dt)
+        running[act[done]] = False
+        dt[done] = 0.0
+
+        # Ruch do chwili zdarzenia (bila, która się zatrzymuje, staje dokładnie w punkcie zatrzymania)
+        te = np.where(moving, np.minimum(dt[:, None], t_stop), 0.0)
+        p += v * te[..., None] + 0.5 * acc * (te * te)[..., None]
+        v += acc * te[..., None]
+        v[moving & (te >= t_stop - _EPS)] = 0.0
+        pos[act], vel[act] = p, v
+        events[act[~done]] += 1
+
+        # Obsługa zdarzeń - wektorowo dla wszystkich strzałów (w każdym dokładnie jedno zdarzenie)
+        ks, idx = act[~done], first[~done]
+        stop = idx < n
+        for k, ball in zip(ks[stop], idx[stop]):
+            _add_point(paths[k], ball, pos[k, ball])
+
+        cushion = ~stop & (idx < n + n * n_edges)
+        if cushion.any():
+            kc = ks[cushion]
+            ball, edge = np.divmod(idx[cushion] - n, n_edges)
+            normal = normals[edge]
+            contact = pos[kc, ball] - radius * normal
+            dist = np.hypot(*(table.pockets[None] - contact[:, None]).transpose(2, 0, 1)) / radius
+            dist = np.where(dist < table.capture, dist, np.inf)
+            captured = np.isfinite(dist).any(axis=1) if dist.shape[1] else np.zeros(len(kc), dtype=bool)
+            vn = np.sum(vel[kc, ball] * normal, axis=1)
+            vel[kc, ball] -= (1.0 + CUSHION_RESTITUTION) * vn[:, None] * normal
+            for k, b in zip(kc[captured], ball[captured]):
+                _add_point(paths[k], b, pos[k, b])
+            if captured.any():
+                kp, bp = kc[captured], ball[captured]
+                target = np.argmin(dist[captured], axis=1)
+                alive[kp, bp] = False
+                vel[kp, bp] = 0.0
+                pocket[kp, bp] = target
+                pos[kp, bp] = table.pockets[target]
+            for k, b in zip(kc, ball):
+                _add_point(paths[k], b, pos[k, b])
+
+        collide = ~stop & ~cushion
+        if collide.any():
+            kb = ks[collide]
+            pair = idx[collide] - n - n * n_edges
+            i, j = iu[pair], ju[pair]
+            normal = pos[kb, j] - pos[kb, i]
+            normal /= np.maximum(np.hypot(normal[:, 0], normal[:, 1]), _EPS)[:, None]
+            u_i, u_j = vel[kb, i], vel[kb, j]
+            vin, vjn = np.sum(u_i * normal, axis=1), np.sum(u_j * normal, axis=1)
+            e = BALL_RESTITUTION
+            w_i = u_i + (0.5 * ((1 - e) * vin + (1 + e) * vjn) - vin)[:, None] * normal
+            w_j = u_j + (0.5 * ((1 + e) * vin + (1 - e) * vjn) - vjn)[:, None] * normal
+            # poślizg po zderzeniu wygasa - bila przechodzi w toczenie
+            vel[kb, i] = (1 - ROLL_FRACTION) * w_i + ROLL_FRACTION * spins[kb, i, None] * u_i
+            vel[kb, j] = (1 - ROLL_FRACTION) * w_j + ROLL_FRACTION * spins[kb, j, None] * u_j
+            spins[kb, i] = spins[kb, j] = 1.0
+            for k, a, b in zip(kb, i, j):
+                _add_point(paths[k], a, pos[k, a])
+                _add_point(paths[k], b, pos[k, b])
+
+    # końcowe punkty tras (bile przerwane limitem zdarzeń - bieżąca pozycja)
+    for k in range(s):
+        for ball in paths[k]:
+            _add_point(paths[k], ball, pos[k, ball])
+    return {"position": pos, "pocket": pocket, "events": events, "paths": paths}
+
+def _add_point(path, ball, point):
+    """Dopisuje wierzchołek trasy bili (pomija powtórzony punkt)."""
+    points = path.setdefault(ball, [])
+    x, y = float(point[0]), float(point[1])
+    if not points or abs(points[-1][0] - x) > _EPS or abs(points[-1][1] - y) > _EPS:
+        points.append((x, y))
+
+def _segments(points):
+    pts = np.rint(points).astype(int)
+    return [{"start": {"x": int(a[0]), "y": int(a[1])}, "end": {"x": int(b[0]), "y": int(b[1])}}
+            for a, b in zip(pts[:-1], pts[1:]) if (a != b).any()]
+
+def simulate_shots(white_ball, other_balls, pockets, shots, table_area=None, speed=DEFAULT_SPEED,
+                   spin=DEFAULT_SPIN, max_events=MAX_EVENTS):
+    """
+    Symuluje strzały z rank_shots (biała uderzona w kierunku ghost ball, przy kicku - punktu odbicia) - wszystkie naraz.
+    speed / spin - liczba albo lista (po jednej wartości na strzał).
+    Zwraca listę (w kolejności shots) wyników:
+      {"made": bila docelowa w wybranej łuzie, "scratch": biała w łuzie, "pocketed": [{"ball", "pocket"}],
+       "cue_ball_end": {"x", "y"} | None, "shot_lines": trasy bil (biała pierwsza) w formacie shot_lines,
+       "events": liczba zdarzeń}
+    """
+    if not shots:
+        return []
+    table = Table(pockets, table_area)
+    balls = [white_ball] + list(other_balls)
+    centers = np.array([[b['x'], b['y']] for b in balls], dtype=float)
+    positions = table.to_table(centers)
+    radius = table.ball_radius(balls)
+
+    # kierunek uderzenia: ghost ball, a przy kicku (biała od bandy) - punkt odbicia
+    aim_at = [sh["cushion"] if sh.get("shot_type") == "kick" else sh["ghost_ball"]["center"] for sh in shots]
+    ghost = table.to_table([[p['x'], p['y']] for p in aim_at])
+    aim = ghost - positions[0]
+    aim /= np.maximum(np.hypot(*aim.T), _EPS)[:, None]
+    speed = np.broadcast_to(np.asarray(speed, dtype=float), (len(shots),))
+    result = simulate(table, positions, radius, aim * np.sqrt(2.0 * DECEL * speed)[:, None],
+                      spin=np.broadcast_to(np.asarray(spin, dtype=float), (len(shots),)), max_events=max_events)
+
+    P = np.array([[p['x'], p['y']] for p in pockets], dtype=float).reshape(-1, 2)
+    out = []
+    for k, sh in enumerate(shots):
+        # bila docelowa i łuza strzału wg współrzędnych (strzały mogą pochodzić z JSON / cache)
+        tb = sh["target_ball"]
+        target = 1 + int(np.argmin(np.hypot(centers[1:, 0] - tb['x'], centers[1:, 1] - tb['y'])))
+        aimed = int(np.argmin(np.hypot(P[:, 0] - sh["pocket"]['x'], P[:, 1] - sh["pocket"]['y'])))
+        pocketed = result["pocket"][k]
+        lines = []
+        for ball in sorted(result["paths"][k]):
+            lines.extend(_segments(table.to_image(result["paths"][k][ball])))
+        cue_end = table.to_image(result["position"][k, 0])[0]
+        out.append({
+            "made": bool(pocketed[target] == aimed),
+            "scratch": bool(pocketed[0] >= 0),
+            "pocketed": [{"ball": balls[b], "pocket": pockets[pocketed[b]]} for b in np.flatnonzero(pocketed >= 0)],
+            "cue_ball_end": None if pocketed[0] >= 0 else {"x": int(round(cue_end[0])), "y": int(round(cue_end[1]))},
+            "shot_lines": lines,
+            "events": int(result["events"][k]),
+        })
+    return out
+
+def simulation_options(value):
+    """
+    Opcja "simulate" z requestu: true albo {"speed": liczba | lista, "spin": liczba | lista}.
+    Zwraca (speeds, spins) albo None (bez symulacji). ValueError przy złym formacie.
+    """
+    if value is None or value is False:
+        return None
+    if value is True:
+        value = {}
+    if not isinstance(value, dict):
+        raise ValueError("simulate musi być true albo obiektem {speed, spin}")
+    options = []
+    for name, default, low, high in (("speed", DEFAULT_SPEED, 0.05, 10.0), ("spin", DEFAULT_SPIN, -1.0, 1.0)):
+        raw = value.get(name, default)
+        values = raw if isinstance(raw, list) else [raw]
+        if not values or len(values) > 16 or not all(
+                isinstance(v, (int, float)) and not isinstance(v, bool) and low <= v <= high for v in values):
+            raise ValueError(f"simulate.{name}: od 1 do 16 liczb w zakresie {low}..{high}")
+        options.append([float(v) for v in values])
+    return tuple(options)
+
+def simulate_best_variant(white_ball, other_balls, pockets, shots, table_area=None, speeds=(DEFAULT_SPEED,),
+                          spins=(DEFAULT_SPIN,), max_events=MAX_EVENTS):
+    """
+    Każdy strzał symulowany dla wszystkich kombinacji siły i rotacji (jedno wywołanie simulate_shots).
+    Dla każdego strzału zwraca pierwszy wariant, w którym bila wpada, a biała nie (kolejność: speeds, potem
+    spins), a jeśli takiego nie ma - pierwszy wariant. Wynik jak z simulate_shots plus "speed" i "spin".
+    """
+    variants = [(speed, spin) for speed in speeds for spin in spins]
+    if len(shots) * len(variants) > MAX_VARIANTS:
+        raise ValueError(f"Za dużo wariantów symulacji ({len(shots) * len(variants)} > {MAX_VARIANTS})")
+    results = simulate_shots(white_ball, other_balls, pockets, [sh for sh in shots for _ in variants],
+                             table_area=table_area, speed=[v[0] for v in variants] * len(shots),
+                             spin=[v[1] for v in variants] * len(shots), max_events=max_events)
+    best = []
+    for k in range(len(shots)):
+        options = [dict(res, speed=speed, spin=spin)
+                   for res, (speed, spin) in zip(results[k * len(variants):(k + 1) * len(variants)], variants)]
+        best.append(next((o for o in options if o["made"] and not o["scratch"]), options[0]))
+    return best
@@ -0,0 +1,119 @@
+import json
+import hashlib
+import numpy as np
+import cv2
+from cache import TTLCache
+from config import RESULT_CACHE_SIZE, RESULT_CACHE_TTL, RESULT_CACHE_PHASH, SHOT_SCORING, SHOT_TYPES
+from color_detection import COLOR_NAMES
+from metrics import REGISTRY, Counter
+from shot_calculation import rank_shots
+
+# Wyniki adresowane treścią: ta sama klatka / ten sam stan stołu => bez OpenCV i bez obliczeń
+detection_cache = TTLCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+shot_cache = TTLCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "billiards_cache_lookups_total", "Odczyty cache wyników wg cache i wyniku (hit/miss).", ("cache", "result")))
+
+CLASS_NAMES = tuple(name.capitalize() for name in COLOR_NAMES)
+_CLASS_INDEX = {name: i for i, name in enumerate(CLASS_NAMES)}
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Nie da się zserializować {type(value).__name__}")
+
+def canonical_json(value):
+    """Deterministyczny JSON (posortowane klucze, bez spacji) - podstawa kluczy cache."""
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), default=_json_default)
+
+def _lookup(cache, name, key):
+    value = cache.get(key)
+    CACHE_LOOKUPS.inc(cache=name, result="hit" if value is not None else "miss")
+    return value
+
+# --- detekcja -------------------------------------------------------------
+
+def detection_params(table_area=None, calibration_point=None, session=None, pyramid_levels=0):
+    """
+    Część klucza detekcji zależna od parametrów (sesja = jej narożniki, punkt kalibracji i łuzy - nie id).
+    """
+    pockets = None
+    if session is not None:
+        table_area, calibration_point, pockets = session.table_area, session.calibration_point, session.pockets
+    return canonical_json({"table_area": table_area, "calibration_point": calibration_point, "pockets": pockets,
+                           "pyramid_levels": pyramid_levels})
+
+def dhash(img, size=16):
+    """Perceptualny hash różnicowy (size x size bitów) - odporny na ponowną kompresję JPEG i szum."""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    return np.packbits(small[:, 1:] > small[:, :-1]).tobytes().hex()
+
+def pack_balls(balls):
+    """Zwarta postać wyniku detekcji: (N, 4) int32 x, y, r, id klasy + (N,) float64 confidence."""
+    ints = np.array([[b['x'], b['y'], b['r'], _CLASS_INDEX.get(b['class'], len(CLASS_NAMES) - 1)]
+                     for b in balls], dtype=np.int32).reshape(-1, 4)
+    confidence = np.array([b['confidence'] for b in balls], dtype=np.float64)
+    return ints, confidence
+
+def unpack_balls(packed):
+    ints, confidence = packed
+    return [{"x": int(x), "y": int(y), "r": int(r), "class": CLASS_NAMES[c], "confidence": float(conf)}
+            for (x, y, r, c), conf in zip(ints.tolist(), confidence.tolist())]
+
+def cached_detect(raw, params, decode, detect):
+    """
+    Detekcja z cache. raw - bajty przesłanego pliku, params - wynik detection_params,
+    decode(raw) -> obraz lub None, detect(img) -> lista bil.
+    Kolejno: SHA-1 bajtów (bez dekodowania), opcjonalnie dHash zdekodowanej klatki, na końcu detekcja.
+    Zwraca (balls, hit); balls = None, jeśli obrazu nie da się zdekodować.
+    """
+    exact_key = ("sha1", hashlib.sha1(raw).hexdigest(), params)
+    packed = _lookup(detection_cache, "detect", exact_key)
+    if packed is not None:
+        return unpack_balls(packed), True
+
+    img = decode(raw)
+    if img is None:
+        return None, False
+    perceptual_key = None
+    if RESULT_CACHE_PHASH:
+        perceptual_key = ("dhash", dhash(img), params)
+        packed = _lookup(detection_cache, "detect_phash", perceptual_key)
+        if packed is not None:
+            detection_cache.set(exact_key, packed)
+            return unpack_balls(packed), True
+
+    balls = detect(img)
+    packed = pack_balls(balls)
+    detection_cache.set(exact_key, packed)
+    if perceptual_key is not None:
+        detection_cache.set(perceptual_key, packed)
+    return balls, False
+
+# --- strzały --------------------------------------------------------------
+
+def cached_rank_shots(white_ball, other_balls, pockets, table_area=None, top_k=None, hull=None, timer=None,
+                      scoring=None, shot_types=None):
+    """
+    rank_shots z cache. Klucz = SHA-1 kanonicznego JSON całego stanu (bile, łuzy, stół, top_k, scoring,
+    shot_types); przechowywany jest gotowy JSON listy strzałów.
+    """
+    state = canonical_json({"white": white_ball, "others": other_balls, "pockets": pockets,
+                            "table_area": table_area, "hull": hull, "top_k": top_k,
+                            "scoring": scoring or SHOT_SCORING, "shot_types": shot_types or SHOT_TYPES})
+    key = hashlib.sha1(state.encode()).hexdigest()
+    stored = _lookup(shot_cache, "shots", key)
+    if stored is not None:
+        return json.loads(stored)
+    shots = rank_shots(white_ball, other_balls, pockets, table_area=table_area, top_k=top_k, hull=hull, timer=timer,
+                       scoring=scoring, shot_types=shot_types)
+    shot_cache.set(key, canonical_json(shots))
+    return shots
+
+def stats():
+    """Statystyki obu cache (hit/miss, zajętość)."""
+    return {"detect": detection_cache.stats(), "shots": shot_cache.stats()}
@@ -1,11 +1,13 @@
 import numpy as np
 import logging
-from geometry import is_point_inside_table_area
+from geometry import table_hull, points_inside_hull, BallGrid, DEFAULT_BALL_RADIUS
+from timing import timed
+from config import SHOT_SCORING, SHOT_TYPES
+from shot_probability import make_probability, MAX_CUT_ANGLE
+from shot_search import search_shots, SEARCH_TYPES
 
 logger = logging.getLogger(__name__)
 
-DEFAULT_BALL_RADIUS = 18
-
 def calculate_cut_angle(white_pt, ghost_pt, pocket_pt):
     """Oblicza kąt cięcia między białą bilą, ghost ball i łuzą."""
     v_shot = np.array([ghost_pt[0] - white_pt[0], ghost_pt[1] - white_pt[1]], dtype=float)
@@ -38,44 +40,210 @@ def calculate_shot_lines(white_ball, target_ball, pocket, ball_radius=None):
     ghost = {"center": {"x": int(P_ghost[0]), "y": int(P_ghost[1])}, "radius": int(ball_radius)}
     return lines, ghost
 
-def find_best_shot(white_ball, other_balls, pockets, table_area=None):
+def evaluate_shots(white_ball, other_balls, pockets, table_area=None, hull=None):
     """
-    Znajduje najlepszy strzał dla białej bili.
-    Zwraca dict z informacjami o najlepszym strzale lub None.
+    Wektorowo ocenia wszystkie pary (bila docelowa x łuza) naraz.
+    hull - gotowa otoczka stołu (np. z sesji kalibracyjnej); jeśli brak, liczona z table_area.
+    Zwraca dict tablic NumPy (n = liczba bil docelowych, m = liczba łuz):
+    ghost (n x m x 2), angle (n x m), shot_dist (n x m), pot_dist (n x m),
+    radius (n,), valid (n x m) - maska par, które są poprawnymi kandydatami.
     """
-    if not white_ball or not other_balls or not pockets:
-        return None
-    best_shot = None
-    min_angle = 180.0
     P_white = np.array([white_ball['x'], white_ball['y']], dtype=float)
-    for target in other_balls:
-        P_target = np.array([target['x'], target['y']], dtype=float)
-        radius = float(target.get('r', DEFAULT_BALL_RADIUS))
-
-        # Jeśli target poza stołem pomiń
-        if table_area and not is_point_inside_table_area(target, table_area):
-            continue
-
-        # Jeśli target bardzo blisko białej => omijamy (nakładanie)
-        if np.linalg.norm(P_white - P_target) < (white_ball.get('r', DEFAULT_BALL_RADIUS) + radius) * 0.6:
-            continue
-
-        for pocket in pockets:
-            P_pocket = np.array([pocket['x'], pocket['y']], dtype=float)
-            # Bezpieczna normalizacja kierunku
-            V = P_target - P_pocket
-            normV = np.linalg.norm(V)
-            if normV == 0:
-                continue
-            # Ghost point (bezpiecznie)
-            V_unit = V / normV
-            P_ghost = P_target + V_unit * (2.0 * radius)
-
-            angle = calculate_cut_angle(P_white, P_ghost, P_pocket)
-            # Preferuj mniejsze kąty
-            if angle < min_angle:
-                min_angle = angle
-                lines, ghost = calculate_shot_lines(white_ball, target, pocket, radius)
-                best_shot = {"target_ball": target, "pocket": pocket, "angle": float(angle), "shot_lines": lines, "ghost_ball": ghost}
-    return best_shot
+    white_r = float(white_ball.get('r', DEFAULT_BALL_RADIUS))
+    P_targets = np.array([[b['x'], b['y']] for b in other_balls], dtype=float).reshape(-1, 2)
+    radius = np.array([float(b.get('r', DEFAULT_BALL_RADIUS)) for b in other_balls], dtype=float)
+    P_pockets = np.array([[p['x'], p['y']] for p in pockets], dtype=float).reshape(-1, 2)
+
+    # Target poza stołem albo nakładający się na białą => pomijamy
+    if hull is None:
+        hull = table_hull(table_area)
+    valid_target = points_inside_hull(P_targets, hull)
+    valid_target &= np.hypot(*(P_white - P_targets).T) >= (white_r + radius) * 0.6
+
+    # Ghost point dla każdej pary (bezpieczna normalizacja kierunku)
+    V = P_targets[:, None, :] - P_pockets[None, :, :]
+    normV = np.hypot(V[..., 0], V[..., 1])
+    safe_norm = np.where(normV == 0, 1.0, normV)
+    V_unit = V / safe_norm[..., None]
+    P_ghost = P_targets[:, None, :] + V_unit * (2.0 * radius)[:, None, None]
+
+    # Kąt cięcia (jak calculate_cut_angle, ale dla wszystkich par naraz)
+    v_shot = P_ghost - P_white
+    v_pot = P_pockets[None, :, :] - P_ghost
+    len_shot = np.hypot(v_shot[..., 0], v_shot[..., 1])
+    len_pot = np.hypot(v_pot[..., 0], v_pot[..., 1])
+    degenerate = (len_shot == 0) | (len_pot == 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos_angle = np.sum(v_shot * v_pot, axis=-1) / (len_shot * len_pot)
+    angle = np.where(degenerate, 180.0, np.degrees(np.arccos(np.clip(np.nan_to_num(cos_angle), -1.0, 1.0))))
+
+    valid = valid_target[:, None] & (normV > 0) & (angle < 180.0)
+    return {"ghost": P_ghost, "angle": angle, "shot_dist": len_shot, "pot_dist": len_pot,
+            "radius": radius, "valid": valid}
+
+def _shot_from_evaluation(white_ball, target, pocket, ghost_pt, angle, radius):
+    """Buduje słownik strzału z wyliczonych wcześniej wartości (bez ponownego liczenia geometrii)."""
+    lines = [
+        {"start": {"x": int(target['x']), "y": int(target['y'])}, "end": {"x": int(pocket['x']), "y": int(pocket['y'])}},
+        {"start": {"x": int(white_ball['x']), "y": int(white_ball['y'])}, "end": {"x": int(ghost_pt[0]), "y": int(ghost_pt[1])}}
+    ]
+    ghost = {"center": {"x": int(ghost_pt[0]), "y": int(ghost_pt[1])}, "radius": int(radius)}
+    return {"target_ball": target, "pocket": pocket, "angle": float(angle), "shot_lines": lines, "ghost_ball": ghost,
+            "blocked": False, "blocked_by": None, "blocked_segment": None, "shot_type": "direct"}
+
+def build_ball_grid(other_balls):
+    """Siatka przestrzenna nad bilami (bez białej) - używana do testów kolizji korytarzy."""
+    centers = [[b['x'], b['y']] for b in other_balls]
+    radii = [float(b.get('r', DEFAULT_BALL_RADIUS)) for b in other_balls]
+    return BallGrid(centers, radii)
+
+def find_obstructions(white_ball, pockets, ev, grid, pairs):
+    """
+    Wsadowo sprawdza korytarze biała -> ghost ball oraz bila docelowa -> łuza
+    dla par (target, łuza) podanych jako tablica indeksów (K x 2).
+    Zwraca (blocker, segment): indeks bili blokującej w other_balls (-1 = brak)
+    oraz "cue" / "target" / None dla każdej pary.
+    """
+    t_idx, p_idx = pairs[:, 0], pairs[:, 1]
+    white_r = float(white_ball.get('r', DEFAULT_BALL_RADIUS))
+    P_white = np.array([white_ball['x'], white_ball['y']], dtype=float)
+    P_pockets = np.array([[p['x'], p['y']] for p in pockets], dtype=float).reshape(-1, 2)
+    cue_block = grid.first_blockers(np.broadcast_to(P_white, (len(pairs), 2)), ev["ghost"][t_idx, p_idx],
+                                    white_r, exclude=t_idx)
+    target_block = grid.first_blockers(grid.centers[t_idx], P_pockets[p_idx], ev["radius"][t_idx], exclude=t_idx)
+    blocker = np.where(cue_block >= 0, cue_block, target_block)
+    segment = [("cue" if c >= 0 else "target" if tb >= 0 else None) for c, tb in zip(cue_block, target_block)]
+    return blocker, segment
+
+SCORING_MODES = ("probability", "angle")
+SHOT_TYPE_NAMES = ("direct",) + SEARCH_TYPES
+
+def validate_shot_types(shot_types):
+    """Lista rodzajów strzałów z requestu / konfiguracji -> krotka. ValueError przy nieznanym rodzaju."""
+    if not isinstance(shot_types, (list, tuple)) or not shot_types:
+        raise ValueError("shot_types musi być niepustą listą")
+    unknown = [t for t in shot_types if t not in SHOT_TYPE_NAMES]
+    if unknown:
+        raise ValueError(f"Nieznane rodzaje strzałów: {unknown}")
+    return tuple(t for t in SHOT_TYPE_NAMES if t in shot_types)
+
+def rank_shots(white_ball, other_balls, pockets, table_area=None, top_k=None, check_obstructions=True, hull=None,
+               timer=None, scoring=None, shot_types=None):
+    """
+    Zwraca listę strzałów posortowaną od najlepszego.
+    scoring - "angle" (najmniejszy kąt cięcia) albo "probability" (największa szansa wbicia z symulacji
+    Monte Carlo, pole "probability" w każdym strzale); None = SHOT_SCORING z konfiguracji.
+    shot_types - rodzaje strzałów (direct / bank / kick / combination, pole "shot_type");
+    None = SHOT_TYPES z konfiguracji. Złożone strzały szuka shot_search.search_shots w twardym budżecie
+    czasu - tylko, gdy czyste strzały bezpośrednie nie wypełniają top_k.
+    Strzały zablokowane przez inne bile (blocked=True, blocked_by = bila blokująca)
+    trafiają na koniec listy. top_k ogranicza długość listy (None = wszystkie).
+    timer (StageTimer) - opcjonalnie zbiera czasy etapów shot_evaluate / shot_obstructions /
+    shot_probability / shot_search / shot_build.
+    """
+    scoring = scoring or SHOT_SCORING
+    if scoring not in SCORING_MODES:
+        raise ValueError(f"Nieznany sposób oceny strzałów: {scoring}")
+    shot_types = validate_shot_types(SHOT_TYPES if shot_types is None else shot_types)
+    if not white_ball or not other_balls or not pockets:
+        return []
+    limit = None if top_k is None else max(0, int(top_k))
+    flat_idx = np.zeros(0, dtype=int)
+    if "direct" in shot_types:
+        with timed(timer, "shot_evaluate"):
+            ev = evaluate_shots(white_ball, other_balls, pockets, table_area=table_area, hull=hull)
+        flat_idx = np.flatnonzero(ev["valid"])
+    if flat_idx.size == 0:
+        # brak strzałów bezpośrednich - zostają tylko złożone
+        if not check_obstructions or shot_types == ("direct",):
+            return []
+        with timed(timer, "shot_search"):
+            extended = search_shots(white_ball, other_balls, pockets, build_ball_grid(other_balls),
+                                    shot_types=shot_types, table_area=table_area, hull=hull, scoring=scoring)
+        return extended[:limit]
+    # Sortowanie stabilne - przy remisie wygrywa wcześniejsza para (jak w pętli target x łuza)
+    order = flat_idx[np.argsort(ev["angle"].ravel()[flat_idx], kind='stable')]
+    pairs = np.stack(np.divmod(order, len(pockets)), axis=1)
+    wanted_total = limit
+    limit = len(pairs) if limit is None else limit
+    blocker = np.full(len(pairs), -1)
+    segment = [None] * len(pairs)
+    if check_obstructions:
+        with timed(timer, "shot_obstructions"):
+            # Kolizje sprawdzamy partiami w kolejności kątów - przerywamy, gdy mamy limit czystych strzałów
+            # (przy ocenie szansą wbicia potrzebne są wszystkie czyste strzały)
+            grid = build_ball_grid(other_balls)
+            wanted = len(pairs) if scoring == "probability" else limit
+            done, chunk = 0, len(pairs) if top_k is None else max(8, 2 * limit)
+            while done < len(pairs) and np.count_nonzero(blocker[:done] < 0) < wanted:
+                part = slice(done, done + chunk)
+                blocker[part], segment[part] = find_obstructions(white_ball, pockets, ev, grid, pairs[part])
+                done, chunk = done + chunk, chunk * 2
+            # Czyste strzały najpierw, zablokowane na końcu (kolejność kątów zachowana w obu grupach)
+            regroup = np.argsort(blocker[:done] >= 0, kind='stable')
+            pairs, blocker = pairs[regroup], blocker[regroup]
+            segment = [segment[i] for i in regroup]
+    probability = None
+    if scoring == "probability":
+        with timed(timer, "shot_probability"):
+            # Czyste strzały wg szansy wbicia (przy remisie - mniejszy kąt), zablokowane bez zmian na końcu
+            clean = np.flatnonzero(blocker < 0)
+            probability = np.full(len(pairs), np.nan)
+            probability[clean] = 0.0
+            # cięcia blisko 90° nie mają szans - bez losowania
+            playable = clean[ev["angle"][pairs[clean, 0], pairs[clean, 1]] < MAX_CUT_ANGLE]
+            t, p = pairs[playable, 0], pairs[playable, 1]
+            P_white = np.array([white_ball['x'], white_ball['y']], dtype=float)
+            P_targets = np.array([[b['x'], b['y']] for b in other_balls], dtype=float).reshape(-1, 2)
+            made, _ = make_probability(
+                P_white, float(white_ball.get('r', DEFAULT_BALL_RADIUS)), P_targets[t], ev["radius"][t],
+                ev["ghost"][t, p], [[q['x'], q['y']] for q in pockets], p)
+            if made is None:
+                # budżet wyczerpany przed pierwszą partią - zostaje kolejność kątów, bez szansy wbicia
+                probability[:] = np.nan
+            else:
+                probability[playable] = made
+                order = np.concatenate((clean[np.argsort(-probability[clean], kind='stable')],
+                                        np.flatnonzero(blocker >= 0)))
+                pairs, blocker, probability = pairs[order], blocker[order], probability[order]
+                segment = [segment[i] for i in order]
+    pairs = pairs[:limit]
+
+    shots = []
+    with timed(timer, "shot_build"):
+        for i, (t, p) in enumerate(pairs):
+            shot = _shot_from_evaluation(white_ball, other_balls[t], pockets[p], ev["ghost"][t, p],
+                                         ev["angle"][t, p], ev["radius"][t])
+            if probability is not None:
+                shot["probability"] = None if np.isnan(probability[i]) else round(float(probability[i]), 4)
+            if blocker[i] >= 0:
+                shot.update(blocked=True, blocked_by=other_balls[blocker[i]], blocked_segment=segment[i])
+            shots.append(shot)
 
+    # Strzały złożone (tylko niezablokowane) - tylko, gdy czyste strzały bezpośrednie nie wypełniają top_k
+    clean = [shot for shot in shots if not shot["blocked"]]
+    if check_obstructions and len(shot_types) > 1 and (wanted_total is None or len(clean) < wanted_total):
+        with timed(timer, "shot_search"):
+            extended = search_shots(white_ball, other_balls, pockets, grid, shot_types=shot_types,
+                                    table_area=table_area, hull=hull, scoring=scoring)
+        if extended:
+            # strzały bez szansy wbicia (budżet Monte Carlo wyczerpany) na końcu czystych, w kolejności kątów
+            key = ((lambda sh: -sh["probability"] if sh["probability"] is not None else 1.0)
+                   if scoring == "probability" else (lambda sh: 0))
+            # sortowanie stabilne: przy remisie strzał bezpośredni przed złożonym
+            clean = sorted(clean + extended, key=key)
+            shots = (clean + [shot for shot in shots if shot["blocked"]])[:wanted_total]
+    return shots
+
+def find_best_shot(white_ball, other_balls, pockets, table_area=None, check_obstructions=True, hull=None,
+                   timer=None, scoring=None, shot_types=None):
+    """
+    Znajduje najlepszy strzał dla białej bili (scoring i shot_types jak w rank_shots).
+    Niezablokowane mają pierwszeństwo; gdy wszystkie są zablokowane, zwracany jest najlepszy
+    zablokowany (blocked=True, blocked_by = bila blokująca).
+    Zwraca dict z informacjami o najlepszym strzale lub None, gdy nie ma żadnego kandydata.
+    """
+    shots = rank_shots(white_ball, other_balls, pockets, table_area=table_area, top_k=1,
+                       check_obstructions=check_obstructions, hull=hull, timer=timer, scoring=scoring,
+                       shot_types=shot_types)
+    return shots[0] if shots else None
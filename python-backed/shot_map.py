@@ -0,0 +1,212 @@
+"""
+Mapa strzałów do gry pozycyjnej: dla każdej komórki siatki nad stołem (możliwa pozycja białej)
+szansa wbicia najlepszego czystego strzału bezpośredniego i bila, której dotyczy.
+
+Zamiast find_best_shot dla każdej komórki jedno wektorowe przeliczenie (komórka x para bila-łuza):
+- ghost ball, korytarz bila -> łuza i zajętość ghost ball zależą tylko od pary, nie od pozycji białej,
+- korytarz biała -> ghost ball: liczba bil blokujących dla każdej (komórki, pary) - "cień" bili widziany
+  z ghost ball (biała stoi za bilą na linii do ghost ball),
+- szansa wbicia: analityczne (gaussowskie) przybliżenie modelu z shot_probability.make_probability -
+  błąd kąta białej obraca tor bili o D / (2R cos cięcia), tor mija środek łuzy o ten kąt x odległość
+  do łuzy, a tolerancja łuzy zależy od kąta wejścia (pocket_geometry).
+Stan mapy (szanse bez blokad i liczniki blokad) jest przechowywany, więc po przesunięciu jednej bili
+przeliczane są tylko: kolumny par z tą bilą jako docelową i cienie jej starej / nowej pozycji.
+
+Siatka leży w układzie physics.Table (widok z góry przy 4 narożnikach table_area), wynik to tablice uint8
+(wiersz po wierszu, base64): quality 0-255 (255 = pewne wbicie) i best_ball (indeks w "balls", 255 = brak).
+"""
+import math
+import uuid
+import base64
+import threading
+import numpy as np
+from cache import TTLCache
+from config import (SHOT_MAP_CELLS, SHOT_MAP_CACHE_SIZE, SHOT_MAP_TTL, SHOT_MC_AIM_SIGMA_DEG,
+                    SHOT_MC_CONTACT_SIGMA)
+from geometry import BallGrid
+from physics import Table
+from shot_probability import pocket_geometry, MAX_CUT_ANGLE
+
+# Mapy po map_id - kolejne przesunięcia bil odnoszą się do zapamiętanego stanu
+shot_maps = TTLCache(maxsize=SHOT_MAP_CACHE_SIZE, ttl=SHOT_MAP_TTL, sliding=True)
+
+NO_BALL = 255
+MAX_BALLS = 254
+
+def _erf(x):
+    """erf dla x >= 0 (Abramowitz-Stegun 7.1.26, błąd < 1.5e-7) - bez zależności od scipy."""
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    return 1.0 - poly * np.exp(-x * x)
+
+class ShotMap:
+    """
+    Mapa strzałów dla stałego stołu i bil (bez białej). move() przelicza przyrostowo po przesunięciu bili.
+    Tablice C x K: C - komórki siatki, K - pary (bila, łuza), para k = bila k // M, łuza k % M.
+    """
+
+    def __init__(self, balls, pockets, table_area=None, cells=SHOT_MAP_CELLS, ball_radius=None):
+        if not balls:
+            raise ValueError("Brak bil na mapie.")
+        if len(balls) > MAX_BALLS:
+            raise ValueError(f"Za dużo bil na mapie (maks. {MAX_BALLS})")
+        self.lock = threading.Lock()
+        self.balls = [dict(b) for b in balls]
+        self.pockets = pockets
+        self.table = Table(pockets, table_area)
+        self.radius = ball_radius if ball_radius is not None else self.table.ball_radius(self.balls)
+        self.B = self.table.to_table([[b['x'], b['y']] for b in self.balls])
+        self.P = self.table.pockets
+        axis, slack, cos_max = pocket_geometry(self.P)
+        self._axis, self._slack, self._cos_max = axis, slack, cos_max
+
+        # Siatka: komórki kwadratowe w układzie stołu, cells na dłuższym boku
+        lo, hi = self.table.polygon.min(axis=0), self.table.polygon.max(axis=0)
+        self.cell = float((hi - lo).max()) / max(int(cells), 1)
+        self.width, self.height = (int(v) for v in np.maximum(np.ceil((hi - lo) / self.cell), 1))
+        self.origin = lo
+        ix, iy = np.meshgrid(np.arange(self.width), np.arange(self.height))
+        self.C = (lo + (np.column_stack((ix.ravel(), iy.ravel())) + 0.5) * self.cell).astype(np.float32)
+        # biała musi się zmieścić między bandami
+        self.playable = np.all(self.C @ self.table.normals.T - self.table.offsets >= self.radius, axis=1)
+
+        n, m = len(self.B), len(self.P)
+        self.K = n * m
+        self.Q0 = np.zeros((len(self.C), self.K), dtype=np.float32)
+        self.blocked = np.zeros((len(self.C), self.K), dtype=np.uint8)
+        self.G = np.zeros((self.K, 2))
+        self.ux, self.uy, self.dist = (np.zeros((len(self.C), self.K), dtype=np.float32) for _ in range(3))
+        for j in range(n):
+            self._recompute_target(j)
+        self._update_pairs()
+
+    def _pairs_of(self, j):
+        m = len(self.P)
+        return np.arange(j * m, (j + 1) * m)
+
+    def _shadows(self, ball_pos, pairs):
+        """
+        Liczba bil z ball_pos (N x 2), przez które przechodzi korytarz komórka -> ghost ball pary (C x len(pairs)).
+        Bila blokuje, gdy leży przed białą (patrząc od ghost ball) w odległości < 2R od toru.
+        """
+        s_sq = np.float32((2.0 * self.radius) ** 2)
+        w = np.asarray(ball_pos, dtype=np.float32).reshape(-1, 2)[None, :, :] - self.G[pairs, None, :].astype(np.float32)
+        w_sq = np.sum(w * w, axis=2)
+        count = np.zeros((len(self.C), len(pairs)), dtype=np.uint8)
+        ux, uy, dist = self.ux[:, pairs], self.uy[:, pairs], self.dist[:, pairs]
+        for b in range(w.shape[1]):
+            along = ux * w[:, b, 0] + uy * w[:, b, 1]
+            perp_sq = w_sq[:, b] - along * along
+            count += (along > 0) & (perp_sq < s_sq) & (dist > along - np.sqrt(np.maximum(s_sq - perp_sq, 0)))
+        return count
+
+    def _recompute_target(self, j):
+        """Pełne kolumny par z bilą j jako docelową: ghost ball, szansa bez blokad i liczniki blokad."""
+        pairs = self._pairs_of(j)
+        away = self.B[j] - self.P
+        away /= np.maximum(np.hypot(*away.T), 1e-12)[:, None]
+        self.G[pairs] = self.B[j] + 2.0 * self.radius * away
+        # kierunki i odległości ghost ball -> komórka (wspólne dla wszystkich testów cieni tych par)
+        u = self.C[:, None, :] - self.G[pairs].astype(np.float32)[None, :, :]
+        self.dist[:, pairs] = np.hypot(u[..., 0], u[..., 1])
+        safe = np.maximum(self.dist[:, pairs], 1e-12)
+        self.ux[:, pairs], self.uy[:, pairs] = u[..., 0] / safe, u[..., 1] / safe
+        self.Q0[:, pairs] = self._probability(pairs)
+        self.blocked[:, pairs] = self._shadows(np.delete(self.B, j, axis=0), pairs)
+
+    def _probability(self, pairs):
+        """Szansa wbicia (C x len(pairs)) bez blokad - przybliżenie make_probability."""
+        R = self.radius
+        p = pairs % len(self.P)
+        G, P = self.G[pairs], self.P[p]
+        shot = G[None, :, :] - self.C[:, None, :]
+        D = np.maximum(np.hypot(shot[..., 0], shot[..., 1]), 1e-12)
+        pot = P - G
+        L = np.maximum(np.hypot(*pot.T), 1e-12)
+        pot_dir = pot / L[:, None]
+        cos_cut = (shot[..., 0] * pot_dir[:, 0] + shot[..., 1] * pot_dir[:, 1]) / D
+        sigma = np.hypot(math.radians(SHOT_MC_AIM_SIGMA_DEG), SHOT_MC_CONTACT_SIGMA * R / D)
+        # odchylenie toru bili docelowej i jej rozrzut przy łuzie
+        spread = sigma * D / (2.0 * R * np.maximum(cos_cut, 1e-6)) * L
+        cos_in = -np.sum(pot_dir * self._axis[p], axis=1)
+        cos_max = self._cos_max[p]
+        tolerance = self._slack[p] * R * np.clip((cos_in - cos_max) / (1.0 - cos_max), 0.0, 1.0)
+        prob = _erf(tolerance / (math.sqrt(2.0) * spread))
+        return np.where(cos_cut > math.cos(math.radians(MAX_CUT_ANGLE)), prob, 0.0)
+
+    def _update_pairs(self):
+        """Warunki niezależne od białej: korytarz bila -> łuza i ghost ball niezajęty przez inną bilę."""
+        m = len(self.P)
+        target = np.arange(self.K) // m
+        grid = BallGrid(self.B, np.full(len(self.B), self.radius))
+        clear = grid.first_blockers(self.B[target], self.P[np.arange(self.K) % m], self.radius,
+                                    exclude=target) < 0
+        gap = np.hypot(*(self.G[:, None, :] - self.B[None, :, :]).transpose(2, 0, 1))
+        gap[np.arange(self.K), target] = np.inf
+        self.pair_ok = clear & np.all(gap >= 2.0 * self.radius, axis=1)
+        # białej nie da się postawić na innej bili
+        overlap = np.hypot(*(self.C[:, None, :] - self.B[None, :, :]).transpose(2, 0, 1)) < 2.0 * self.radius
+        self.cell_ok = self.playable & ~overlap.any(axis=1)
+
+    def move(self, j, x, y):
+        """Przesuwa bilę j (współrzędne obrazu) i przelicza tylko to, co od niej zależy."""
+        new_pos = self.table.to_table([[x, y]])[0]
+        others = np.setdiff1d(np.arange(self.K), self._pairs_of(j))
+        self.blocked[:, others] -= self._shadows(self.B[j], others)
+        self.B[j] = new_pos
+        self.blocked[:, others] += self._shadows(self.B[j], others)
+        self.balls[j].update(x=x, y=y)
+        self._recompute_target(j)
+        self._update_pairs()
+
+    def result(self):
+        """quality / best_ball jako tablice uint8 (height x width)."""
+        score = np.where((self.blocked == 0) & self.pair_ok[None, :], self.Q0, 0.0)
+        best = np.argmax(score, axis=1)
+        quality = score[np.arange(len(score)), best] * self.cell_ok
+        best_ball = np.where(quality > 0, best // len(self.P), NO_BALL)
+        shape = (self.height, self.width)
+        return np.round(quality * 255).astype(np.uint8).reshape(shape), best_ball.astype(np.uint8).reshape(shape)
+
+    def corners(self):
+        """Narożniki siatki na obrazie (lewy górny, prawy górny, prawy dolny, lewy dolny) w układzie stołu."""
+        lo = self.origin
+        hi = lo + self.cell * np.array([self.width, self.height])
+        pts = self.table.to_image([[lo[0], lo[1]], [hi[0], lo[1]], [hi[0], hi[1]], [lo[0], hi[1]]])
+        return [{"x": round(float(x), 1), "y": round(float(y), 1)} for x, y in pts]
+
+    def describe(self, map_id):
+        quality, best_ball = self.result()
+        return {"map_id": map_id, "width": self.width, "height": self.height, "corners": self.corners(),
+                "balls": self.balls,
+                "quality": base64.b64encode(quality.tobytes()).decode('ascii'),
+                "best_ball": base64.b64encode(best_ball.tobytes()).decode('ascii')}
+
+def create_shot_map(balls, pockets, table_area=None, cells=SHOT_MAP_CELLS):
+    """Buduje mapę i zapamiętuje ją pod nowym map_id. Zwraca (map_id, ShotMap)."""
+    shot_map = ShotMap(balls, pockets, table_area=table_area, cells=cells)
+    map_id = uuid.uuid4().hex
+    shot_maps.set(map_id, shot_map)
+    return map_id, shot_map
+
+def get_shot_map(map_id):
+    if not map_id:
+        return None
+    return shot_maps.get(map_id)
+
+def apply_moves(shot_map, moves):
+    """
+    Przesunięcia bil [{"index": i, "x": .., "y": ..}] (index w "balls" mapy).
+    ValueError przy złym formacie - wtedy mapa nie jest zmieniana.
+    """
+    if not isinstance(moves, list) or not moves:
+        raise ValueError("moves musi być niepustą listą")
+    for move in moves:
+        if not isinstance(move, dict) or not isinstance(move.get('index'), int) \
+                or not 0 <= move['index'] < len(shot_map.balls):
+            raise ValueError(f"Niepoprawne przesunięcie bili: {move}")
+        if not all(isinstance(move.get(k), (int, float)) for k in ('x', 'y')):
+            raise ValueError(f"Przesunięcie bili wymaga x i y: {move}")
+    with shot_map.lock:
+        for move in moves:
+            shot_map.move(move['index'], move['x'], move['y'])
@@ -0,0 +1,145 @@
+"""
+Szacowanie szansy wbicia (Monte Carlo) dla kandydatów z evaluate_shots.
+
+Dla każdego strzału losujemy błąd kierunku uderzenia (kąt) i błąd punktu celowania (przesunięcie
+ghost ball w poprzek linii strzału), liczymy rzeczywisty punkt zderzenia bil, kierunek bili
+docelowej po zderzeniu i sprawdzamy, czy wpada w łuzę (odległość toru od środka łuzy mniejsza od
+tolerancji zależnej od typu łuzy i kąta wejścia). Wszystkie strzały i próbki liczone są razem
+(tablice K x M), partiami, aż do wyczerpania budżetu czasu albo limitu próbek.
+
+Dzięki temu w wyniku uwzględnione są: odległość białej od bili (błąd kąta rośnie z dystansem),
+odległość bili od łuzy, czułość cienkich cięć na błąd punktu styku i kąt wejścia w łuzę.
+"""
+import time
+import numpy as np
+from config import SHOT_MC_BUDGET_MS, SHOT_MC_MAX_SAMPLES, SHOT_MC_AIM_SIGMA_DEG, SHOT_MC_CONTACT_SIGMA
+
+# Próbki na partię (na każdy strzał) - budżet czasu sprawdzany po każdej partii
+BATCH_SAMPLES = 256
+
+# Cięcia powyżej tego kąta (stopnie) traktujemy jako niewykonalne (szansa 0, bez losowania)
+MAX_CUT_ANGLE = 85.0
+
+# Tolerancja łuzy: o ile (w promieniach bili) środek bili może minąć środek łuzy przy wejściu na wprost,
+# oraz maksymalne odchylenie toru od osi łuzy (narożna przyjmuje wzdłuż bandy, środkowa tylko z przodu)
+CORNER_SLACK, CORNER_MAX_ANGLE = 1.0, 90.0
+SIDE_SLACK, SIDE_MAX_ANGLE = 0.7, 60.0
+
+def _unit(v):
+    norm = np.hypot(v[..., 0], v[..., 1])
+    return v / np.where(norm == 0, 1.0, norm)[..., None]
+
+def side_pockets(P_pockets):
+    """
+    Maska łuz środkowych: dwaj najbliżsi sąsiedzi leżą po przeciwnych stronach (na tej samej bandzie);
+    przy narożnej są pod kątem ok. 90° (dwie bandy). Zwraca (side (M,), d1, d2) - d1/d2 to kierunki
+    do dwóch najbliższych łuz; przy mniej niż 3 łuzach wszystkie są narożne (d1 = d2 = None).
+    """
+    P = np.asarray(P_pockets, dtype=float).reshape(-1, 2)
+    if len(P) < 3:
+        return np.zeros(len(P), dtype=bool), None, None
+    dist = np.hypot(*(P[:, None, :] - P[None, :, :]).transpose(2, 0, 1))
+    np.fill_diagonal(dist, np.inf)
+    nearest = np.argsort(dist, axis=1)[:, :2]
+    d1 = _unit(P[nearest[:, 0]] - P)
+    d2 = _unit(P[nearest[:, 1]] - P)
+    return np.sum(d1 * d2, axis=1) < np.cos(np.radians(150.0)), d1, d2
+
+def pocket_geometry(P_pockets):
+    """
+    Oś wejścia (wektor jednostkowy w głąb stołu), tolerancja i cos maksymalnego kąta wejścia dla każdej łuzy
+    (typ łuzy z side_pockets). Oś narożnej = dwusieczna kierunków do sąsiadów,
+    środkowej = prostopadła do bandy, zwrócona do środka stołu.
+    Zwraca (axis (M x 2), slack (M,), cos_max (M,)).
+    """
+    P = np.asarray(P_pockets, dtype=float).reshape(-1, 2)
+    m = len(P)
+    axis = _unit(P.mean(axis=0) - P)
+    slack = np.full(m, CORNER_SLACK)
+    cos_max = np.full(m, np.cos(np.radians(CORNER_MAX_ANGLE)))
+    side, d1, d2 = side_pockets(P)
+    if d1 is None:
+        return axis, slack, cos_max
+    bisector = _unit(d1 + d2)
+    normal = np.column_stack((-d1[:, 1], d1[:, 0]))
+    normal = np.where(np.sum(normal * axis, axis=1, keepdims=True) < 0, -normal, normal)
+    axis = np.where(side[:, None], normal, np.where(np.hypot(*bisector.T)[:, None] > 0, bisector, axis))
+    slack[side] = SIDE_SLACK
+    cos_max[side] = np.cos(np.radians(SIDE_MAX_ANGLE))
+    return axis, slack, cos_max
+
+def make_probability(P_white, white_r, P_targets, target_r, P_ghost, P_pockets, pocket_idx,
+                     budget_ms=SHOT_MC_BUDGET_MS, max_samples=SHOT_MC_MAX_SAMPLES,
+                     aim_sigma_deg=SHOT_MC_AIM_SIGMA_DEG, contact_sigma=SHOT_MC_CONTACT_SIGMA, seed=0, geometry=None):
+    """
+    Szansa wbicia dla K strzałów naraz.
+    P_targets, P_ghost (K x 2), target_r (K,), pocket_idx (K,) - indeks łuzy w P_pockets.
+    aim_sigma_deg - odchylenie kąta uderzenia, contact_sigma - odchylenie punktu celowania
+    (w promieniach bili docelowej; aim_sigma_deg może być tablicą (K,)).
+    Partie próbek do budżetu budget_ms - kolejna partia tylko, jeśli zmieści się w budżecie
+    (czas najdłuższej dotychczasowej partii).
+    geometry - gotowe (axis, slack, cos_max) dla P_pockets zamiast pocket_geometry
+    (np. łuzy odbite względem bandy przy strzałach od bandy).
+    Zwraca (probability (K,), liczba próbek na strzał); (None, 0), gdy budżet skończył się przed pierwszą partią.
+    """
+    P_targets = np.asarray(P_targets, dtype=float).reshape(-1, 2)
+    k = len(P_targets)
+    if k == 0:
+        return np.zeros(0), 0
+    deadline = time.perf_counter() + budget_ms / 1000.0
+    rng = np.random.default_rng(seed)
+    P_white = np.asarray(P_white, dtype=float)
+    target_r = np.asarray(target_r, dtype=float)
+    P_ghost = np.asarray(P_ghost, dtype=float).reshape(-1, 2)
+
+    axis, slack, cos_max = pocket_geometry(P_pockets) if geometry is None else geometry
+    P_pocket = np.asarray(P_pockets, dtype=float).reshape(-1, 2)[pocket_idx]
+    axis, slack, cos_max = axis[pocket_idx], slack[pocket_idx], cos_max[pocket_idx]
+
+    # Układ lokalny każdego strzału: oś x = idealny kierunek biała -> ghost ball.
+    # Stałe per strzał (K, 1) - w pętli tylko operacje na próbkach (K x M)
+    shot_dir = _unit(P_ghost - P_white)
+    def local(v):
+        return ((v[:, 0] * shot_dir[:, 0] + v[:, 1] * shot_dir[:, 1])[:, None],
+                (v[:, 1] * shot_dir[:, 0] - v[:, 0] * shot_dir[:, 1])[:, None])
+    rel_x, rel_y = local(P_targets - P_white)
+    pocket_x, pocket_y = local(P_pocket - P_targets)
+    axis_x, axis_y = local(axis)
+    rel_sq = rel_x ** 2 + rel_y ** 2
+    contact_d = (white_r + target_r)[:, None]
+    # błąd punktu celowania e (w poprzek linii) to przy odległości D obrót kierunku o ok. e / D,
+    # więc oba błędy składają się w jedno odchylenie kąta per strzał
+    shot_len = np.hypot(*(P_ghost - P_white).T)
+    sigma = np.hypot(np.radians(np.asarray(aim_sigma_deg, dtype=float)), contact_sigma * target_r / np.maximum(shot_len, 1.0))[:, None]
+    tol_scale = (slack * target_r)[:, None]
+    cos_max = cos_max[:, None]
+
+    hits = np.zeros(k)
+    samples = 0
+    batch_time = 0.0
+    while samples < max_samples and time.perf_counter() + batch_time < deadline:
+        batch_start = time.perf_counter()
+        m = min(BATCH_SAMPLES, max_samples - samples)
+        delta = rng.standard_normal((k, m)) * sigma
+        ux, uy = np.cos(delta), np.sin(delta)
+
+        # Zderzenie: pierwszy punkt toru białej w odległości r_white + r_target od środka bili
+        along = ux * rel_x + uy * rel_y
+        miss_sq = rel_sq - along * along
+        contact = (along > 0) & (miss_sq < contact_d ** 2)
+        s = along - np.sqrt(np.maximum(contact_d ** 2 - miss_sq, 0.0))
+        # kierunek bili docelowej = od środka białej w chwili zderzenia do środka bili (długość = contact_d)
+        vx = (rel_x - s * ux) / contact_d
+        vy = (rel_y - s * uy) / contact_d
+
+        # Wejście w łuzę: tor przed bilą, mija środek łuzy o mniej niż tolerancja (malejąca z kątem wejścia)
+        ahead = vx * pocket_x + vy * pocket_y
+        offset = np.abs(vx * pocket_y - vy * pocket_x)
+        cos_in = -(vx * axis_x + vy * axis_y)
+        tolerance = tol_scale * np.clip((cos_in - cos_max) / (1.0 - cos_max), 0.0, 1.0)
+        hits += np.count_nonzero(contact & (ahead > 0) & (offset < tolerance), axis=1)
+        samples += m
+        batch_time = max(batch_time, time.perf_counter() - batch_start)
+    if samples == 0:
+        return None, 0
+    return hits / samples, samples
@@ -0,0 +1,301 @@
+"""
+Strzały złożone: od bandy (bank - bila docelowa odbija się od bandy), z bandy (kick - biała odbija się
+od bandy przed bilą) i kombinacje (biała -> bila A -> bila B -> łuza).
+
+Geometria liczona jest w układzie stołu z physics.Table (widok z góry przy 4 narożnikach table_area),
+bo odbicie lustrzane ma sens tylko bez perspektywy. Odbicie od bandy = prosta do łuzy (albo ghost ball)
+odbitej względem linii, po której porusza się środek bili (banda przesunięta o promień do środka stołu),
+z poprawką na tłumienie bandy.
+
+Wyszukiwanie jest ograniczone:
+1. wszyscy kandydaci danego rodzaju liczeni są wektorowo (bank/kick: bila x łuza x banda,
+   kombinacje: bila x bila x łuza),
+2. przycinanie geometryczne: punkt odbicia na bandzie i poza wylotem łuzy, kąty cięcia
+   (MAX_CUT_ANGLE, dla kombinacji COMBINATION_MAX_CUT), odległość bil w kombinacji,
+3. korytarze sprawdzane partiami w kolejności kątów, z pamięcią odcinków (SegmentClearance) -
+   ten sam odcinek (np. bila -> łuza wspólny dla kicków od różnych band) liczony jest raz,
+4. twardy budżet czasu sprawdzany przed generowaniem każdego rodzaju kandydatów i przed każdym krokiem
+   testu korytarzy - po jego przekroczeniu zwracamy to, co zostało już sprawdzone; szansa wbicia
+   (Monte Carlo) dostaje pozostały czas, a bez niego strzały zostają w kolejności kątów ("probability": None).
+"""
+import time
+import numpy as np
+from config import SHOT_SEARCH_BUDGET_MS, SHOT_MC_AIM_SIGMA_DEG
+from geometry import table_hull, points_inside_hull, DEFAULT_BALL_RADIUS
+from physics import Table, CUSHION_RESTITUTION
+from shot_probability import make_probability, pocket_geometry, _unit, MAX_CUT_ANGLE
+
+SEARCH_TYPES = ("bank", "kick", "combination")
+
+# Odbicie od bandy nie jest idealnie lustrzane - mnożnik szansy wbicia za każde odbicie
+CUSHION_FACTOR = 0.85
+# Kombinacje: maksymalny kąt cięcia na każdej z bil i maksymalna odległość bila A -> ghost ball na B
+# (w długościach stołu)
+COMBINATION_MAX_CUT = 60.0
+COMBINATION_MAX_GAP = 0.5
+# Limit sprawdzanych czystych strzałów złożonych i wielkość partii testów korytarzy
+MAX_CANDIDATES = 48
+CLEARANCE_CHUNK = 64
+
+class SegmentClearance:
+    """
+    Pamięć testów korytarzy: (start, koniec, promień, bila pomijana) -> pierwsza bila na drodze.
+    Zapytania wsadowe jak BallGrid.first_blockers - liczone są tylko odcinki jeszcze nieznane.
+    """
+
+    def __init__(self, grid):
+        self.grid = grid
+        self._memo = {}
+        self.hits = 0
+
+    def first_blockers(self, starts, ends, radius, exclude):
+        starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+        radius = np.broadcast_to(np.asarray(radius, dtype=float), (len(starts),))
+        exclude = np.broadcast_to(np.asarray(exclude, dtype=int), (len(starts),))
+        keys = list(zip(map(tuple, np.round(starts, 1).tolist()), map(tuple, np.round(ends, 1).tolist()),
+                        np.round(radius, 1).tolist(), exclude.tolist()))
+        result = np.array([self._memo.get(key, -2) for key in keys], dtype=int)
+        unknown = np.flatnonzero(result == -2)
+        self.hits += len(keys) - len(unknown)
+        if len(unknown):
+            # duplikaty w jednym zapytaniu też liczymy raz
+            first = {}
+            for i in unknown:
+                first.setdefault(keys[i], i)
+            todo = np.fromiter(first.values(), dtype=int)
+            found = self.grid.first_blockers(starts[todo], ends[todo], radius[todo], exclude=exclude[todo])
+            self._memo.update(zip((keys[i] for i in todo), found.tolist()))
+            result[unknown] = [self._memo[keys[i]] for i in unknown]
+        return result
+
+def _cut_angle(start, ghost, end):
+    """Kąt (stopnie) między kierunkami start -> ghost i ghost -> end, wektorowo."""
+    cos = np.sum(_unit(ghost - start) * _unit(end - ghost), axis=-1)
+    return np.degrees(np.arccos(np.clip(cos, -1.0, 1.0)))
+
+def _unfold(table, radius, A, B, edge):
+    """
+    Odbicie od bandy edge na drodze A -> B: B odbite względem linii środka bili (banda przesunięta o promień).
+    Banda tłumi składową normalną prędkości (CUSHION_RESTITUTION jak w physics.py), więc odbity punkt leży
+    głębiej (dB / e za linią), a A odbite dla prostej A' -> odbicie -> B - płycej (e * dA).
+    Zwraca (punkt odbicia, odbite A, odbite B, maska poprawnych) - punkt odbicia musi leżeć na bandzie
+    i poza wylotami łuz (tam bila wpada zamiast się odbić).
+    """
+    n = table.normals[edge]
+    c = table.offsets[edge] + radius
+    e = CUSHION_RESTITUTION
+    dA = np.sum(A * n, axis=1) - c
+    dB = np.sum(B * n, axis=1) - c
+    B_mirror = B - (1.0 + 1.0 / e) * dB[:, None] * n
+    A_mirror = A - (1.0 + e) * dA[:, None] * n
+    valid = (dA > 0) & (dB > 0)
+    t = dA / np.where(valid, dA + dB / e, 1.0)
+    bounce = A + t[:, None] * (B_mirror - A)
+    v0 = table.polygon[edge]
+    v1 = table.polygon[(edge + 1) % len(table.polygon)]
+    along = np.sum((bounce - v0) * (v1 - v0), axis=1) / np.sum((v1 - v0) ** 2, axis=1)
+    contact = bounce - radius * n
+    gap = np.hypot(*(contact[:, None, :] - table.pockets[None, :, :]).transpose(2, 0, 1)) / radius
+    valid &= (along > 0) & (along < 1) & np.all(gap > table.capture[None, :], axis=1)
+    return bounce, A_mirror, B_mirror, valid
+
+def _reflect(v, edge, table):
+    n = table.normals[edge]
+    return v - 2.0 * np.sum(v * n, axis=1)[:, None] * n
+
+def _bank_candidates(table, R, W, T, P, targets):
+    """Bila t -> banda e -> łuza p. Biała w ghost ball przy bili t (bila t leci na punkt odbicia)."""
+    n_edges = len(table.normals)
+    t, p, e = (a.ravel() for a in np.meshgrid(targets, np.arange(len(P)), np.arange(n_edges), indexing='ij'))
+    bounce, _, pocket_mirror, valid = _unfold(table, R, T[t], P[p], e)
+    ghost = T[t] - 2.0 * R * _unit(bounce - T[t])
+    angle = _cut_angle(W, ghost, bounce)
+    valid &= angle < MAX_CUT_ANGLE
+    keep = np.flatnonzero(valid)
+    return {"kind": "bank", "t": t[keep], "a": np.full(len(keep), -1), "p": p[keep], "e": e[keep],
+            "angle": angle[keep], "ghost": ghost[keep], "bounce": bounce[keep],
+            # Monte Carlo w widoku rozłożonym: łuza odbita razem ze swoją osią wejścia
+            "mc_white": np.broadcast_to(W, (len(keep), 2)), "mc_target": T[t[keep]], "mc_ghost": ghost[keep],
+            "mc_pocket": pocket_mirror[keep], "mc_mirror": e[keep], "mc_sigma": np.ones(len(keep)),
+            "factor": np.full(len(keep), CUSHION_FACTOR)}
+
+def _kick_candidates(table, R, W, T, P, targets):
+    """Biała -> banda e -> ghost ball przy bili t -> bila do łuzy p."""
+    n_edges = len(table.normals)
+    t, p, e = (a.ravel() for a in np.meshgrid(targets, np.arange(len(P)), np.arange(n_edges), indexing='ij'))
+    ghost = T[t] + 2.0 * R * _unit(T[t] - P[p])
+    bounce, white_mirror, _, valid = _unfold(table, R, np.broadcast_to(W, (len(t), 2)), ghost, e)
+    angle = _cut_angle(bounce, ghost, P[p])
+    valid &= (angle < MAX_CUT_ANGLE) & (np.hypot(*(T[t] - P[p]).T) > 0)
+    keep = np.flatnonzero(valid)
+    return {"kind": "kick", "t": t[keep], "a": np.full(len(keep), -1), "p": p[keep], "e": e[keep],
+            "angle": angle[keep], "ghost": ghost[keep], "bounce": bounce[keep],
+            "mc_white": white_mirror[keep], "mc_target": T[t[keep]], "mc_ghost": ghost[keep], "mc_pocket": P[p[keep]],
+            "mc_mirror": np.full(len(keep), -1), "mc_sigma": np.ones(len(keep)),
+            "factor": np.full(len(keep), CUSHION_FACTOR)}
+
+def _combination_candidates(table, R, W, T, P, targets):
+    """Biała -> bila a -> bila t -> łuza p. angle = większy z dwóch kątów cięcia."""
+    a, t, p = (x.ravel() for x in np.meshgrid(targets, targets, np.arange(len(P)), indexing='ij'))
+    pair = (a != t) & (np.hypot(*(T[a] - T[t]).T) > 2.0 * R)
+    a, t, p = a[pair], t[pair], p[pair]
+    ghost_t = T[t] + 2.0 * R * _unit(T[t] - P[p])
+    ghost_a = T[a] + 2.0 * R * _unit(T[a] - ghost_t)
+    angle_t = _cut_angle(T[a], ghost_t, P[p])
+    angle_a = _cut_angle(W, ghost_a, ghost_t)
+    valid = (angle_t < COMBINATION_MAX_CUT) & (angle_a < COMBINATION_MAX_CUT)
+    valid &= np.hypot(*(ghost_t - T[a]).T) < COMBINATION_MAX_GAP
+    keep = np.flatnonzero(valid)
+    # Błąd kąta białej d przesuwa punkt styku na A o D * d, a to obraca kierunek A o D * d / (2R cos cięcia):
+    # szansę wbicia liczymy dla A jako "białej" z odpowiednio większym błędem kierunku
+    reach = np.hypot(*(ghost_a - W).T) / (2.0 * R * np.cos(np.radians(angle_a)))
+    return {"kind": "combination", "t": t[keep], "a": a[keep], "p": p[keep], "e": np.full(len(keep), -1),
+            "angle": np.maximum(angle_t, angle_a)[keep], "ghost": ghost_a[keep], "bounce": ghost_t[keep],
+            "mc_white": T[a[keep]], "mc_target": T[t[keep]], "mc_ghost": ghost_t[keep], "mc_pocket": P[p[keep]],
+            "mc_mirror": np.full(len(keep), -1), "mc_sigma": np.maximum(reach[keep], 1.0), "factor": np.ones(len(keep))}
+
+GENERATORS = {"bank": _bank_candidates, "kick": _kick_candidates, "combination": _combination_candidates}
+
+def _segments(kind, t, a, p, W_img, T_img, P_img, ghost_img, bounce_img, white_r, radius):
+    """
+    Trzy korytarze każdego kandydata w układzie obrazu: starts, ends (K x 3 x 2), promień i bila pomijana (K x 3).
+    bank: biała -> ghost, bila -> odbicie, odbicie -> łuza; kick: biała -> odbicie, odbicie -> ghost, bila -> łuza;
+    kombinacja: biała -> ghost na A, A -> ghost na B, B -> łuza.
+    """
+    k = len(t)
+    W = np.broadcast_to(W_img, (k, 2))
+    bank, kick = (kind == "bank")[:, None], (kind == "kick")[:, None]
+    first_ball = np.where(a >= 0, a, t)
+    starts = np.stack((W, np.where(kick, bounce_img, T_img[first_ball]), np.where(bank, bounce_img, T_img[t])), axis=1)
+    # trzeci odcinek zawsze kończy się w łuzie (różni się tylko początek: odbicie przy banku, bila t w pozostałych)
+    ends = np.stack((np.where(kick, bounce_img, ghost_img), np.where(kick, ghost_img, bounce_img), P_img[p]), axis=1)
+    seg_radius = np.column_stack((np.full(k, white_r), np.where(kick[:, 0], white_r, radius[first_ball]), radius[t]))
+    # biała -> ghost pomija bilę, w którą celuje (A w kombinacji); przy kicku biała -> banda nie pomija żadnej
+    exclude = np.column_stack((np.where(kick[:, 0], -1, first_ball), t, t))
+    return starts, ends, seg_radius, exclude
+
+def _point(pt):
+    return {"x": int(pt[0]), "y": int(pt[1])}
+
+def _line(a, b):
+    return {"start": _point(a), "end": _point(b)}
+
+def search_shots(white_ball, other_balls, pockets, grid, shot_types=SEARCH_TYPES, table_area=None, hull=None,
+                 scoring="probability", budget_ms=SHOT_SEARCH_BUDGET_MS):
+    """
+    Niezablokowane strzały złożonych rodzajów z shot_types (bank / kick / combination), najwyżej MAX_CANDIDATES,
+    posortowane wg szansy wbicia (scoring="probability", pole "probability") albo kąta (scoring="angle").
+    grid - BallGrid nad other_balls (jak w rank_shots). Format strzału jak w rank_shots plus:
+    "shot_type", "cushion" (punkt odbicia, bank/kick) i "first_ball" (bila A, kombinacja).
+    Budżet budget_ms jest twardy: bez czasu na Monte Carlo strzały mają "probability": None (kolejność kątów).
+    """
+    deadline = time.perf_counter() + budget_ms / 1000.0
+    kinds = [k for k in SEARCH_TYPES if k in shot_types]
+    if not kinds or not other_balls or not pockets or budget_ms <= 0:
+        return []
+    try:
+        table = Table(pockets, table_area)
+    except ValueError:
+        return []
+    W_img = np.array([white_ball['x'], white_ball['y']], dtype=float)
+    T_img = np.array([[b['x'], b['y']] for b in other_balls], dtype=float).reshape(-1, 2)
+    P_img = np.array([[p['x'], p['y']] for p in pockets], dtype=float).reshape(-1, 2)
+    white_r = float(white_ball.get('r', DEFAULT_BALL_RADIUS))
+    radius = np.array([float(b.get('r', DEFAULT_BALL_RADIUS)) for b in other_balls], dtype=float)
+    if hull is None:
+        hull = table_hull(table_area)
+    targets = np.flatnonzero(points_inside_hull(T_img, hull))
+    R = table.ball_radius([white_ball] + list(other_balls))
+    W, T, P = table.to_table(W_img)[0], table.to_table(T_img), table.pockets
+
+    # 1-2. Kandydaci (wektorowo) po przycięciu geometrycznym - kolejne rodzaje tylko, gdy jest jeszcze czas
+    candidates = []
+    for name in kinds:
+        if time.perf_counter() >= deadline:
+            break
+        candidates.append(GENERATORS[name](table, R, W, T, P, targets))
+    if not candidates:
+        return []
+    fields = candidates[0].keys() - {"kind"}
+    c = {f: np.concatenate([part[f] for part in candidates]) for f in fields}
+    kind = np.concatenate([np.full(len(part["t"]), part["kind"], dtype=object) for part in candidates])
+    order = np.argsort(c["angle"], kind='stable')
+    c = {f: v[order] for f, v in c.items()}
+    kind = kind[order]
+
+    # 3. Korytarze partiami (z pamięcią odcinków), do limitu czystych strzałów albo końca budżetu
+    clearance = SegmentClearance(grid)
+    ghost_img = table.to_image(c["ghost"])
+    bounce_img = table.to_image(c["bounce"])
+    starts, ends, seg_radius, exclude = _segments(kind, c["t"], c["a"], c["p"], W_img, T_img, P_img, ghost_img,
+                                                  bounce_img, white_r, radius)
+    clean = np.zeros(len(kind), dtype=bool)
+    done = 0
+    # kolejny krok tylko, jeśli zmieści się w budżecie (czas najdłuższego dotychczasowego kroku)
+    step_time = 0.0
+    while (done < len(kind) and np.count_nonzero(clean) < MAX_CANDIDATES
+           and time.perf_counter() + step_time < deadline):
+        # odcinki po kolei - kolejny tylko dla kandydatów, którzy przeszli poprzednie
+        alive = np.arange(done, min(done + CLEARANCE_CHUNK, len(kind)))
+        for j in range(3):
+            step_start = time.perf_counter()
+            if step_start + step_time >= deadline:
+                # niesprawdzeni do końca kandydaci nie są czyści
+                alive = alive[:0]
+                break
+            blocker = clearance.first_blockers(starts[alive, j], ends[alive, j], seg_radius[alive, j],
+                                               exclude[alive, j])
+            alive = alive[blocker < 0]
+            step_time = max(step_time, time.perf_counter() - step_start)
+        clean[alive] = True
+        done += CLEARANCE_CHUNK
+    keep = np.flatnonzero(clean)[:MAX_CANDIDATES]
+    if not len(keep):
+        return []
+
+    # 4. Szansa wbicia w pozostałym czasie (bez czasu - kolejność kątów)
+    probability = None
+    if scoring == "probability" and time.perf_counter() < deadline:
+        axis, slack, cos_max = pocket_geometry(P)
+        p, mirror = c["p"][keep], c["mc_mirror"][keep]
+        axis = axis[p]
+        banked = mirror >= 0
+        axis[banked] = _reflect(axis[banked], mirror[banked], table)
+        sigma = c["mc_sigma"][keep] * SHOT_MC_AIM_SIGMA_DEG
+        probability, _ = make_probability(
+            c["mc_white"][keep], R, c["mc_target"][keep], np.full(len(keep), R), c["mc_ghost"][keep],
+            c["mc_pocket"][keep], np.arange(len(keep)),
+            budget_ms=max(0.0, (deadline - time.perf_counter()) * 1000.0), aim_sigma_deg=sigma,
+            geometry=(axis, slack[p], cos_max[p]))
+        if probability is not None:
+            probability = probability * c["factor"][keep]
+            rank = np.argsort(-probability, kind='stable')
+            keep, probability = keep[rank], probability[rank]
+
+    shots = []
+    for i, k in enumerate(keep):
+        t, p = int(c["t"][k]), int(c["p"][k])
+        target, pocket = other_balls[t], pockets[p]
+        shot = {"target_ball": target, "pocket": pocket, "angle": float(c["angle"][k]),
+                "ghost_ball": {"center": _point(ghost_img[k]), "radius": int(radius[t])},
+                "blocked": False, "blocked_by": None, "blocked_segment": None, "shot_type": kind[k]}
+        if kind[k] == "bank":
+            shot["shot_lines"] = [_line(T_img[t], bounce_img[k]), _line(bounce_img[k], P_img[p]),
+                                  _line(W_img, ghost_img[k])]
+            shot["cushion"] = _point(bounce_img[k])
+        elif kind[k] == "kick":
+            shot["shot_lines"] = [_line(T_img[t], P_img[p]), _line(W_img, bounce_img[k]),
+                                  _line(bounce_img[k], ghost_img[k])]
+            shot["cushion"] = _point(bounce_img[k])
+        else:
+            a = int(c["a"][k])
+            shot["shot_lines"] = [_line(T_img[t], P_img[p]), _line(T_img[a], bounce_img[k]),
+                                  _line(W_img, ghost_img[k])]
+            shot["first_ball"] = other_balls[a]
+        if probability is not None:
+            shot["probability"] = round(float(probability[i]), 4)
+        elif scoring == "probability":
+            shot["probability"] = None
+        shots.append(shot)
+    return shots
@@ -0,0 +1,168 @@
+"""
+Strumieniowa analiza klatek z kamery (WebSocket /stream).
+
+Klient wysyła ciąg klatek JPEG (wiadomości binarne) i opcjonalnie opcje jako JSON (wiadomości tekstowe):
+    {"pockets": [...], "cue_ball_color": "white", "track": true, "pyramid_levels": 1}
+Serwer zawsze przetwarza tylko najnowszą klatkę - klatki, które przyszły w trakcie analizy poprzedniej,
+są odrzucane (liczba w polu "dropped") - i od razu odsyła wynik:
+    {"frame": 12, "balls": [...], "best_shot": {...} | null, "dropped": 3, "timings": {...}}
+Z ?format=packed / ?format=msgpack wynik przychodzi jako wiadomość binarna w tym formacie (wire_format.py).
+"""
+import json
+import time
+import logging
+from config import PYRAMID_LEVELS
+from image_processing import decode_image, detect_all_balls
+from shot_calculation import find_best_shot
+from analysis import split_cue_ball
+from tracking import BallTracker
+from timing import StageTimer
+from metrics import REGISTRY, Counter, STAGE_SECONDS
+from wire_format import JSON, encode
+
+logger = logging.getLogger(__name__)
+
+STREAM_FRAMES = REGISTRY.register(Counter(
+    "billiards_stream_frames_total", "Klatki strumienia WebSocket: przetworzone i odrzucone (nieaktualne).",
+    ("result",)))
+
+OPTION_FIELDS = ("pockets", "cue_ball_color", "track", "pyramid_levels", "table_area", "calibration_point")
+
+def latest_frame(receive, on_text):
+    """
+    Czeka na klatkę i zwraca (klatka, dropped) - najnowszą z wiadomości już odebranych;
+    starsze klatki z bufora są pomijane (dropped = ile). receive(timeout) jak w simple_websocket
+    (None, gdy brak wiadomości w czasie timeout; 0 = bez czekania). Wiadomości tekstowe trafiają do on_text.
+    """
+    frame, dropped = None, 0
+    timeout = 0
+    while True:
+        message = receive(timeout=timeout)
+        if message is None:
+            if frame is not None:
+                return frame, dropped
+            # bufor pusty i brak klatki - czekamy na kolejną wiadomość
+            timeout = None
+            continue
+        if isinstance(message, str):
+            on_text(message)
+            continue
+        if frame is not None:
+            dropped += 1
+        frame, timeout = message, 0
+
+class StreamAnalyzer:
+    """
+    Stan jednego połączenia: opcje, własny tracker (tryb track) i ostatni najlepszy strzał.
+    detect - funkcja pełnej detekcji (detect_all_balls albo DetectionPool.detect).
+    """
+
+    def __init__(self, session=None, detect=None, pyramid_levels=None):
+        self.session = session
+        self.detect = detect or detect_all_balls
+        self.options = {"pockets": [], "cue_ball_color": "white", "track": False,
+                        "pyramid_levels": PYRAMID_LEVELS if pyramid_levels is None else pyramid_levels,
+                        "table_area": None, "calibration_point": None}
+        # osobny tracker na połączenie - nie miesza się ze śledzeniem przez /detect w tej samej sesji
+        self.tracker = BallTracker(session) if session is not None else None
+        self.frames = 0
+        self._best_shot = None
+        self._shot_valid = False
+
+    def configure(self, text):
+        """Nakłada opcje z wiadomości JSON (tylko podane pola). ValueError przy złym formacie."""
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError("Opcje muszą być obiektem JSON")
+        options = dict(self.options)
+        options.update({k: data[k] for k in OPTION_FIELDS if k in data})
+        if not isinstance(options["pyramid_levels"], int) or not 0 <= options["pyramid_levels"] <= 4:
+            raise ValueError("pyramid_levels musi być w zakresie 0-4")
+        if options["track"] and self.tracker is None:
+            raise ValueError("Tryb śledzenia wymaga session_id.")
+        if not isinstance(options["pockets"], list):
+            raise ValueError("pockets musi być listą")
+        self.options = options
+        self._shot_valid = False
+
+    def _best(self, balls, timer):
+        o = self.options
+        table_area, hull = o["table_area"] or [], None
+        if self.session is not None:
+            table_area, hull = self.session.table_area, self.session.hull
+        cue_ball, other_balls = split_cue_ball([dict(b) for b in balls], str(o["cue_ball_color"]).lower())
+        pockets = o["pockets"] or (self.session.pockets if self.session is not None else None)
+        if cue_ball is None or not other_balls or not pockets:
+            return None
+        return find_best_shot(cue_ball, other_balls, pockets, table_area=table_area, hull=hull, timer=timer)
+
+    def analyze(self, raw, dropped=0):
+        """Detekcja (lub śledzenie) i najlepszy strzał dla jednej klatki JPEG/PNG. Zwraca wiadomość wyniku."""
+        start = time.perf_counter()
+        timer = StageTimer()
+        self.frames += 1
+        STREAM_FRAMES.inc(result="processed")
+        if dropped:
+            STREAM_FRAMES.inc(dropped, result="dropped")
+        result = {"frame": self.frames, "dropped": dropped}
+
+        with timer.stage("decode"):
+            img = decode_image(raw)
+        if img is None:
+            result["error"] = "Błąd odczytu klatki"
+            return result
+        if self.session is not None:
+            try:
+                self.session.check_frame(img.shape)
+            except ValueError as e:
+                result["error"] = str(e)
+                return result
+
+        o = self.options
+        kwargs = {"pyramid_levels": o["pyramid_levels"]}
+        static = False
+        if o["track"]:
+            balls, info = self.tracker.process(img, timer=timer, detect=self.detect, **kwargs)
+            static = info["static"]
+            result["tracking"] = info
+        else:
+            _, _, balls = self.detect(img, session=self.session, table_area=o["table_area"],
+                                      calibration_point=o["calibration_point"], timer=timer, **kwargs)
+
+        # Nieruchoma scena (tryb track) - strzał z poprzedniej klatki nadal aktualny
+        if not (static and self._shot_valid):
+            self._best_shot = self._best(balls, timer)
+            self._shot_valid = True
+        result["balls"] = balls
+        result["best_shot"] = self._best_shot
+
+        for stage, ms in timer.stages.items():
+            STAGE_SECONDS.observe(ms / 1000.0, endpoint="/stream", stage=stage)
+        stages = {name: round(ms, 3) for name, ms in timer.stages.items()}
+        stages["total"] = round((time.perf_counter() - start) * 1000.0, 3)
+        result["timings"] = stages
+        return result
+
+def serve(ws, analyzer, media_type=JSON):
+    """
+    Pętla połączenia: najnowsza klatka -> analiza -> wynik, aż klient się rozłączy
+    (ConnectionClosed z simple_websocket przechodzi do wywołującego).
+    Wyniki w formacie media_type (wire_format.py; poza JSON jako wiadomości binarne),
+    potwierdzenia opcji i błędy opcji zawsze jako tekst JSON.
+    """
+    def on_text(text):
+        try:
+            analyzer.configure(text)
+            ws.send(json.dumps({"options": analyzer.options}))
+        except ValueError as e:
+            ws.send(json.dumps({"error": str(e)}))
+
+    while True:
+        raw, dropped = latest_frame(ws.receive, on_text)
+        try:
+            result = analyzer.analyze(raw, dropped)
+        except Exception as e:
+            # błąd jednej klatki (np. przeciążona pula) nie zamyka strumienia
+            logger.error(f"Stream Error: {e}", exc_info=True)
+            result = {"frame": analyzer.frames, "dropped": dropped, "error": str(e)}
+        ws.send(json.dumps(result) if media_type == JSON else encode(result, media_type))
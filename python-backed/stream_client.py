@@ -0,0 +1,156 @@
+"""
+Lokalny klient strumienia /stream (test bez aplikacji iOS).
+
+Wysyła klatki z pliku wideo, kamery, zdjęć albo syntetycznych scen w zadanym tempie (bez czekania
+na wyniki - serwer sam odrzuca nieaktualne klatki) i wypisuje odpowiedzi serwera:
+    python stream_client.py nagranie.mp4 --fps 30 --session <session_id> --pockets '[{"x": 40, "y": 60}, ...]'
+    python stream_client.py 0 --track --session <session_id>       # kamera nr 0
+    python stream_client.py --synthetic 60 --fps 20 --track        # sceny z synthetic.py, sesja tworzona sama
+    python stream_client.py --synthetic 60 --format packed         # wyniki w binarnym formacie packed
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.request
+import cv2
+from simple_websocket import Client, ConnectionClosed
+from wire_format import FORMATS, decode
+
+def frames_from_source(source, max_width=None):
+    """Klatki BGR z pliku wideo / numeru kamery / listy zdjęć."""
+    if len(source) == 1 and not source[0].lower().endswith(('.jpg', '.jpeg', '.png')):
+        capture = cv2.VideoCapture(int(source[0]) if source[0].isdigit() else source[0])
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield _fit(frame, max_width)
+        finally:
+            capture.release()
+        return
+    for path in source:
+        frame = cv2.imread(path)
+        if frame is not None:
+            yield _fit(frame, max_width)
+
+def _fit(frame, max_width):
+    if max_width and frame.shape[1] > max_width:
+        scale = max_width / frame.shape[1]
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return frame
+
+def synthetic_frames(count, seed=0):
+    """Sceny z synthetic.py: ten sam układ, bila biała przesuwa się co klatkę (zmiana tylko jednej bili)."""
+    from synthetic import render_scene
+    scene = render_scene(seed)
+    for i in range(count):
+        img = scene["image"].copy()
+        white = scene["balls"][0]
+        x, y, r = int(white["x"]), int(white["y"]), int(round(white["r"]))
+        # przesunięcie białej: zamalowanie starej pozycji kolorem sukna i narysowanie jej obok
+        felt = [int(c) for c in img[y, x - 2 * r]]
+        cv2.circle(img, (x, y), r + 2, felt, -1, cv2.LINE_AA)
+        cv2.circle(img, (x + 3 * (i % 10), y), r, (235, 235, 235), -1, cv2.LINE_AA)
+        yield img
+
+def create_session(http_url, table_area):
+    body = json.dumps({"table_area": table_area}).encode()
+    req = urllib.request.Request(f"{http_url}/session", data=body, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req) as resp:
+        return json.load(resp)["session_id"]
+
+def receive_results(ws, stats, done):
+    while not done.is_set():
+        try:
+            text = ws.receive(timeout=0.5)
+        except ConnectionClosed:
+            break
+        if text is None:
+            continue
+        # wynik binarny (--format packed / msgpack), tekst = JSON
+        msg = decode(text, FORMATS[stats["format"]]) if isinstance(text, bytes) else json.loads(text)
+        if "frame" not in msg:
+            print(msg)
+            continue
+        stats["results"] += 1
+        stats["dropped"] += msg.get("dropped", 0)
+        best = msg.get("best_shot")
+        target = f"{best['target_ball']['class']} -> łuza" if best else "brak"
+        tracking = msg.get("tracking", {})
+        print(f"klatka {msg['frame']}: bil {len(msg.get('balls', []))}, strzał: {target}, "
+              f"odrzucone {msg.get('dropped', 0)}, {msg.get('timings', {}).get('total', 0):.1f} ms"
+              + (" (pełna detekcja)" if tracking.get("full_detection") else "")
+              + (f" BŁĄD: {msg['error']}" if "error" in msg else ""))
+
+def main():
+    parser = argparse.ArgumentParser(description="Klient testowy strumienia /stream")
+    parser.add_argument("source", nargs="*", help="plik wideo, numer kamery albo zdjęcia JPG/PNG")
+    parser.add_argument("--url", default="ws://localhost:5001/stream")
+    parser.add_argument("--session", help="session_id (z POST /session)")
+    parser.add_argument("--pockets", help="łuzy jako JSON [{x, y}, ...]")
+    parser.add_argument("--cue", default="white", help="kolor bili rozgrywającej")
+    parser.add_argument("--track", action="store_true", help="tryb śledzenia (wymaga sesji)")
+    parser.add_argument("--fps", type=float, default=15.0, help="tempo wysyłania klatek")
+    parser.add_argument("--max-width", type=int, default=1280, help="zmniejszenie klatek przed wysłaniem")
+    parser.add_argument("--quality", type=int, default=80, help="jakość JPEG")
+    parser.add_argument("--synthetic", type=int, metavar="N", help="N syntetycznych klatek zamiast źródła")
+    parser.add_argument("--format", default="json", choices=sorted(FORMATS), help="format wyników (wire_format.py)")
+    args = parser.parse_args()
+
+    options = {"cue_ball_color": args.cue, "track": args.track}
+    if args.pockets:
+        options["pockets"] = json.loads(args.pockets)
+    session = args.session
+    if args.synthetic:
+        from synthetic import render_scene
+        scene = render_scene(0)
+        options.setdefault("pockets", scene["pockets"])
+        if session is None:
+            http_url = args.url.replace("ws://", "http://").replace("wss://", "https://").rsplit("/", 1)[0]
+            session = create_session(http_url, scene["table_area"])
+        frames = synthetic_frames(args.synthetic)
+    elif args.source:
+        frames = frames_from_source(args.source, args.max_width)
+    else:
+        parser.error("podaj źródło klatek albo --synthetic N")
+
+    url = args.url + f"?format={args.format}" + (f"&session_id={session}" if session else "")
+    ws = Client.connect(url)
+    stats = {"results": 0, "dropped": 0, "format": args.format}
+    done = threading.Event()
+    receiver = threading.Thread(target=receive_results, args=(ws, stats, done), daemon=True)
+    receiver.start()
+    ws.send(json.dumps(options))
+
+    sent, start = 0, time.perf_counter()
+    try:
+        for frame in frames:
+            ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, args.quality])
+            if not ok:
+                continue
+            ws.send(encoded.tobytes())
+            sent += 1
+            # stałe tempo jak z kamery, niezależnie od czasu przetwarzania na serwerze
+            delay = start + sent / args.fps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        # czekamy na wynik ostatniej klatki (albo informację, że została odrzucona)
+        deadline = time.perf_counter() + 10.0
+        while stats["results"] + stats["dropped"] < sent and time.perf_counter() < deadline:
+            time.sleep(0.05)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        done.set()
+        receiver.join(timeout=1.0)
+        ws.close()
+    elapsed = time.perf_counter() - start
+    print(f"Wysłano {sent} klatek w {elapsed:.1f} s, wyniki: {stats['results']}, odrzucone przez serwer: "
+          f"{stats['dropped']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
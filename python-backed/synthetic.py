@@ -0,0 +1,142 @@
+"""
+Syntetyczne sceny stołu bilardowego ze znanym położeniem i kolorem bil (ground truth).
+Używane przez benchmark.py do pomiaru precision/recall detekcji i czasu obliczeń strzałów.
+
+Scena powstaje w widoku z góry (sukno, bandy, łuzy, bile z cieniowaniem i cieniem),
+potem jest rzutowana perspektywą kamery i oświetlana nierównomiernie (gradient + szum sensora).
+Ten sam seed zawsze daje ten sam obraz.
+"""
+import cv2
+import numpy as np
+
+# Kolory bil zdefiniowane w HSV (OpenCV: H 0-180) - wartości zgodne z regułami classify_hsv_means
+BALL_COLORS_HSV = {
+    "white": (0, 15, 235),
+    "black": (0, 0, 25),
+    "red": (0, 210, 190),
+    "yellow": (30, 210, 225),
+    "blue": (112, 210, 170),
+    "purple": (150, 170, 150),
+    "orange": (17, 220, 235),
+    "brown": (8, 60, 110),
+    "green": (70, 210, 110),
+}
+FELT_HSV = (60, 170, 120)
+CUSHION_HSV = (55, 150, 70)
+
+def _hsv_to_bgr(hsv):
+    return cv2.cvtColor(np.uint8([[hsv]]), cv2.COLOR_HSV2BGR)[0, 0].astype(np.float32)
+
+def _draw_ball(canvas, x, y, r, color_bgr, light_dir):
+    """Bila z przyciemnionym brzegiem i odblaskiem (antyaliasing przez alfa z odległości od środka)."""
+    h, w = canvas.shape[:2]
+    x1, y1 = max(0, int(x - r - 2)), max(0, int(y - r - 2))
+    x2, y2 = min(w, int(x + r + 3)), min(h, int(y + r + 3))
+    ys, xs = np.mgrid[y1:y2, x1:x2].astype(np.float32)
+    dist = np.hypot(xs - x, ys - y)
+    alpha = np.clip(r + 0.5 - dist, 0.0, 1.0)[..., None]
+    shade = (1.0 - 0.35 * np.clip(dist / r, 0.0, 1.0) ** 2)[..., None]
+    hx, hy = x + light_dir[0] * 0.4 * r, y + light_dir[1] * 0.4 * r
+    highlight = (90.0 * np.exp(-((xs - hx) ** 2 + (ys - hy) ** 2) / (0.18 * r) ** 2))[..., None]
+    ball = np.clip(color_bgr * shade + highlight, 0, 255)
+    canvas[y1:y2, x1:x2] = canvas[y1:y2, x1:x2] * (1.0 - alpha) + ball * alpha
+
+def _draw_shadow(canvas, x, y, r, light_dir):
+    h, w = canvas.shape[:2]
+    sx, sy = x - light_dir[0] * 0.35 * r, y - light_dir[1] * 0.35 * r
+    x1, y1 = max(0, int(sx - 2 * r)), max(0, int(sy - 2 * r))
+    x2, y2 = min(w, int(sx + 2 * r)), min(h, int(sy + 2 * r))
+    ys, xs = np.mgrid[y1:y2, x1:x2].astype(np.float32)
+    shadow = 0.45 * np.exp(-((xs - sx) ** 2 + (ys - sy) ** 2) / (1.1 * r) ** 2)
+    canvas[y1:y2, x1:x2] *= (1.0 - shadow)[..., None]
+
+def render_scene(seed, width=808, n_balls=10, perspective=0.15, lighting=0.3, noise=4.0, ball_radius=None):
+    """
+    Renderuje scenę i zwraca dict:
+      image - obraz BGR uint8 (width x ~0.62*width),
+      balls - ground truth: [{"x", "y", "r", "class"}] we współrzędnych obrazu (class jak z detekcji, np. "Red"),
+      table_area - 4 narożniki sukna (do /detect i sesji), pockets - 6 łuz (do /calculate).
+    perspective - siła zniekształcenia kamery (0 = widok z góry), lighting - nierównomierność
+    oświetlenia (0 = równe), noise - odchylenie szumu sensora.
+    """
+    rng = np.random.default_rng(seed)
+    height = int(round(width * 0.62))
+    # Widok z góry: sukno w proporcji 2:1 z bandą dookoła
+    cushion = int(width * 0.045)
+    felt_w = width - 2 * cushion
+    felt_h = felt_w // 2
+    top_h = felt_h + 2 * cushion
+    r = float(ball_radius or width / 808 * 13)
+
+    canvas = np.empty((top_h, width, 3), dtype=np.float32)
+    canvas[:] = _hsv_to_bgr(CUSHION_HSV)
+    canvas[cushion:cushion + felt_h, cushion:cushion + felt_w] = _hsv_to_bgr(FELT_HSV)
+    # delikatna faktura sukna
+    canvas[cushion:cushion + felt_h, cushion:cushion + felt_w] += rng.normal(0, 2.5, (felt_h, felt_w, 1))
+
+    felt_corners = np.float32([[cushion, cushion], [cushion + felt_w, cushion],
+                               [cushion + felt_w, cushion + felt_h], [cushion, cushion + felt_h]])
+    pockets_top = np.float32([[cushion, cushion], [width / 2, cushion - 0.3 * r], [cushion + felt_w, cushion],
+                              [cushion, cushion + felt_h], [width / 2, cushion + felt_h + 0.3 * r],
+                              [cushion + felt_w, cushion + felt_h]])
+    for px, py in pockets_top:
+        cv2.circle(canvas, (int(px), int(py)), int(1.7 * r), (12, 12, 12), -1, cv2.LINE_AA)
+
+    # Rozmieszczenie bil bez nakładania (losowanie z odrzucaniem)
+    names = ["white"] + list(rng.choice([c for c in BALL_COLORS_HSV if c != "white"], size=max(0, n_balls - 1)))
+    margin = 2.2 * r
+    placed = []
+    for name in names:
+        for _ in range(200):
+            x = rng.uniform(cushion + margin, cushion + felt_w - margin)
+            y = rng.uniform(cushion + margin, cushion + felt_h - margin)
+            if all(np.hypot(x - px, y - py) > 2.6 * r for px, py, _ in placed):
+                placed.append((x, y, name))
+                break
+
+    angle = rng.uniform(0, 2 * np.pi)
+    light_dir = (np.cos(angle), np.sin(angle))
+    for x, y, _ in placed:
+        _draw_shadow(canvas, x, y, r, light_dir)
+    for x, y, name in placed:
+        _draw_ball(canvas, x, y, r, _hsv_to_bgr(BALL_COLORS_HSV[name]), light_dir)
+
+    # Kamera: narożniki stołu z losowym zniekształceniem perspektywy (bliższa krawędź szersza)
+    src = np.float32([[0, 0], [width, 0], [width, top_h], [0, top_h]])
+    # pochylenie kamery skraca też stół w pionie
+    inset = np.float32([[0.05, 0.08 + perspective], [0.95, 0.08 + perspective], [0.95, 0.92], [0.05, 0.92]]) * [width, height]
+    squeeze = perspective * width * np.float32([[1, 0], [-1, 0], [0, 0], [0, 0]])
+    jitter = rng.uniform(-1, 1, (4, 2)).astype(np.float32) * perspective * 0.15 * width
+    dst = (inset + squeeze * rng.uniform(0.5, 1.0) + jitter).astype(np.float32)
+    H = cv2.getPerspectiveTransform(src, dst)
+
+    background = np.full((height, width, 3), 45, dtype=np.float32) + rng.normal(0, 6, (height, width, 1))
+    view = cv2.warpPerspective(canvas, H, (width, height), flags=cv2.INTER_LINEAR)
+    mask = cv2.warpPerspective(np.ones((top_h, width), np.float32), H, (width, height), flags=cv2.INTER_LINEAR)
+    image = view + background * (1.0 - mask[..., None])
+
+    # Oświetlenie: gradient jasności w losowym kierunku + szum sensora
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    gx, gy = rng.uniform(-1, 1, 2)
+    gradient = 1.0 + lighting * ((xs / width - 0.5) * gx + (ys / height - 0.5) * gy)
+    image = image * gradient[..., None] + rng.normal(0, noise, image.shape)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+
+    def project(points):
+        return cv2.perspectiveTransform(np.float32(points).reshape(-1, 1, 2), H).reshape(-1, 2)
+
+    balls = []
+    if placed:
+        centers = project([(x, y) for x, y, _ in placed])
+        edges_x = project([(x + r, y) for x, y, _ in placed])
+        edges_y = project([(x, y + r) for x, y, _ in placed])
+        radii = 0.5 * (np.hypot(*(edges_x - centers).T) + np.hypot(*(edges_y - centers).T))
+        for (cx, cy), br, (_, _, name) in zip(centers, radii, placed):
+            balls.append({"x": float(cx), "y": float(cy), "r": float(br), "class": name.capitalize()})
+    corners = project(felt_corners)
+    return {
+        "image": image,
+        "balls": balls,
+        "table_area": [{"x": int(round(x)), "y": int(round(y))} for x, y in corners],
+        "pockets": [{"x": int(round(x)), "y": int(round(y))} for x, y in project(pockets_top)],
+    }
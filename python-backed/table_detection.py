@@ -0,0 +1,290 @@
+"""
+Automatyczne wykrywanie stołu na klatce z kamery: sukno, narożniki, łuzy.
+
+Liczone raz na sesję kalibracyjną (POST /session ze zdjęciem zamiast table_area), dalej z cache sesji:
+  1. kolor sukna - dominujący odcień nasyconych pikseli w środkowej części kadru (sukno szare: barwa w Lab),
+  2. maska sukna - piksele o podobnej barwie i jasności zbliżonej do sukna w otoczeniu, największa
+     spójna składowa,
+  3. narożniki - cztery boki dopasowane prostymi (cv2.fitLine) do konturu maski, z pominięciem wcięć łuz
+     i bil przy bandzie, narożniki = przecięcia sąsiednich boków,
+  4. łuzy - cztery narożniki + środki tych przeciwległych boków, przy których widać ciemne otwory łuz,
+  5. otwory łuz - ciemne plamy przy łuzach w widoku z góry, zamalowywane przed Houghem (pocket_hole_mask).
+Wszystko liczone na klatce zmniejszonej do DETECT_WIDTH px i skalowane z powrotem.
+"""
+import logging
+import itertools
+import numpy as np
+import cv2
+from geometry import compute_perspective, order_points
+
+logger = logging.getLogger(__name__)
+
+# Szerokość robocza (px) - wynik skalowany do rozdzielczości klatki
+DETECT_WIDTH = 400
+
+# Kolor sukna: środkowa część kadru (ułamek szerokości/wysokości) i minimalne nasycenie próbek
+CENTER_FRACTION = 0.4
+MIN_FELT_SATURATION = 50
+# poniżej tego ułamka nasyconych pikseli sukno jest szare - barwa porównywana w Lab (a, b)
+MIN_SATURATED_FRACTION = 0.5
+CHROMA_TOLERANCE = 4
+
+# Maska sukna: tolerancja odcienia i progi nasycenia / jasności względem koloru sukna
+HUE_TOLERANCE = 12
+SATURATION_RATIO = 0.5
+# (jasność względem najjaśniejszego sukna w oknie LOCAL_WINDOW x szerokość kadru i względem środka kadru)
+VALUE_RATIO = 0.75
+LOCAL_WINDOW = 0.1
+MIN_VALUE_RATIO = 0.3
+
+# Sukno musi zajmować co najmniej tyle kadru, a czworokąt - tyle otoczki maski
+MIN_FELT_FRACTION = 0.1
+MIN_QUAD_FILL = 0.85
+# Wierzchołki otoczki, spośród których wybierany jest czworokąt (przegląd wszystkich czwórek)
+MAX_HULL_VERTICES = 12
+
+# Dopasowanie boków: punkty konturu cofnięte względem krawędzi bardziej niż ułamek długości boku to wcięcia
+# łuz / bile przy bandzie
+SIDE_TOLERANCE = 0.02
+# pomijane końce boku (narożne łuzy)
+SIDE_END_MARGIN = 0.12
+
+# Narożnik bliżej krawędzi kadru niż tyle pikseli (w skali roboczej) = stół nie mieści się w kadrze
+BORDER_MARGIN = 2
+
+# Okno (ułamek dłuższego boku stołu), w którym porównywana jest jasność środków boków przy wyborze łuz środkowych
+POCKET_SAMPLE = 0.03
+
+# Otwór łuzy: ciemniejsze niż ułamek jasności sukna, szukane w oknie o boku ułamka dłuższego boku stołu
+POCKET_VALUE_RATIO = 0.5
+POCKET_WINDOW = 0.08
+
+def _circular_hue_distance(h, ref):
+    d = np.abs(h.astype(np.int16) - int(ref))
+    return np.minimum(d, 180 - d)
+
+def felt_color(hsv):
+    """
+    Kolor sukna (h, s, v, neutral) ze środka kadru. Sukno kolorowe: dominujący odcień nasyconych pikseli,
+    potem mediana S i V pikseli o tym odcieniu. Sukno szare (mało nasyconych pikseli, neutral=True):
+    mediany H, S, V całego środka - maska liczona wtedy z odległości barwy w Lab (felt_mask).
+    """
+    h, w = hsv.shape[:2]
+    mx, my = int(w * (1 - CENTER_FRACTION) / 2), int(h * (1 - CENTER_FRACTION) / 2)
+    center = hsv[my:h - my, mx:w - mx].reshape(-1, 3)
+    saturated = center[center[:, 1] >= MIN_FELT_SATURATION]
+    if len(saturated) < MIN_SATURATED_FRACTION * len(center):
+        hue, sat, val = np.median(center, axis=0)
+        return int(hue), float(sat), float(val), True
+    hue = int(np.argmax(np.bincount(saturated[:, 0], minlength=180)))
+    same = saturated[_circular_hue_distance(saturated[:, 0], hue) <= HUE_TOLERANCE // 2]
+    return hue, float(np.median(same[:, 1])), float(np.median(same[:, 2])), False
+
+def _chroma_mask(image, hsv, color):
+    """Piksele o barwie sukna niezależnie od jasności: odcień + nasycenie albo (sukno szare) a, b w Lab."""
+    hue, sat, _, neutral = color
+    if not neutral:
+        return (_circular_hue_distance(hsv[..., 0], hue) <= HUE_TOLERANCE) & (hsv[..., 1] >= SATURATION_RATIO * sat)
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+    h, w = lab.shape[:2]
+    mx, my = int(w * (1 - CENTER_FRACTION) / 2), int(h * (1 - CENTER_FRACTION) / 2)
+    a, b = np.median(lab[my:h - my, mx:w - mx, 1:].reshape(-1, 2), axis=0)
+    return np.hypot(lab[..., 1] - a, lab[..., 2] - b) <= CHROMA_TOLERANCE
+
+def felt_mask(image, hsv, color):
+    """
+    Maska pikseli w kolorze sukna (uint8, 255 = sukno), bez wygładzania. Jasność porównywana jest
+    z najjaśniejszym pikselem w kolorze sukna w otoczeniu (dylatacja) - przy nierównym oświetleniu
+    banda jest ciemniejsza od sukna obok niej, ale nie od sukna w ciemniejszym rogu kadru.
+    """
+    chroma = _chroma_mask(image, hsv, color)
+    value = np.where(chroma, hsv[..., 2], 0).astype(np.uint8)
+    size = max(3, int(LOCAL_WINDOW * hsv.shape[1]) | 1)
+    local = cv2.dilate(value, cv2.getStructuringElement(cv2.MORPH_RECT, (size, size)))
+    mask = chroma & (value >= VALUE_RATIO * local.astype(np.float32)) & (value >= MIN_VALUE_RATIO * color[2])
+    return mask.astype(np.uint8) * 255
+
+def _largest_component(mask):
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=4)
+    if count < 2:
+        return None
+    best = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+    return (labels == best).astype(np.uint8) * 255
+
+def _intersect(l1, l2):
+    """Przecięcie dwóch prostych (vx, vy, x0, y0) - None dla równoległych."""
+    (vx1, vy1, x1, y1), (vx2, vy2, x2, y2) = l1, l2
+    det = vx1 * (-vy2) - vy1 * (-vx2)
+    if abs(det) < 1e-9:
+        return None
+    t = ((x2 - x1) * (-vy2) - (y2 - y1) * (-vx2)) / det
+    return np.array([x1 + t * vx1, y1 + t * vy1])
+
+def _side_line(pts, a, b, center):
+    """
+    Prosta boku a-b: punkty konturu ze środkowej części boku, najbardziej wysunięte na zewnątrz
+    (wcięcia łuz i bil przy bandzie leżą do środka stołu), dopasowane dwukrotnie - drugi raz
+    względem pierwszej prostej, bo wstępny bok z approxPolyDP bywa przekrzywiony przez otwory łuz.
+    Zwraca (vx, vy, x0, y0) albo None.
+    """
+    ab = b - a
+    length = np.hypot(*ab)
+    if length == 0:
+        return None
+    t = (pts - a) @ ab / length ** 2
+    section = pts[(t > SIDE_END_MARGIN) & (t < 1 - SIDE_END_MARGIN)]
+    normal = np.array([ab[1], -ab[0]]) / length
+    if (a - center) @ normal < 0:
+        normal = -normal
+    origin, band = a, SIDE_TOLERANCE * length + 1.5
+    line = None
+    for _ in range(2):
+        outward = (section - origin) @ normal
+        near = section[outward > np.percentile(outward, 90) - band] if len(section) else section
+        if len(near) < 5:
+            return line
+        line = cv2.fitLine(near.astype(np.float32), cv2.DIST_HUBER, 0, 0.01, 0.01).ravel()
+        normal = np.array([line[1], -line[0]]) if (a - center) @ np.array([line[1], -line[0]]) >= 0 \
+            else np.array([-line[1], line[0]])
+        origin = line[2:]
+    return line
+
+def _fit_sides(contour, quad):
+    """
+    Narożniki z przecięć prostych dopasowanych do czterech boków konturu (patrz _side_line).
+    Zwraca quad, gdy dopasowanie się nie uda.
+    """
+    pts = contour.reshape(-1, 2).astype(np.float64)
+    center = quad.mean(axis=0)
+    lines = [_side_line(pts, quad[i], quad[(i + 1) % 4], center) for i in range(4)]
+    if any(line is None for line in lines):
+        return quad
+    corners = [_intersect(lines[i - 1], lines[i]) for i in range(4)]
+    if any(c is None for c in corners):
+        return quad
+    corners = np.array(corners)
+    # przecięcie daleko od wstępnego narożnika = zły bok (np. bila przy bandzie na całej długości)
+    if np.max(np.hypot(*(corners - quad).T)) > 0.15 * np.hypot(*(quad[2] - quad[0])):
+        return quad
+    return corners
+
+def _quad(contour):
+    """
+    Wstępny czworokąt: spośród wierzchołków uproszczonej otoczki (approxPolyDP) cztery o największym
+    polu - ścięte przez otwory łuz narożniki dają po dwa bliskie wierzchołki, z których wybierany jest
+    jeden. Zwraca (quad (4 x 2) albo None, otoczka).
+    """
+    hull = cv2.convexHull(contour)
+    perimeter = cv2.arcLength(hull, True)
+    for eps in (0.01, 0.02, 0.04):
+        approx = cv2.approxPolyDP(hull, eps * perimeter, True).reshape(-1, 2).astype(np.float64)
+        if len(approx) <= MAX_HULL_VERTICES:
+            break
+    if len(approx) < 4:
+        return None, hull
+    best, best_area = None, 0.0
+    for idx in itertools.combinations(range(len(approx)), 4):
+        area = cv2.contourArea(approx[list(idx)].astype(np.float32))
+        if area > best_area:
+            best, best_area = approx[list(idx)], area
+    return best, hull
+
+def pocket_positions(table_area, value=None, scale=1.0):
+    """
+    Sześć łuz dla narożników sukna: narożniki + środki dwóch przeciwległych boków. Środki liczone
+    w widoku z góry i rzutowane z powrotem (w perspektywie środek boku na obrazie nie jest środkiem
+    odcinka). Przy podanym value (kanał V obrazu zmniejszonego scale razy) wybierana jest para boków,
+    przy której środkach jest ciemniej (otwory łuz) - kamera skraca stół, więc dłuższy bok na obrazie
+    nie musi być dłuższym bokiem stołu. Bez value - środki dłuższych boków w widoku z góry.
+    """
+    M, M_inv, (w, h) = compute_perspective(table_area)
+    top = np.float32([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]])
+    pairs = [[[(w - 1) / 2, 0], [(w - 1) / 2, h - 1]], [[0, (h - 1) / 2], [w - 1, (h - 1) / 2]]]
+    if w < h:
+        pairs.reverse()
+    def project(points):
+        return cv2.perspectiveTransform(np.float32(points).reshape(-1, 1, 2), M_inv).reshape(-1, 2)
+    middle = project(pairs[0])
+    if value is not None:
+        radius = max(2, int(POCKET_SAMPLE * max(w, h) / scale))
+        def darkness(points):
+            samples = []
+            for x, y in points / scale:
+                x, y = int(round(x)), int(round(y))
+                window = value[max(0, y - radius):y + radius + 1, max(0, x - radius):x + radius + 1]
+                samples.append(window.mean() if window.size else 255.0)
+            return np.mean(samples)
+        candidates = [project(pair) for pair in pairs]
+        middle = min(candidates, key=darkness)
+    pts = np.vstack((project(top), middle))
+    return [{"x": int(round(x)), "y": int(round(y))} for x, y in pts]
+
+def detect_table(image):
+    """
+    Wykrywa stół na obrazie BGR. Zwraca dict:
+      table_area - 4 narożniki sukna (kolejność jak order_points), pockets - 6 łuz.
+    ValueError, gdy w kadrze nie ma wyraźnego, czworokątnego sukna.
+    """
+    if image is None or image.ndim != 3:
+        raise ValueError("Błąd odczytu obrazu")
+    h, w = image.shape[:2]
+    scale = w / DETECT_WIDTH if w > DETECT_WIDTH else 1.0
+    small = cv2.resize(image, (round(w / scale), round(h / scale)), interpolation=cv2.INTER_AREA) if scale > 1 else image
+    small = cv2.GaussianBlur(small, (5, 5), 0)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+
+    color = felt_color(hsv)
+    mask = felt_mask(small, hsv, color)
+    # otwarcie rozcina cienkie połączenia z bandami / tłem w podobnym kolorze
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
+    mask = _largest_component(mask)
+    if mask is None or cv2.countNonZero(mask) < MIN_FELT_FRACTION * mask.size:
+        raise ValueError("Nie znaleziono sukna (za mały obszar w kolorze stołu)")
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    contour = max(contours, key=cv2.contourArea)
+    quad, hull = _quad(contour)
+    if quad is None or cv2.contourArea(quad.astype(np.float32)) < MIN_QUAD_FILL * cv2.contourArea(hull):
+        raise ValueError("Nie znaleziono narożników stołu (sukno nie jest czworokątem)")
+    corners = order_points(_fit_sides(contour, quad).astype(np.float32))
+    # sukno ucięte krawędzią kadru - narożniki i łuzy byłyby zgadywane
+    sh, sw = small.shape[:2]
+    if np.any((corners < BORDER_MARGIN) | (corners > [sw - 1 - BORDER_MARGIN, sh - 1 - BORDER_MARGIN])):
+        raise ValueError("Stół nie mieści się w kadrze - podaj table_area ręcznie")
+    corners *= scale
+
+    table_area = [{"x": int(round(x)), "y": int(round(y))} for x, y in corners]
+    result = {"table_area": table_area, "pockets": pocket_positions(table_area, hsv[..., 2], scale)}
+    logger.info(f"Wykryto stół: narożniki {table_area}, sukno HSV {color[:3]}")
+    return result
+
+def pocket_hole_mask(warped, pockets_top):
+    """
+    Maska otworów łuz w widoku z góry (uint8, 255 = otwór): ciemne plamy połączone z punktem łuzy,
+    w oknie wokół łuzy, poszerzone o kilka pikseli (krawędź rozmycia). Piksele maski są przed
+    Houghem zamalowywane szarością sukna, żeby krawędzie otworów nie dawały fałszywych okręgów.
+    None, gdy nie znaleziono żadnego otworu.
+    """
+    h, w = warped.shape[:2]
+    value = cv2.cvtColor(warped, cv2.COLOR_BGR2HSV)[..., 2]
+    # jasność sukna = mediana środka widoku z góry (same sukno i bile)
+    felt_value = np.median(value[h // 4:h - h // 4, w // 4:w - w // 4])
+    dark = (value < POCKET_VALUE_RATIO * felt_value).astype(np.uint8)
+    half = max(3, int(POCKET_WINDOW * max(w, h)))
+    mask = np.zeros((h, w), dtype=np.uint8)
+    for px, py in pockets_top:
+        x, y = int(min(max(px, 0), w - 1)), int(min(max(py, 0), h - 1))
+        x1, y1, x2, y2 = max(0, x - half), max(0, y - half), min(w, x + half + 1), min(h, y + half + 1)
+        window = dark[y1:y2, x1:x2]
+        count, labels = cv2.connectedComponents(window, connectivity=8)
+        if count < 2:
+            continue
+        # składowa najbliżej punktu łuzy (łuza może leżeć tuż za krawędzią sukna)
+        ys, xs = np.nonzero(labels)
+        nearest = np.argmin(np.hypot(xs - (x - x1), ys - (y - y1)))
+        if np.hypot(xs[nearest] - (x - x1), ys[nearest] - (y - y1)) > half / 2:
+            continue
+        mask[y1:y2, x1:x2][labels == labels[ys[nearest], xs[nearest]]] = 255
+    if not mask.any():
+        return None
+    return cv2.dilate(mask, np.ones((7, 7), np.uint8))
@@ -0,0 +1,38 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+class StageTimer:
+    """
+    Zbiera czasy kolejnych etapów przetwarzania (w milisekundach).
+    Użycie:
+        timer = StageTimer()
+        with timer.stage("hough"):
+            ...
+        timer.stages  # {"hough": 12.3}
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000.0)
+
+    def add(self, name, ms):
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def total(self):
+        return sum(self.stages.values())
+
+    def summary(self):
+        """Krótki opis do logów, np. 'warp=1.2 hough_1=80.3 (razem 95.1 ms)'."""
+        parts = " ".join(f"{name}={ms:.1f}" for name, ms in self.stages.items())
+        return f"{parts} (razem {self.total():.1f} ms)"
+
+def timed(timer, name):
+    """timer.stage(name), a jeśli timer jest None - pusty kontekst (pomiar opcjonalny)."""
+    return timer.stage(name) if timer is not None else nullcontext()
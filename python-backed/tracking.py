@@ -0,0 +1,233 @@
+import threading
+import numpy as np
+import cv2
+import logging
+from cache import TTLCache
+from config import SESSION_MAX_ENTRIES, SESSION_TTL, TRACK_FULL_EVERY, TRACK_MIN_SCORE
+from image_processing import detect_balls_in_image
+from timing import StageTimer
+
+logger = logging.getLogger(__name__)
+
+# Wzorce większe niż ~COARSE_TEMPLATE_SIZE px są dopasowywane najpierw w zmniejszonej skali
+COARSE_TEMPLATE_SIZE = 16
+
+class BallTrack:
+    """Pojedyncza śledzona bila (współrzędne oryginalnego obrazu) + wzorzec do dopasowania."""
+
+    def __init__(self, track_id, ball, template):
+        self.track_id = track_id
+        self.x, self.y, self.r = int(ball['x']), int(ball['y']), int(ball['r'])
+        self.cls = ball['class']
+        self.confidence = ball['confidence']
+        self.vx = self.vy = 0.0
+        self.static_frames = 0
+        self.set_template(*template)
+
+    def set_template(self, template, offset):
+        self.template, self.offset = template, offset
+        # wektor wzorca bez średniej + norma - do szybkiej korelacji w przewidzianym miejscu
+        self.template_vec = None
+        if template is not None:
+            vec = template.astype(np.float32).ravel()
+            vec -= vec.mean()
+            self.template_vec, self.template_norm = vec, float(np.sqrt(vec @ vec))
+
+    def predict(self):
+        """Model stałej prędkości - przewidywana pozycja w następnej klatce."""
+        return self.x + self.vx, self.y + self.vy
+
+    def move_to(self, x, y, static_tol):
+        dx, dy = x - self.x, y - self.y
+        # prędkość wygładzona, żeby pojedynczy skok dopasowania nie rozjechał predykcji
+        self.vx = 0.5 * self.vx + 0.5 * dx
+        self.vy = 0.5 * self.vy + 0.5 * dy
+        self.x, self.y = int(x), int(y)
+        if np.hypot(dx, dy) <= static_tol:
+            self.static_frames += 1
+        else:
+            self.static_frames = 0
+
+    def to_dict(self):
+        return {"x": self.x, "y": self.y, "r": self.r, "class": self.cls,
+                "confidence": float(self.confidence), "track_id": self.track_id,
+                "static": self.static_frames > 0}
+
+class BallTracker:
+    """
+    Śledzenie bil między kolejnymi klatkami stałej kamery (jedna instancja na sesję kalibracyjną).
+    Pełna detekcja (detect_balls_in_image) uruchamiana jest co full_every klatek, przy pierwszej
+    klatce i gdy któryś ślad się zgubi. W pozostałych klatkach każda bila jest szukana tylko
+    w małym oknie wokół pozycji przewidzianej modelem stałej prędkości (cv2.matchTemplate
+    z wzorcem zapamiętanym przy pełnej detekcji).
+    Bila jest "static", jeśli od poprzedniej klatki przesunęła się o <= static_tol px.
+    """
+
+    def __init__(self, session=None, full_every=TRACK_FULL_EVERY, min_score=TRACK_MIN_SCORE, static_tol=2.0,
+                 static_score=0.9):
+        self.session = session
+        self.full_every = max(1, int(full_every))
+        self.min_score = float(min_score)
+        # korelacja w przewidzianym miejscu, od której bila uznawana jest za niezmienioną (bez szukania w oknie)
+        self.static_score = float(static_score)
+        self.static_tol = float(static_tol)
+        self.tracks = []
+        self.frame_index = 0
+        self._next_id = 1
+        self._since_full = 0
+        self._shape = None
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.tracks = []
+            self._since_full = 0
+            self._shape = None
+
+    def _template(self, img, x, y, r):
+        """
+        Wycinek (2r+1)^2 wokół bili - razem z fragmentem sukna, który daje kontrast.
+        Przy krawędzi obrazu przycięty. Zwraca (wzorzec, (ox, oy) - położenie środka bili we wzorcu).
+        """
+        h, w = img.shape[:2]
+        half = max(4, int(r))
+        x1, y1 = max(0, x - half), max(0, y - half)
+        x2, y2 = min(w, x + half + 1), min(h, y + half + 1)
+        if x2 - x1 < 5 or y2 - y1 < 5:
+            return None, (0, 0)
+        return img[y1:y2, x1:x2].copy(), (x - x1, y - y1)
+
+    def _match(self, img, track):
+        """Szuka wzorca bili w oknie wokół przewidzianej pozycji. Zwraca (x, y) albo None (zgubiona)."""
+        template = track.template
+        if template is None:
+            return None
+        h, w = img.shape[:2]
+        th, tw = template.shape[:2]
+        ox, oy = track.offset
+        px, py = (int(round(v)) for v in track.predict())
+
+        # Szybka ścieżka (nieruchomy stół): jedna korelacja dokładnie w przewidzianym miejscu
+        x0, y0 = px - ox, py - oy
+        if x0 >= 0 and y0 >= 0 and x0 + tw <= w and y0 + th <= h:
+            # numpy zamiast matchTemplate - dla jednej pozycji wielokrotnie szybsze
+            patch = img[y0:y0 + th, x0:x0 + tw].astype(np.float32).ravel()
+            patch -= patch.mean()
+            denom = track.template_norm * float(np.sqrt(patch @ patch))
+            if denom > 0 and float(patch @ track.template_vec) / denom >= self.static_score:
+                return px, py
+
+        # okno = wzorzec + margines na ruch (zależny od prędkości)
+        margin = int(8 + track.r * 0.5 + abs(track.vx) + abs(track.vy))
+        x1, y1 = max(0, x0 - margin), max(0, y0 - margin)
+        x2, y2 = min(w, x0 + tw + margin), min(h, y0 + th + margin)
+        if x2 - x1 < tw or y2 - y1 < th:
+            return None
+        # Duże bile: najpierw zgrubnie na pomniejszonym oknie, potem tylko +-step px w pełnej rozdzielczości
+        step = max(th, tw) // COARSE_TEMPLATE_SIZE
+        if step > 1:
+            small = cv2.resize(img[y1:y2, x1:x2], ((x2 - x1) // step, (y2 - y1) // step), interpolation=cv2.INTER_AREA)
+            small_t = cv2.resize(template, (tw // step, th // step), interpolation=cv2.INTER_AREA)
+            _, _, _, loc = cv2.minMaxLoc(cv2.matchTemplate(small, small_t, cv2.TM_CCOEFF_NORMED))
+            cx, cy = x1 + loc[0] * step, y1 + loc[1] * step
+            x1, y1 = min(max(0, cx - step), w - tw), min(max(0, cy - step), h - th)
+            x2, y2 = min(w, cx + step + tw + 1), min(h, cy + step + th + 1)
+        _, score, _, loc = cv2.minMaxLoc(cv2.matchTemplate(img[y1:y2, x1:x2], template, cv2.TM_CCOEFF_NORMED))
+        if score < self.min_score:
+            return None
+        return x1 + loc[0] + ox, y1 + loc[1] + oy
+
+    def _associate(self, img, detected):
+        """Najbliższy sąsiad: wykryte bile -> istniejące ślady (bramka ~1.5 promienia + ruch)."""
+        tracks = self.tracks
+        matched_tracks, matched_balls = set(), set()
+        if tracks and detected:
+            pred = np.array([t.predict() for t in tracks], dtype=float)
+            gate = np.array([1.5 * t.r + abs(t.vx) + abs(t.vy) for t in tracks], dtype=float)
+            pos = np.array([[b['x'], b['y']] for b in detected], dtype=float)
+            dist = np.hypot(pred[:, None, 0] - pos[None, :, 0], pred[:, None, 1] - pos[None, :, 1])
+            for flat in np.argsort(dist, axis=None):
+                ti, bi = np.unravel_index(flat, dist.shape)
+                if dist[ti, bi] > gate[ti] or ti in matched_tracks or bi in matched_balls:
+                    continue
+                matched_tracks.add(ti)
+                matched_balls.add(bi)
+                track, ball = tracks[ti], detected[bi]
+                track.move_to(ball['x'], ball['y'], self.static_tol)
+                track.r, track.cls, track.confidence = int(ball['r']), ball['class'], ball['confidence']
+                template, offset = self._template(img, track.x, track.y, track.r)
+                if template is not None:
+                    track.set_template(template, offset)
+
+        kept = [tracks[i] for i in sorted(matched_tracks)]
+        # Ślady bez detekcji (Hough bywa niestabilny) - zostają, jeśli wzorzec wciąż pasuje
+        for i, track in enumerate(tracks):
+            if i in matched_tracks:
+                continue
+            found = self._match(img, track)
+            if found is not None:
+                track.move_to(found[0], found[1], self.static_tol)
+                kept.append(track)
+        for bi, ball in enumerate(detected):
+            if bi in matched_balls:
+                continue
+            new = BallTrack(self._next_id, ball, self._template(img, int(ball['x']), int(ball['y']), int(ball['r'])))
+            self._next_id += 1
+            kept.append(new)
+        return kept
+
+    def process(self, img, timer=None, detect=None, **detect_kwargs):
+        """
+        Przetwarza kolejną klatkę (BGR, oryginalne współrzędne).
+        detect - funkcja pełnej detekcji o sygnaturze detect_balls_in_image (np. DetectionPool.detect);
+        detect_kwargs trafiają do niej przy pełnej detekcji (pyramid_levels...).
+        Zwraca (balls, info): balls - lista bil jak z detekcji + "track_id" i "static";
+        info - {"frame", "full_detection", "static"}; static = żadna bila się nie ruszyła
+        i zestaw śladów się nie zmienił (klient może pominąć przeliczanie strzałów).
+        """
+        if timer is None:
+            timer = StageTimer()
+        with self._lock:
+            self.frame_index += 1
+            previous_ids = {t.track_id for t in self.tracks}
+            full = (not self.tracks or self._shape != img.shape[:2] or self._since_full >= self.full_every - 1)
+
+            if not full:
+                with timer.stage("track"):
+                    positions = [self._match(img, t) for t in self.tracks]
+                if any(p is None for p in positions):
+                    # zgubiony ślad (bila wbita / zasłonięta / szybki ruch) - pełna detekcja od razu
+                    logger.info("Tracking: zgubiony ślad, pełna detekcja")
+                    full = True
+                else:
+                    for track, (x, y) in zip(self.tracks, positions):
+                        track.move_to(x, y, self.static_tol)
+                    self._since_full += 1
+
+            if full:
+                _, _, detected = (detect or detect_balls_in_image)(img, session=self.session, timer=timer,
+                                                                   **detect_kwargs)
+                with timer.stage("associate"):
+                    self.tracks = self._associate(img, detected)
+                self._since_full = 0
+                self._shape = img.shape[:2]
+
+            balls = sorted((t.to_dict() for t in self.tracks), key=lambda b: b['confidence'], reverse=True)
+            scene_static = (bool(previous_ids) and previous_ids == {t.track_id for t in self.tracks}
+                            and all(b['static'] for b in balls))
+            info = {"frame": self.frame_index, "full_detection": full, "static": scene_static}
+        logger.info(f"Tracking klatka {self.frame_index} (pełna={full}): {timer.summary()}")
+        return balls, info
+
+# Trackery per sesja kalibracyjna (ten sam limit i TTL co sesje)
+trackers = TTLCache(maxsize=SESSION_MAX_ENTRIES, ttl=SESSION_TTL, sliding=True)
+_trackers_lock = threading.Lock()
+
+def get_tracker(session):
+    """Tracker przypisany do sesji (tworzony przy pierwszej klatce)."""
+    with _trackers_lock:
+        tracker = trackers.get(session.session_id)
+        if tracker is None:
+            tracker = BallTracker(session)
+            trackers.set(session.session_id, tracker)
+        return tracker
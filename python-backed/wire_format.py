@@ -0,0 +1,249 @@
+"""
+Kompaktowe kodowanie odpowiedzi (bile, strzały) dla klientów strumieniowych i wysokiej częstotliwości.
+
+Format wybierany nagłówkiem Accept (domyślnie JSON):
+    application/json                  - jak dotąd,
+    application/x-billiards-packed    - binarny układ struct (poniżej),
+    application/msgpack               - MessagePack (tylko gdy zainstalowany pakiet msgpack).
+Te same typy w Content-Type requestu pozwalają wysłać dane wejściowe (/calculate, /analyze) w tym formacie.
+
+Układ packed (little-endian):
+    nagłówek  "BILP", wersja u8, flagi u8, liczba bil u16, liczba strzałów u16
+    reszta    u32 długość + JSON z pozostałymi polami odpowiedzi (detection_id, timings, tracking, message,
+              symulacje i inne dodatkowe pola strzałów w "shot_extras", nazwy klas spoza COLOR_NAMES w "ball_classes")
+    bile      BALL na bilę: x, y, r (int16), kolor (u8, indeks w COLOR_NAMES, 255 = inna nazwa),
+              confidence (u8, 0-255), id, track_id (int16, -1 = brak), flagi u8 (static)
+    strzały   SHOT: typ (u8), flagi (u8), kąt (u16, setne stopnia), szansa wbicia (u16, 0-65534, 65535 = brak),
+              bila docelowa (BALL), łuza (x, y), ghost ball (x, y, r), [punkt odbicia (x, y)],
+              [pierwsza bila kombinacji (BALL)], [bila blokująca (BALL)], liczba odcinków u8 + odcinki (4 x int16)
+best_shot nie jest powtarzany: flaga mówi, czy to pierwszy element shots, null, czy osobny rekord na końcu listy.
+"""
+import json
+import struct
+from color_detection import COLOR_NAMES
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "application/json"
+PACKED = "application/x-billiards-packed"
+MSGPACK = "application/msgpack"
+
+# Krótkie nazwy formatów (np. ?format=packed w /stream)
+FORMATS = {"json": JSON, "packed": PACKED, "msgpack": MSGPACK}
+
+MAGIC, VERSION = b"BILP", 1
+
+HEADER = struct.Struct("<4sBBHH")
+BALL = struct.Struct("<hhhBBhhB")
+SHOT = struct.Struct("<BBHH")
+POINT = struct.Struct("<hh")
+CIRCLE = struct.Struct("<hhh")
+SEGMENT = struct.Struct("<hhhh")
+COUNT = struct.Struct("<B")
+TAIL = struct.Struct("<I")
+
+# Flagi nagłówka
+HAS_BALLS, HAS_SHOTS, HAS_BEST, BEST_FIRST, BEST_EXTRA = 1, 2, 4, 8, 16
+# Flagi strzału (bity 4-5: odcinek blokady)
+BLOCKED, HAS_CUSHION, HAS_FIRST_BALL, HAS_BLOCKER = 1, 2, 4, 8
+SEGMENTS = (None, "cue", "target")
+# Flagi bili
+STATIC, HAS_STATIC = 1, 2
+
+SHOT_TYPES = ("direct", "bank", "kick", "combination")
+OTHER_CLASS = 255
+NO_PROBABILITY = 65535
+_CLASS_IDS = {name: i for i, name in enumerate(COLOR_NAMES)}
+_INT16 = (-32768, 32767)
+
+def available_formats():
+    """Typy mediów obsługiwane przez serwer (JSON pierwszy - domyślny przy Accept: */* i bez nagłówka)."""
+    return (JSON, PACKED) + ((MSGPACK,) if msgpack is not None else ())
+
+def negotiate(accept):
+    """Format odpowiedzi dla nagłówka Accept (werkzeug MIMEAccept albo tekst). Nieznane typy => JSON."""
+    if isinstance(accept, str):
+        from werkzeug.datastructures import MIMEAccept
+        from werkzeug.http import parse_accept_header
+        accept = parse_accept_header(accept, MIMEAccept)
+    return accept.best_match(available_formats(), default=JSON) or JSON
+
+def _i16(value):
+    return min(max(int(round(float(value))), _INT16[0]), _INT16[1])
+
+def _pack_ball(out, ball, index, classes):
+    cls = ball.get('class', '')
+    cls_id = _CLASS_IDS.get(cls.lower(), OTHER_CLASS) if isinstance(cls, str) else OTHER_CLASS
+    # nazwa spoza COLOR_NAMES albo w innej postaci niż "Red" (np. "ignore" od klienta) - w reszcie JSON
+    if cls_id == OTHER_CLASS or cls != COLOR_NAMES[cls_id].capitalize():
+        classes[index] = cls
+    flags = (HAS_STATIC | (STATIC if ball["static"] else 0)) if "static" in ball else 0
+    out.append(BALL.pack(_i16(ball.get('x', 0)), _i16(ball.get('y', 0)), _i16(ball.get('r', 0)), cls_id,
+                         int(round(min(max(float(ball.get('confidence', 1.0)), 0.0), 1.0) * 255)),
+                         _i16(ball.get('id', -1)), _i16(ball.get('track_id', -1)), flags))
+
+def _unpack_ball(buf, offset, index, classes):
+    x, y, r, cls_id, conf, ball_id, track_id, flags = BALL.unpack_from(buf, offset)
+    cls = classes.get(index)
+    if cls is None:
+        cls = COLOR_NAMES[cls_id].capitalize() if cls_id < len(COLOR_NAMES) else ""
+    ball = {"x": x, "y": y, "r": r, "class": cls, "confidence": round(conf / 255.0, 3)}
+    if ball_id >= 0:
+        ball["id"] = ball_id
+    if track_id >= 0:
+        ball["track_id"] = track_id
+    if flags & HAS_STATIC:
+        ball["static"] = bool(flags & STATIC)
+    return ball, offset + BALL.size
+
+# Pola strzału w stałym układzie SHOT
+_SHOT_FIELDS = {"target_ball", "pocket", "angle", "shot_lines", "ghost_ball", "blocked", "blocked_by",
+                "blocked_segment", "shot_type", "probability", "cushion", "first_ball"}
+
+def _pack_shot(out, shot, index, classes, extras):
+    flags = BLOCKED if shot.get("blocked") else 0
+    flags |= HAS_CUSHION if shot.get("cushion") else 0
+    flags |= HAS_FIRST_BALL if shot.get("first_ball") else 0
+    flags |= HAS_BLOCKER if shot.get("blocked_by") else 0
+    segment = shot.get("blocked_segment")
+    flags |= (SEGMENTS.index(segment) if segment in SEGMENTS else 0) << 4
+    probability = shot.get("probability")
+    shot_type = shot.get("shot_type", "direct")
+    out.append(SHOT.pack(SHOT_TYPES.index(shot_type) if shot_type in SHOT_TYPES else 0, flags,
+                         min(int(round(float(shot.get("angle", 0.0)) * 100)), 65535),
+                         NO_PROBABILITY if probability is None else int(round(float(probability) * (NO_PROBABILITY - 1)))))
+    _pack_ball(out, shot["target_ball"], f"{index}.target_ball", classes)
+    out.append(POINT.pack(_i16(shot["pocket"]['x']), _i16(shot["pocket"]['y'])))
+    ghost = shot["ghost_ball"]
+    out.append(CIRCLE.pack(_i16(ghost["center"]['x']), _i16(ghost["center"]['y']), _i16(ghost["radius"])))
+    if flags & HAS_CUSHION:
+        out.append(POINT.pack(_i16(shot["cushion"]['x']), _i16(shot["cushion"]['y'])))
+    if flags & HAS_FIRST_BALL:
+        _pack_ball(out, shot["first_ball"], f"{index}.first_ball", classes)
+    if flags & HAS_BLOCKER:
+        _pack_ball(out, shot["blocked_by"], f"{index}.blocked_by", classes)
+    lines = shot.get("shot_lines") or []
+    out.append(COUNT.pack(len(lines)))
+    out.extend(SEGMENT.pack(_i16(ln["start"]['x']), _i16(ln["start"]['y']), _i16(ln["end"]['x']), _i16(ln["end"]['y']))
+               for ln in lines)
+    # pola spoza stałego układu (np. "simulation") - w reszcie JSON
+    extra = {k: v for k, v in shot.items() if k not in _SHOT_FIELDS or (k == "probability" and v is None)}
+    if extra:
+        extras[str(index)] = extra
+
+def _unpack_shot(buf, offset, index, classes, extras):
+    shot_type, flags, angle, probability = SHOT.unpack_from(buf, offset)
+    offset += SHOT.size
+    target, offset = _unpack_ball(buf, offset, f"{index}.target_ball", classes)
+    px, py = POINT.unpack_from(buf, offset)
+    gx, gy, gr = CIRCLE.unpack_from(buf, offset + POINT.size)
+    offset += POINT.size + CIRCLE.size
+    shot = {"target_ball": target, "pocket": {"x": px, "y": py}, "angle": angle / 100.0,
+            "shot_lines": [], "ghost_ball": {"center": {"x": gx, "y": gy}, "radius": gr},
+            "blocked": bool(flags & BLOCKED), "blocked_by": None, "blocked_segment": SEGMENTS[(flags >> 4) & 3],
+            "shot_type": SHOT_TYPES[shot_type]}
+    if probability != NO_PROBABILITY:
+        shot["probability"] = round(probability / (NO_PROBABILITY - 1), 4)
+    if flags & HAS_CUSHION:
+        cx, cy = POINT.unpack_from(buf, offset)
+        shot["cushion"] = {"x": cx, "y": cy}
+        offset += POINT.size
+    if flags & HAS_FIRST_BALL:
+        shot["first_ball"], offset = _unpack_ball(buf, offset, f"{index}.first_ball", classes)
+    if flags & HAS_BLOCKER:
+        shot["blocked_by"], offset = _unpack_ball(buf, offset, f"{index}.blocked_by", classes)
+    (count,) = COUNT.unpack_from(buf, offset)
+    offset += COUNT.size
+    for _ in range(count):
+        x0, y0, x1, y1 = SEGMENT.unpack_from(buf, offset)
+        shot["shot_lines"].append({"start": {"x": x0, "y": y0}, "end": {"x": x1, "y": y1}})
+        offset += SEGMENT.size
+    shot.update(extras.get(str(index), {}))
+    return shot, offset
+
+def encode_packed(payload):
+    """Odpowiedź (dict z "balls" / "shots" / "best_shot" i dowolnymi innymi polami) -> bytes w układzie packed."""
+    rest = dict(payload)
+    balls = rest.pop("balls", None)
+    shots = rest.pop("shots", None)
+    flags = (HAS_BALLS if isinstance(balls, list) else 0) | (HAS_SHOTS if isinstance(shots, list) else 0)
+    balls, shots = balls if isinstance(balls, list) else [], list(shots) if isinstance(shots, list) else []
+    n_shots = len(shots)
+    if "best_shot" in rest:
+        best = rest.pop("best_shot")
+        flags |= HAS_BEST
+        if best is not None and shots and best is shots[0]:
+            flags |= BEST_FIRST
+        elif best is not None:
+            flags |= BEST_EXTRA
+            shots.append(best)
+    if len(balls) > 65535 or n_shots > 65535:
+        raise ValueError("Za dużo bil lub strzałów dla formatu packed")
+
+    body, classes, extras = [], {}, {}
+    for i, ball in enumerate(balls):
+        _pack_ball(body, ball, str(i), classes)
+    for i, shot in enumerate(shots):
+        _pack_shot(body, shot, i, classes, extras)
+    if classes:
+        rest["ball_classes"] = classes
+    if extras:
+        rest["shot_extras"] = extras
+    tail = json.dumps(rest, ensure_ascii=False, separators=(",", ":")).encode("utf-8") if rest else b""
+    return b"".join([HEADER.pack(MAGIC, VERSION, flags, len(balls), n_shots), TAIL.pack(len(tail)), tail] + body)
+
+def decode_packed(data):
+    """Odwrotność encode_packed (klienci w Pythonie, body requestu). ValueError przy złym formacie."""
+    try:
+        magic, version, flags, n_balls, n_shots = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Nieznany format lub wersja danych packed")
+        (length,) = TAIL.unpack_from(data, HEADER.size)
+        offset = HEADER.size + TAIL.size
+        rest = json.loads(bytes(data[offset:offset + length]).decode("utf-8")) if length else {}
+        offset += length
+        classes = rest.pop("ball_classes", {})
+        extras = rest.pop("shot_extras", {})
+        balls = []
+        for i in range(n_balls):
+            ball, offset = _unpack_ball(data, offset, str(i), classes)
+            balls.append(ball)
+        shots = []
+        for i in range(n_shots + (1 if flags & BEST_EXTRA else 0)):
+            shot, offset = _unpack_shot(data, offset, i, classes, extras)
+            shots.append(shot)
+    except (struct.error, IndexError, UnicodeDecodeError, AttributeError) as e:
+        raise ValueError(f"Niepoprawne dane packed: {e}")
+    payload = {}
+    if flags & HAS_BALLS:
+        payload["balls"] = balls
+    if flags & HAS_BEST:
+        payload["best_shot"] = shots[0] if flags & BEST_FIRST else shots[-1] if flags & BEST_EXTRA else None
+    if flags & HAS_SHOTS:
+        payload["shots"] = shots[:n_shots]
+    payload.update(rest)
+    return payload
+
+def encode(payload, media_type):
+    """Odpowiedź w wybranym formacie (JSON, PACKED, MSGPACK) -> bytes."""
+    if media_type == PACKED:
+        return encode_packed(payload)
+    if media_type == MSGPACK and msgpack is not None:
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def decode(data, media_type):
+    """Body requestu w formacie media_type -> dict. ValueError przy złych danych lub niedostępnym formacie."""
+    if media_type == PACKED:
+        return decode_packed(data)
+    if media_type == MSGPACK:
+        if msgpack is None:
+            raise ValueError("Format msgpack niedostępny (brak pakietu msgpack)")
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except Exception as e:
+            raise ValueError(f"Niepoprawne dane msgpack: {e}")
+    return json.loads(data)
@@ -0,0 +1,220 @@
+import os
+import time
+import atexit
+import threading
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+from config import DETECT_WORKERS, DETECT_QUEUE_SIZE, DETECT_TIMEOUT, SESSION_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+class PoolSaturated(Exception):
+    """Wszystkie miejsca w kolejce detekcji są zajęte - klient powinien spróbować ponownie (HTTP 429)."""
+
+class PoolTimeout(Exception):
+    """Worker nie skończył klatki w DETECT_TIMEOUT sekund - pula jest uruchamiana od nowa (HTTP 503)."""
+
+# --- strona workera -------------------------------------------------------
+
+# Stan procesu workera: podłączone bloki pamięci współdzielonej i lokalne kopie sesji
+# (z policzonymi mapami remap) - żeby nie odtwarzać ich przy każdej klatce.
+_attached = OrderedDict()
+_worker_sessions = OrderedDict()
+
+def _init_worker():
+    """Inicjalizacja procesu workera: CLAHE, LUT gamma i pierwsze przejście HoughCircles."""
+    from image_processing import warm_up
+    warm_up()
+
+def _attach(name, max_attached):
+    shm = _attached.get(name)
+    if shm is None:
+        shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = shm
+        # blok mógł zostać zastąpiony większym - stare podłączenia zamykamy
+        while len(_attached) > max_attached:
+            _attached.popitem(last=False)[1].close()
+    else:
+        _attached.move_to_end(name)
+    return shm
+
+def _local_session(session):
+    if session is None:
+        return None
+    cached = _worker_sessions.get(session.session_id)
+    if cached is None:
+        cached = session
+        _worker_sessions[session.session_id] = cached
+        while len(_worker_sessions) > SESSION_MAX_ENTRIES:
+            _worker_sessions.popitem(last=False)
+    else:
+        _worker_sessions.move_to_end(session.session_id)
+    return cached
+
+def _detect_in_worker(name, shape, dtype, max_attached, session, kwargs):
+    """Detekcja na klatce z pamięci współdzielonej. Zwraca (wynik detect_all_balls, czasy etapów)."""
+    from image_processing import detect_all_balls
+    from timing import StageTimer
+    shm = _attach(name, max_attached)
+    img = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    timer = StageTimer()
+    try:
+        result = detect_all_balls(img, session=_local_session(session), timer=timer, **kwargs)
+    finally:
+        # widok na bufor nie może przeżyć zamknięcia bloku
+        del img
+    return result, timer.stages
+
+# --- strona serwera -------------------------------------------------------
+
+class _FrameSlot:
+    """Blok pamięci współdzielonej na jedną klatkę w locie; powiększany, gdy klatka się nie mieści."""
+
+    def __init__(self):
+        self.shm = None
+
+    def write(self, img):
+        img = np.ascontiguousarray(img)
+        if self.shm is None or self.shm.size < img.nbytes:
+            self.release()
+            self.shm = shared_memory.SharedMemory(create=True, size=max(img.nbytes, 1))
+        np.ndarray(img.shape, dtype=img.dtype, buffer=self.shm.buf)[...] = img
+        return self.shm.name, img.shape, img.dtype.str
+
+    def release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+class DetectionPool:
+    """
+    Pula procesów do detekcji bil (detect_all_balls) poza wątkiem requestu Flask.
+    Zdekodowana klatka trafia do workera przez pamięć współdzieloną (bez pickle obrazu),
+    a przez kolejkę idą tylko nazwa bloku, kształt, sesja (bez map) i parametry.
+    Liczba klatek w locie jest ograniczona do queue_size - gdy wszystkie miejsca są zajęte,
+    detect() od razu rzuca PoolSaturated (backpressure zamiast rosnącej kolejki).
+    Martwy worker (OOM, awaria OpenCV) psuje cały ProcessPoolExecutor - detect() buduje wtedy
+    nowy executor i ponawia klatkę raz. Worker, który nie oddał wyniku w timeout sekund, jest
+    zabijany razem z pulą (PoolTimeout), żeby nie blokował wątku requestu i miejsca w kolejce.
+    """
+
+    def __init__(self, workers, queue_size=None, timeout=DETECT_TIMEOUT):
+        self.workers = max(1, int(workers))
+        self.queue_size = max(self.workers, int(queue_size or 2 * self.workers))
+        self.timeout = timeout or None
+        self._executor = self._new_executor()
+        self._free = [_FrameSlot() for _ in range(self.queue_size)]
+        self._lock = threading.Lock()
+        logger.info(f"Pula detekcji: {self.workers} procesów, maks. {self.queue_size} klatek w locie")
+
+    def _new_executor(self):
+        # spawn - bezpieczny przy wielowątkowym serwerze (fork kopiowałby stan wątków i locków)
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker)
+
+    def _restart(self, broken, kill=False):
+        """
+        Zastępuje executor broken nowym (raz, nawet gdy awarię zauważy kilka wątków naraz).
+        kill - zabija procesy starego executora (zawieszony worker nie skończy sam).
+        """
+        with _pool_lock:
+            if self._executor is not broken:
+                return
+            logger.warning("Pula detekcji uszkodzona - uruchamiam procesy od nowa")
+            self._executor = self._new_executor()
+        if kill:
+            # ProcessPoolExecutor nie ma publicznego sposobu na przerwanie działającego zadania
+            for process in list((getattr(broken, "_processes", None) or {}).values()):
+                process.terminate()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, *args):
+        """Wynik _detect_in_worker; po awarii procesu puli - nowy executor i jedna ponowna próba."""
+        for attempt in range(2):
+            executor = self._executor
+            try:
+                return executor.submit(_detect_in_worker, *args).result(timeout=self.timeout)
+            except BrokenProcessPool:
+                self._restart(executor)
+                if attempt:
+                    raise
+                logger.warning("Worker detekcji padł - ponawiam klatkę w nowej puli")
+            except FutureTimeout:
+                self._restart(executor, kill=True)
+                raise PoolTimeout(f"Detekcja przekroczyła {self.timeout:g} s")
+
+    def _acquire(self):
+        with self._lock:
+            if not self._free:
+                raise PoolSaturated("Kolejka detekcji pełna")
+            return self._free.pop()
+
+    def _release(self, slot):
+        with self._lock:
+            self._free.append(slot)
+
+    @property
+    def in_flight(self):
+        """Liczba klatek aktualnie w kolejce lub w trakcie detekcji."""
+        with self._lock:
+            return self.queue_size - len(self._free)
+
+    def warm_up(self):
+        """Uruchamia wszystkie procesy od razu (zamiast przy pierwszych requestach)."""
+        executor = self._executor
+        try:
+            for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+                future.result(timeout=self.timeout)
+        except BrokenProcessPool:
+            self._restart(executor)
+
+    def detect(self, img, session=None, timer=None, **kwargs):
+        """
+        Odpowiednik detect_all_balls(img, session=session, ...) wykonywany w procesie workera.
+        img - zdekodowany obraz BGR. Czasy etapów z workera są dopisywane do timer,
+        a czas kolejki + IPC jako etap "pool".
+        """
+        slot = self._acquire()
+        start = time.perf_counter()
+        try:
+            name, shape, dtype = slot.write(img)
+            result, stages = self._submit(name, shape, dtype, 2 * self.queue_size, session, kwargs)
+        finally:
+            self._release(slot)
+        if timer is not None:
+            elapsed = (time.perf_counter() - start) * 1000.0
+            for stage, ms in stages.items():
+                timer.add(stage, ms)
+            timer.add("pool", max(0.0, elapsed - sum(stages.values())))
+        return result
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            for slot in self._free:
+                slot.release()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def pool_in_flight():
+    """Głębokość kolejki puli (0, jeśli pula jeszcze nie powstała) - bez tworzenia puli."""
+    return _pool.in_flight if _pool is not None else 0
+
+def get_pool():
+    """Wspólna pula detekcji (tworzona przy pierwszym użyciu) albo None, jeśli DETECT_WORKERS = 0."""
+    global _pool
+    if DETECT_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = DetectionPool(DETECT_WORKERS, DETECT_QUEUE_SIZE)
+                atexit.register(_pool.shutdown)
+    return _pool